@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'filters_tutorial_back.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after the setup done by get_asgi_application()
+from filters_tutorial_back.common.async_views import AsyncListView, EventStreamView, PathRouter  # noqa: E402
+from order.signals import ORDERS_CHANNEL  # noqa: E402
+from order.views import OrderListCreateAPIView  # noqa: E402
+
+application = PathRouter(django_application, {
+    '/async/orders/': AsyncListView(OrderListCreateAPIView),
+    # Server-Sent Events of the orders matching the filters of the query string
+    '/stream/orders/': EventStreamView(OrderListCreateAPIView, ORDERS_CHANNEL),
+})
@@ -1,35 +1,593 @@
+import calendar
+import hashlib
 import json
 import logging
+import os
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
-from django.db.models import Q
+from django.db import IntegrityError, connections
+from django.db.models import Count, DecimalField, F, Max, Q, Sum
 from django.db.transaction import atomic
-from django.http import Http404
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import serializers
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
-from rest_framework.generics import CreateAPIView, ListAPIView, RetrieveUpdateDestroyAPIView
+from rest_framework.generics import CreateAPIView, ListAPIView, RetrieveAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.response import Response
 
+from filters_tutorial_back.common import routers
 from filters_tutorial_back.common.cons import ERRORS, DATA, MESSAGE, FILTER_PREFIX, ERROR_TYPE, VALIDATION_ERROR, HTTP_404, INTEGRITY_ERROR, INVALID_DATA, OTHER
+from filters_tutorial_back.common.cache import get_generation, make_cache_key, normalize_cleaned_data, normalize_query_params
 from filters_tutorial_back.common.exceptions import APIException202, InvalidData
+from filters_tutorial_back.common.export import EXPORT_FORMATS
+from filters_tutorial_back.common.jobs import REQUEST_JOB, get_current_job, get_request_params, report_progress
+from filters_tutorial_back.common.pagination import KeysetPagination, Pagination
+from filters_tutorial_back.common.profiling import TABLE_SCAN_RE, Profile, explain, timer
+from filters_tutorial_back.common.queryset import optimize_queryset
+from filters_tutorial_back.common.serializers import Fieldset, SparseFieldsetMixin
+from filters_tutorial_back.common.signals import BULK_CREATE, BULK_DELETE, BULK_UPDATE, post_bulk_change
 
 logger = logging.getLogger(__name__)
 
 
-class CustomListAPIView(ListAPIView):
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified validators for GET responses, answered with 304 Not Modified
+    (without querying the rows or serializing them) when the client's copy is current.
+    Validators are a tuple (etag, last modified timestamp), both None when disabled.
+    """
+    # DateTimeField set on every change of a row (auto_now), None disables the validators
+    last_modified_field = None
+
+    @staticmethod
+    def make_validators(last_modified, *parts):
+        etag = '"{}"'.format(hashlib.md5(repr((last_modified,) + parts).encode('utf-8')).hexdigest())
+        return etag, calendar.timegm(last_modified.utctimetuple()) if last_modified is not None else None
+
+    def get_not_modified_response(self, request, validators):
+        etag, last_modified = validators
+        if etag is None and last_modified is None:
+            return None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        return self.set_validators(response, validators) if response is not None else None
+
+    @staticmethod
+    def set_validators(response, validators):
+        etag, last_modified = validators
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            if etag is not None:
+                response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class ReplicaReadMixin:
+    """
+    GET requests read from a replica database, unless the client is pinned to the primary after a write.
+    """
+    replica_methods = ('GET', 'HEAD')
+
+    def initial(self, request, *args, **kwargs):
+        if request.method in self.replica_methods and not routers.is_pinned(request):
+            routers.activate_replica()
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        routers.deactivate_replica()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class BackgroundJobMixin:
+    """
+    Requests sent with ?background=1 are stored as a job and answered at once with 202 Accepted
+    and the job (as APIException202 is), a `run_jobs` worker replays them (see common.jobs).
+    """
+    background_query_param = 'background'
+    job_model = None
+    job_serializer_class = None
+
+    def is_background_request(self, request):
+        return self.job_model is not None and request.query_params.get(self.background_query_param) in ('1', 'true')
+
+    def get_background_response(self, request):
+        params = get_request_params(request, exclude=[self.background_query_param])
+        job = self.job_model.enqueue(REQUEST_JOB, params, user=request.user)
+        data = self.job_serializer_class(job, context=self.get_serializer_context()).data
+        return Response({DATA: data, MESSAGE: 'Puna u shtua në radhë'}, status=status.HTTP_202_ACCEPTED)
+
+
+class RequestFilterSetMixin:
+    def get_request_filterset(self, request, queryset=None):
+        """
+        The FilterSet filter_queryset() applies to the request, None when the view has none.
+        """
+        for backend in self.filter_backends:
+            if hasattr(backend, 'get_filterset'):
+                return backend().get_filterset(request, self.get_queryset() if queryset is None else queryset, self)
+        return None
+
+
+class CustomListAPIView(RequestFilterSetMixin, ReplicaReadMixin, ConditionalGetMixin, ListAPIView):
     queryset = None
     serializer_class = None
     filter_serializer_class = None
     filter_map = {}
     queryset_kwargs = {}
+    keyset_pagination_class = KeysetPagination
+    # Models whose writes invalidate cached results of this view, list responses are cached only when set
+    cache_models = []
+    response_cache_timeout = getattr(settings, 'LIST_RESPONSE_CACHE_TIMEOUT', 0)
+    validators_cache_timeout = getattr(settings, 'LIST_VALIDATORS_CACHE_TIMEOUT', 60)
+    # ValuesSerializer used for GET instead of serializer_class
+    values_serializer_class = None
+    # Sparse fieldsets, for serializers using SparseFieldsetMixin: ?fields=id,customer&expand=user
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    # ?explain=1 returns the queries of the list and their plans, when QUERY_EXPLAIN_ENABLED (default: DEBUG)
+    explain_query_param = 'explain'
+    explain = False
+
+    @property
+    def paginator(self):
+        """
+        Clients opt in to keyset pagination by sending the cursor parameter.
+        """
+        if not hasattr(self, '_paginator'):
+            keyset_class = self.keyset_pagination_class
+            if keyset_class is not None and keyset_class.cursor_query_param in self.request.query_params:
+                self._paginator = keyset_class()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
+    def use_values_serializer(self):
+        return self.values_serializer_class is not None and self.request.method == 'GET'
+
+    def get_serializer_class(self):
+        if self.use_values_serializer():
+            return self.values_serializer_class
+        return super().get_serializer_class()
+
+    def get_fieldset(self):
+        """
+        Fieldset asked for with the `fields` and `expand` parameters, None for the full representation.
+        Unknown names are a validation error.
+        """
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = None
+            serializer_class = self.get_serializer_class()
+            if self.use_values_serializer():
+                serializer_class = serializer_class.model_serializer_class
+            fields = self.get_query_param_list(self.fields_query_param)
+            expand = self.get_query_param_list(self.expand_query_param) or []
+            if issubclass(serializer_class, SparseFieldsetMixin) and (fields is not None or expand):
+                all_fields = serializer_class().fields
+                errors = {}
+                unknown = [name for name in fields or () if name not in all_fields]
+                if unknown:
+                    errors[self.fields_query_param] = ['Unknown field {}'.format(', '.join(unknown))]
+                unknown = [name for name in expand if not isinstance(all_fields.get(name), serializers.BaseSerializer)]
+                if unknown:
+                    errors[self.expand_query_param] = ['Can not expand {}'.format(', '.join(unknown))]
+                if errors:
+                    raise ValidationError(errors)
+                self._fieldset = Fieldset(None if fields is None else tuple(sorted(set(fields))), tuple(sorted(set(expand))))
+        return self._fieldset
+
+    def get_query_param_list(self, name):
+        """
+        Comma separated values of a parameter, None when it is not sent.
+        """
+        if name not in self.request.query_params:
+            return None
+        return [value.strip() for value in self.request.query_params[name].split(',') if value.strip()]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fieldset'] = self.get_fieldset()
+        return context
+
+    def get_queryset(self, serialized=True):
+        """
+        Join or prefetch every relation the serializer reads, so a page is served
+        with a constant number of queries regardless of its size.
+        With a values serializer only the serialized columns are fetched, as plain rows.
+        A sparse fieldset trims the columns and joins to the fields it asks for.
+        Not serialized, the rows are left as they are, e.g. to be counted without those joins.
+        """
+        queryset = super().get_queryset()
+        if not serialized:
+            return queryset
+        if self.use_values_serializer():
+            return queryset.values(*self.values_serializer_class.get_values_fields(self.get_fieldset()))
+        return optimize_queryset(queryset, self.get_serializer_class(), self.get_fieldset())
+
+    def list(self, request, *args, **kwargs):
+        if self.is_explain_request(request):
+            return self.get_explain_response(request)
+        key = self.get_response_cache_key(request)
+        response = self.get_cached_list_response(request, key)
+        if response is not None:
+            return response
+        validators = self.get_list_validators(request)
+        response = self.get_not_modified_response(request, validators)
+        if response is None:
+            response = self.set_validators(self.get_list_response(request), validators)
+            self.cache_list_response(key, response, validators)
+        return response
+
+    def is_explain_request(self, request):
+        if request.query_params.get(self.explain_query_param) not in ('1', 'true'):
+            return False
+        return getattr(settings, 'QUERY_EXPLAIN_ENABLED', settings.DEBUG)
+
+    def get_explain_response(self, request):
+        """
+        Runs the list without the response, count and validator caches and returns every query
+        it executed with the database's plan for it. Steps reading a whole table are listed in `table_scans`.
+        """
+        self.explain = True
+        connection = connections[self.get_queryset().db]
+        profile = Profile(capture_sql=True)
+        with connection.execute_wrapper(profile):
+            response = self.get_list_response(request)
+        queries = []
+        for sql, params, duration in profile.queries:
+            plan = explain(connection, sql, params)
+            queries.append({
+                'sql': sql,
+                'params': list(params or ()),
+                'ms': round(duration * 1000, 3),
+                'plan': plan,
+                'table_scans': [step for step in plan if TABLE_SCAN_RE.search(step)],
+            })
+        filterset = self.get_request_filterset(request)
+        return Response({DATA: {
+            'status': response.status_code,
+            'filters': list(getattr(filterset, 'shape', ())),
+            'queries': queries,
+        }})
+
+    def get_cached_list_response(self, request, key):
+        cached = cache.get(key) if key is not None else None
+        if cached is None:
+            return None
+        data, validators = cached
+        return self.get_not_modified_response(request, validators) or self.set_validators(Response(data, headers={'X-Cache': 'HIT'}), validators)
+
+    def cache_list_response(self, key, response, validators):
+        if key is None:
+            return
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, (response.data, validators), self.response_cache_timeout)
+        response['X-Cache'] = 'MISS'
+
+    def get_list_validators(self, request):
+        """
+        Validators of a list response: the newest `last_modified_field` and the row count of the
+        filtered set, and the query parameters. The aggregate query is cached until cache_models
+        are written, under the key parts of the paginator's count, whose cache it fills as well.
+        Lists paginated without counting (keyset pages, estimated counts) have none, deleted rows
+        would go unnoticed.
+        """
+        if self.last_modified_field is None:
+            return None, None
+        paginator = self.paginator
+        if paginator is not None and not (isinstance(paginator, Pagination) and paginator.counts_exactly(request)):
+            return None, None
+        # values() keeps the joins of the related columns it selects, even in an aggregate
+        queryset = self.get_queryset(serialized=False)
+        ignored = getattr(paginator, 'count_ignored_params', ())
+        key = make_cache_key(
+            'validators', request.path, queryset.db, get_generation(*self.cache_models or [queryset.model]),
+            normalize_query_params(request.query_params, exclude=ignored)
+        )
+        stats = cache.get(key)
+        if stats is None:
+            with timer('validators'):
+                stats = self.filter_queryset(queryset).order_by().aggregate(last_modified=Max(self.last_modified_field), count=Count('pk'))
+            cache.set(key, stats, self.validators_cache_timeout)
+            if paginator is not None:
+                paginator.cache_count(request, self, queryset, stats['count'])
+        return self.make_validators(stats['last_modified'], stats['count'], request.path, normalize_query_params(request.query_params))
+
+    def get_list_response(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        with timer('page'):
+            page = self.paginate_queryset(queryset)
+        with timer('serialize'):
+            data = self.get_serializer(page if page is not None else queryset, many=True).data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def get_response_cache_key(self, request):
+        """
+        Key made of the validated filter values (so equivalent query strings share an entry),
+        the remaining parameters such as page and ordering, and the generations of cache_models.
+        Returns None when the response should not be cached.
+        """
+        if not self.cache_models or not self.response_cache_timeout:
+            return None
+        filters = []
+        filter_names = ()
+        filterset = self.get_request_filterset(request)
+        if filterset is not None:
+            if not filterset.is_valid():
+                return None
+            filters = normalize_cleaned_data(filterset.form.cleaned_data)
+            filter_names = tuple(self.filterset_class.base_filters)
+        params = [
+            (key, values) for key, values in normalize_query_params(request.query_params)
+            if not any(key == name or key.startswith(name + '_') for name in filter_names)
+        ]
+        return make_cache_key('response', request.path, self.get_queryset().db, get_generation(*self.cache_models), filters, params)
+
+
+class CustomExportAPIView(BackgroundJobMixin, CustomListAPIView):
+    """
+    Streams the filtered and ordered queryset of a list view as a file, in any of the
+    EXPORT_FORMATS given by the `file_format` url kwarg. Rows are read with a server side
+    iterator and written in chunks, so memory stays flat regardless of the row count.
+    """
+    pagination_class = None
+    export_filename = 'export'
+    export_chunk_size = 2000
+
+    def list(self, request, *args, **kwargs):
+        file_format = kwargs.get('file_format')
+        if file_format not in EXPORT_FORMATS:
+            response_data = {
+                ERROR_TYPE: HTTP_404,
+                ERRORS: 'Unknown format {}'.format(file_format),
+                MESSAGE: 'Formati nuk ekziston'
+            }
+            return Response(response_data, status=status.HTTP_404_NOT_FOUND)
+        if self.is_background_request(request):
+            return self.get_background_response(request)
+        writer, content_type = EXPORT_FORMATS[file_format]
+        queryset = self.filter_queryset(self.get_queryset())
+        response = StreamingHttpResponse(writer(self.get_export_rows(queryset)), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(self.export_filename, file_format)
+        return response
+
+    def get_export_rows(self, queryset):
+        serializer_class = self.get_serializer_class()
+        rows = queryset.iterator(chunk_size=self.export_chunk_size)
+        if get_current_job() is not None:
+            rows = self.report_export_progress(rows, queryset.count())
+        if self.use_values_serializer():
+            serializer = serializer_class(context=self.get_serializer_context())
+            return (serializer.to_representation(row) for row in rows)
+        context = self.get_serializer_context()
+        return (serializer_class(instance, context=context).data for instance in rows)
+
+    def report_export_progress(self, rows, total):
+        report_progress(0, total)
+        for index, row in enumerate(rows, 1):
+            yield row
+            if index % self.export_chunk_size == 0:
+                report_progress(index, total)
+
+
+class CustomChangesAPIView(CustomListAPIView):
+    """
+    Changes feed for delta sync: rows created or updated (soft deletes included) and rows deleted
+    after a watermark, oldest first, as `upserts` in the list representation and `deletes` as ids.
+    The returned `watermark` (time and id of the last change) is sent back as `since` for the next
+    batch, until `has_more` is false. Without `since` all rows are sent, for the first sync.
+    Both sources are read in keyset order on a (time, id) index: `last_modified_field` of the rows,
+    `tombstone_time_field` of `tombstone_model`, which records the id of every deleted row.
+    """
+    pagination_class = None
+    # a filtered feed could not tell rows leaving the filter
+    filter_backends = []
+    watermark_query_param = 'since'
+    page_size_query_param = 'page_size'
+    page_size = 500
+    max_page_size = 5000
+    tombstone_model = None
+    tombstone_id_field = 'object_id'
+    tombstone_time_field = 'date_deleted'
+    # Changes of the last seconds are held back: a transaction committing after a later one would
+    # otherwise land behind watermarks already handed out, and be skipped
+    settle_seconds = getattr(settings, 'DELTA_SYNC_SETTLE_SECONDS', 5)
+    # Tombstones are kept this long (see the prune job), clients not caught up since have to sync from the start
+    tombstone_days = getattr(settings, 'DELTA_SYNC_TOMBSTONE_DAYS', 30)
+
+    def list(self, request, *args, **kwargs):
+        position, synced = self.decode_watermark(request)
+        if synced is not None and synced < timezone.now() - timedelta(days=self.tombstone_days):
+            response_data = {
+                ERROR_TYPE: INVALID_DATA,
+                ERRORS: 'Watermark is older than the deletes kept, sync again without {}'.format(self.watermark_query_param),
+                MESSAGE: 'Sinkronizoni përsëri nga fillimi'
+            }
+            return Response(response_data, status=status.HTTP_410_GONE)
+        limit = self.get_page_size(request)
+        horizon = timezone.now() - timedelta(seconds=self.settle_seconds)
+        queryset = self.get_queryset()
+        pk_name = queryset.model._meta.pk.name
+        if queryset.query.values_select:
+            # rows are dicts, the watermark values have to be part of them
+            queryset = queryset.values(*dict.fromkeys(queryset.query.values_select + (self.last_modified_field, pk_name)))
+        with timer('changes'):
+            changes = [
+                ((KeysetPagination.get_value(row, self.last_modified_field), KeysetPagination.get_value(row, pk_name)), row, True)
+                for row in self.seek(queryset, self.last_modified_field, pk_name, position, horizon, limit)
+            ]
+            if synced is not None:
+                # a first sync has no rows to delete
+                tombstones = self.tombstone_model._default_manager.values_list(self.tombstone_time_field, self.tombstone_id_field)
+                changes += [(key, key[1], False) for key in self.seek(tombstones, self.tombstone_time_field, self.tombstone_id_field, position, horizon, limit)]
+        changes.sort(key=lambda change: change[0])
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        if changes:
+            position = changes[-1][0]
+        # once caught up, the client has every delete up to the horizon
+        synced = horizon if not has_more or synced is None else synced
+        with timer('serialize'):
+            upserts = self.get_serializer([row for key, row, upsert in changes if upsert], many=True).data
+        return Response({DATA: {
+            'upserts': upserts,
+            'deletes': [pk for key, pk, upsert in changes if not upsert],
+            'watermark': self.encode_watermark(position, synced),
+            'has_more': has_more,
+        }})
+
+    @staticmethod
+    def seek(queryset, time_field, id_field, watermark, horizon, limit):
+        """
+        The first limit + 1 rows after the watermark. The range on the time column keeps the
+        index usable, the OR only decides between rows sharing the watermark's time.
+        """
+        queryset = queryset.filter(**{time_field + '__lte': horizon}).order_by(time_field, id_field)
+        if watermark is not None:
+            time, pk = watermark
+            queryset = queryset.filter(**{time_field + '__gte': time}).filter(Q(**{time_field + '__gt': time}) | Q(**{id_field + '__gt': pk}))
+        return list(queryset[:limit + 1])
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def decode_watermark(self, request):
+        """
+        (time, id) of the last change sent, None before any; and the time up to which the client
+        got every delete, None for a first sync.
+        """
+        encoded = request.query_params.get(self.watermark_query_param)
+        if not encoded:
+            return None, None
+        try:
+            watermark = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            field = self.get_queryset().model._meta.get_field(self.last_modified_field)
+            position = (field.to_python(watermark['t']), int(watermark['i'])) if watermark['t'] is not None else None
+            return position, field.to_python(watermark['s'])
+        except Exception:
+            raise ValidationError({self.watermark_query_param: ['Invalid watermark']})
+
+    @staticmethod
+    def encode_watermark(position, synced):
+        # str() keeps the microseconds, DateTimeField.to_python() reads them back
+        time, pk = position or (None, None)
+        watermark = json.dumps({'t': str(time) if time is not None else None, 'i': pk, 's': str(synced)}, separators=(',', ':'))
+        return urlsafe_b64encode(watermark.encode('utf-8')).decode('ascii')
+
+
+# Rows to aggregate: queryset, {group name: lookup or expression}, {'count' / '<field>_sum': aggregate expression}
+AggregateSource = namedtuple('AggregateSource', ['name', 'queryset', 'groups', 'totals'])
+
+
+class CustomAggregateAPIView(CustomListAPIView):
+    """
+    Count, sum and average of `aggregate_fields` over the filtered queryset, grouped by the
+    `group_by` parameter (comma separated names of `aggregate_groups`) in one GROUP BY query.
+    Without `group_by` a single row with the totals is returned.
+    """
+    pagination_class = None
+    # rows are ordered by their groups
+    ordering_fields = []
+    group_by_query_param = 'group_by'
+    # group name -> lookup or expression
+    aggregate_groups = {}
+    aggregate_fields = []
+
+    def get_queryset(self, serialized=True):
+        # rows are aggregated, there is no serializer to optimize for
+        return super(CustomListAPIView, self).get_queryset()
+
+    def get_group_by(self, request):
+        names = [name.strip() for name in request.query_params.get(self.group_by_query_param, '').split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.aggregate_groups]
+        if unknown:
+            raise ValidationError({self.group_by_query_param: ['Unknown group {}, choose from {}'.format(', '.join(unknown), ', '.join(self.aggregate_groups))]})
+        return list(dict.fromkeys(names))
+
+    def get_aggregate_source(self, request, group_by):
+        """
+        Hook for views that can answer some requests from a precomputed summary.
+        """
+        totals = {'count': Count('pk')}
+        totals.update((field + '_sum', Sum(field)) for field in self.aggregate_fields)
+        groups = {name: self.aggregate_groups[name] for name in group_by}
+        return AggregateSource('query', self.filter_queryset(self.get_queryset()), groups, totals)
+
+    def get_list_response(self, request):
+        source = self.get_aggregate_source(request, self.get_group_by(request))
+        with timer('aggregate'):
+            rows = self.aggregate(source)
+        return Response({DATA: rows}, headers={'X-Aggregate-Source': source.name})
+
+    def aggregate(self, source):
+        queryset = source.queryset.order_by()
+        if not source.groups:
+            rows = [queryset.aggregate(**source.totals)]
+        else:
+            # prefixed, so group names may be the names of model fields
+            aliases = {'group_' + name: F(expression) if isinstance(expression, str) else expression for name, expression in source.groups.items()}
+            queryset = queryset.annotate(**aliases).values(*aliases).annotate(**source.totals).order_by(*aliases)
+            rows = [
+                dict({name: row['group_' + name] for name in source.groups}, **{key: row[key] for key in source.totals})
+                for row in queryset
+            ]
+        exponents = self.get_decimal_exponents(source)
+        for row in rows:
+            row['count'] = row['count'] or 0
+            for key, exponent in exponents.items():
+                if row[key] is not None:
+                    row[key] = Decimal(row[key]).quantize(exponent)
+            for field in self.aggregate_fields:
+                row[field + '_avg'] = self.average(row[field + '_sum'], row['count'])
+        return rows
+
+    @staticmethod
+    def get_decimal_exponents(source):
+        """
+        Sums of decimal fields come back unrounded from some backends (SQLite sums floats),
+        they are rounded to the decimal places of their field.
+        """
+        exponents = {}
+        for key, expression in source.totals.items():
+            output_field = expression.resolve_expression(source.queryset.query.clone()).output_field
+            if isinstance(output_field, DecimalField):
+                exponents[key] = Decimal(1).scaleb(-output_field.decimal_places)
+        return exponents
+
+    @staticmethod
+    def average(total, count):
+        if not count or total is None:
+            return None
+        if isinstance(total, Decimal):
+            return (total / count).quantize(Decimal(1).scaleb(total.as_tuple().exponent))
+        return total / count
 
 
 class HRMCreateAPIView(CreateAPIView):
+    # A list payload is validated as a whole and inserted with bulk_create in batches of this size
+    bulk_create_batch_size = getattr(settings, 'BULK_CREATE_BATCH_SIZE', 500)
+    bulk_create_max_items = getattr(settings, 'BULK_CREATE_MAX_ITEMS', 10000)
 
     @atomic
     def create(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            return self.bulk_create(request, *args, **kwargs)
         data = {}
         if 'data' in request.data:  # POST request with FILES
             for key in request.FILES.keys():
@@ -96,6 +654,48 @@ class HRMCreateAPIView(CreateAPIView):
         finally:
             return Response(response_data, status=response_status, headers=response_headers)
 
+    def bulk_create(self, request, *args, **kwargs):
+        """
+        All items are validated before anything is written. Errors are reported per item,
+        keyed by the item's index in the payload, and nothing is inserted.
+        """
+        if len(request.data) > self.bulk_create_max_items:
+            message = 'Maksimumi i lejuar është {} objekte'.format(self.bulk_create_max_items)
+            return Response({ERROR_TYPE: INVALID_DATA, ERRORS: message, MESSAGE: message}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(data=request.data, many=True)
+        try:
+            if not serializer.is_valid():
+                errors = serializer.errors
+                if isinstance(errors, list):
+                    error_dict = {index: ValidationError(item).get_full_details() for index, item in enumerate(errors) if item}
+                    message = ' '.join('[{}] {}'.format(index, get_validation_error_message(item)) for index, item in error_dict.items())
+                else:  # the payload itself is invalid, e.g. empty
+                    error_dict = ValidationError(errors).get_full_details()
+                    message = get_validation_error_message(error_dict)
+                logger.error('Bulk create Error: {}'.format(message))
+                return Response({ERROR_TYPE: VALIDATION_ERROR, ERRORS: error_dict, MESSAGE: message}, status=status.HTTP_400_BAD_REQUEST)
+            with atomic():
+                objs = self.perform_bulk_create(serializer)
+            return Response({DATA: {'created': len(objs)}}, status=status.HTTP_201_CREATED)
+        except IntegrityError as ie:
+            logger.error('{}'.format(ie))
+            response_data = {
+                ERROR_TYPE: INTEGRITY_ERROR,
+                ERRORS: '{}'.format(ie),
+                MESSAGE: 'Gabim në databazë',
+            }
+            return Response(response_data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def perform_bulk_create(self, serializer):
+        model = serializer.child.Meta.model
+        objs = [model(**attrs) for attrs in serializer.validated_data]
+        # Django 3.0 does not cap an explicit batch_size to the backend limits (e.g. SQLite's 500 compound SELECTs)
+        fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        batch_size = min(self.bulk_create_batch_size, max(connections[model.objects.db].ops.bulk_batch_size(fields, objs), 1))
+        objs = model.objects.bulk_create(objs, batch_size=batch_size)
+        post_bulk_change.send(sender=model, action=BULK_CREATE, objs=objs)
+        return objs
+
 
 class CustomListCreateAPIView(HRMCreateAPIView, CustomListAPIView):
     list_read_serializer_class = None
@@ -110,6 +710,8 @@ class CustomListCreateAPIView(HRMCreateAPIView, CustomListAPIView):
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
+            if self.use_values_serializer():
+                return self.values_serializer_class
             if self.list_read_serializer_class is not None:
                 return self.list_read_serializer_class
             assert self.read_serializer_class is not None or self.serializer_class is not None, (self.serializer_error_msg % self.__class__.__name__)
@@ -121,9 +723,18 @@ class CustomListCreateAPIView(HRMCreateAPIView, CustomListAPIView):
         return self.serializer_class
 
 
-class HRMRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
+class BulkSelectionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    data = serializers.DictField(required=False)
+
+
+class HRMRetrieveUpdateDestroyAPIView(BackgroundJobMixin, RequestFilterSetMixin, ReplicaReadMixin, ConditionalGetMixin, RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update or delete an object instance.
+    When routed without the lookup kwarg, PUT/PATCH and DELETE work in bulk on the rows selected
+    by the filter query params and/or the `ids` of the body, with an UPDATE per batch of their ids
+    and without loading instances. PATCH takes the changes under `data`. Models with a `deleted` field are soft deleted.
+    Bulk requests can run as a background job with ?background=1.
     """
     queryset = None
     serializer_class = None
@@ -133,6 +744,8 @@ class HRMRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
     # permission_classes = [IsAuthenticated]
     serializer_error_msg = "'%s' should either include a `serializer_class` attribute, or override the `get_serializer_class()` method."
     delete_obj_id_physical = None
+    # Filters that do not narrow the rows (e.g. picking a table), they alone select nothing in bulk
+    bulk_unselective_filters = []
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -146,9 +759,23 @@ class HRMRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
 
     def retrieve(self, request, *args, **kwargs):
         try:
+            if self.is_bulk_request():
+                raise Http404('Bulk endpoints support only update and delete')
+            if self.last_modified_field is not None and self.is_conditional_request(request):
+                # the timestamp alone decides, the row is only loaded when it changed
+                lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+                row = self.filter_queryset(self.get_queryset()).filter(**lookup).values_list('pk', self.last_modified_field).first()
+                if row is None:
+                    raise Http404('No {} matches the given query.'.format(self.get_queryset().model._meta.object_name))
+                response = self.get_not_modified_response(request, self.get_object_validators(*row))
+                if response is not None:
+                    return response
             instance = self.get_object()
             serializer = self.get_serializer(instance)
-            return Response({DATA: serializer.data})
+            validators = (None, None)
+            if self.last_modified_field is not None:
+                validators = self.get_object_validators(instance.pk, getattr(instance, self.last_modified_field))
+            return self.set_validators(Response({DATA: serializer.data}), validators)
         except Http404 as e:
             response_data = {
                 ERROR_TYPE: HTTP_404,
@@ -158,8 +785,138 @@ class HRMRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
             response_status = status.HTTP_404_NOT_FOUND
             return Response(response_data, status=response_status)
 
+    @staticmethod
+    def is_conditional_request(request):
+        return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+    def get_object_validators(self, pk, last_modified):
+        return self.make_validators(last_modified, pk)
+
+    def is_bulk_request(self):
+        return (self.lookup_url_kwarg or self.lookup_field) not in self.kwargs
+
+    def get_selecting_filters(self, request):
+        """
+        Names of the filters of the request that select rows: declared by the FilterSet and set to
+        a valid value. Other params (format, page, fields, misspelled filters) select nothing.
+        """
+        filterset = self.get_request_filterset(request)
+        if filterset is None:
+            return []
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        return [name for name, value in normalize_cleaned_data(filterset.form.cleaned_data) if name not in self.bulk_unselective_filters]
+
+    def get_bulk_queryset(self, request):
+        """
+        Rows selected by the filters and the `ids` of the body.
+        Returns None when nothing selects rows, so a bare request can not touch the whole table.
+        """
+        selection = BulkSelectionSerializer(data=request.data)
+        selection.is_valid(raise_exception=True)
+        ids = selection.validated_data.get('ids')
+        if ids is None and not self.get_selecting_filters(request):
+            return None
+        queryset = self.filter_queryset(self.get_queryset())
+        if ids is not None:
+            queryset = queryset.filter(pk__in=ids)
+        return queryset
+
+    def get_auto_now_values(self, model):
+        now = timezone.now()
+        return {field.name: now for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)}
+
+    def update_selected_rows(self, queryset, values):
+        """
+        UPDATE of the selected rows, whose ids are read (and locked) first: each batch is sent as
+        post_bulk_change with exactly the rows it changed, even those the filters no longer match.
+        """
+        pks = list(queryset.select_for_update().values_list('pk', flat=True))
+        if not pks:
+            return 0
+        rows = queryset.model._default_manager.using(queryset.db)
+        batch_size = connections[queryset.db].ops.bulk_batch_size(['pk'], pks)
+        updated = 0
+        for start in range(0, len(pks), batch_size):
+            batch = rows.filter(pk__in=pks[start:start + batch_size])
+            updated += batch.update(**values)
+            post_bulk_change.send(sender=queryset.model, action=BULK_UPDATE, queryset=batch, fields=list(values))
+        return updated
+
+    def bulk_update(self, request, *args, **kwargs):
+        if self.is_background_request(request):
+            return self.get_background_response(request)
+        try:
+            queryset = self.get_bulk_queryset(request)
+            if queryset is None:
+                raise InvalidData('Zgjidhni objektet me filtra ose ids')
+            serializer = self.get_serializer(data=request.data.get('data', {}), partial=True)
+            serializer.is_valid(raise_exception=True)
+            if not serializer.validated_data:
+                raise InvalidData('Nuk ka të dhëna për të ndryshuar')
+            with atomic():
+                updated = self.update_selected_rows(queryset, dict(serializer.validated_data, **self.get_auto_now_values(queryset.model)))
+            return Response({DATA: {'updated': updated}}, status=status.HTTP_200_OK)
+        except ValidationError as ve:
+            logger.error('Bulk update Error: {}'.format(ve))
+            error_dict = ve.get_full_details()
+            response_data = {
+                ERROR_TYPE: VALIDATION_ERROR,
+                ERRORS: error_dict,
+                MESSAGE: get_validation_error_message(error_dict)
+            }
+            return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
+        except InvalidData as ex:
+            response_data = {
+                ERROR_TYPE: INVALID_DATA,
+                ERRORS: ex.get_message(),
+                MESSAGE: ex.get_message(),
+            }
+            return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError as ie:
+            logger.error('{}'.format(ie))
+            response_data = {
+                ERROR_TYPE: INTEGRITY_ERROR,
+                ERRORS: '{}'.format(ie),
+                MESSAGE: 'Gabim në databazë',
+            }
+            return Response(response_data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def bulk_delete(self, request, *args, **kwargs):
+        if self.is_background_request(request):
+            return self.get_background_response(request)
+        try:
+            queryset = self.get_bulk_queryset(request)
+            if queryset is None:
+                raise InvalidData('Zgjidhni objektet me filtra ose ids')
+            model = queryset.model
+            with atomic():
+                if any(field.name == 'deleted' for field in model._meta.concrete_fields):
+                    deleted = self.update_selected_rows(queryset.filter(deleted=False), dict(deleted=True, **self.get_auto_now_values(model)))
+                else:
+                    post_bulk_change.send(sender=model, action=BULK_DELETE, queryset=queryset)
+                    deleted = queryset.delete()[1].get(model._meta.label, 0)
+            return Response({DATA: {'deleted': deleted}}, status=status.HTTP_200_OK)
+        except ValidationError as ve:
+            error_dict = ve.get_full_details()
+            response_data = {
+                ERROR_TYPE: VALIDATION_ERROR,
+                ERRORS: error_dict,
+                MESSAGE: get_validation_error_message(error_dict)
+            }
+            return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
+        except InvalidData as ex:
+            response_data = {
+                ERROR_TYPE: INVALID_DATA,
+                ERRORS: ex.get_message(),
+                MESSAGE: ex.get_message(),
+            }
+            return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
+
     @atomic
     def update(self, request, *args, **kwargs):
+        if self.is_bulk_request():
+            return self.bulk_update(request, *args, **kwargs)
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
         data = {}
@@ -229,6 +986,8 @@ class HRMRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
             return Response(response_data, status=response_status)
 
     def delete(self, request, *args, **kwargs):
+        if self.is_bulk_request():
+            return self.bulk_delete(request, *args, **kwargs)
         try:
             instance = self.get_object()
             # if hasattr(instance, 'deleted'):
@@ -248,6 +1007,42 @@ class HRMRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
             return Response(response_data, status=response_status)
 
 
+class CustomJobResultAPIView(RetrieveAPIView):
+    """
+    Result of a finished job: its file as a download, or its JSON result with the status code of
+    the request it replayed. Jobs still queued or running answer 202 with their progress.
+    """
+    queryset = None
+    serializer_class = None
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            job = self.get_object()
+        except Http404 as e:
+            response_data = {
+                ERROR_TYPE: HTTP_404,
+                ERRORS: '{}'.format(e),
+                MESSAGE: 'Nuk u gjet'
+            }
+            return Response(response_data, status=status.HTTP_404_NOT_FOUND)
+        if not job.is_finished:
+            return Response({DATA: self.get_serializer(job).data, MESSAGE: 'Puna është në proces'}, status=status.HTTP_202_ACCEPTED)
+        result = job.get_result() or {}
+        if job.result_file:
+            filename = os.path.basename(job.result_file.name)
+            return FileResponse(job.result_file.open('rb'), as_attachment=True, filename=filename, content_type=result.get('content_type'))
+        if 'status' in result:
+            return Response(result.get('data'), status=result['status'])
+        if job.error:
+            response_data = {
+                ERROR_TYPE: OTHER,
+                ERRORS: self.get_serializer(job).data['error'],
+                MESSAGE: 'Puna dështoi'
+            }
+            return Response(response_data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({DATA: result})
+
+
 def get_validation_error_message(error_data):
     try:
         response_message = ''
@@ -0,0 +1,372 @@
+"""
+ASGI native list endpoints. Django 3.0 runs every view synchronously, so the async variant
+is an ASGI application mounted in front of Django (see filters_tutorial_back/asgi.py).
+It reuses a CustomListAPIView for filtering, pagination and serialization, but runs the
+pagination count and the page query concurrently in worker threads and keeps serialization
+and rendering off the event loop. Requests go through settings.MIDDLEWARE like any other
+(see MiddlewareHandler), so responses carry the same CORS and security headers.
+
+EventStreamView keeps the connection open instead and streams the changes matching the
+filters of the request as Server-Sent Events.
+"""
+import asyncio
+import contextvars
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.handlers.base import BaseHandler
+from django.core.paginator import Page
+from django.db import close_old_connections
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+from filters_tutorial_back.common import events, routers
+from filters_tutorial_back.common.cache import make_cache_key, normalize_query_params
+from filters_tutorial_back.common.pagination import CountPaginator, Pagination
+from filters_tutorial_back.common.profiling import profile_connections, timer
+from filters_tutorial_back.common.renderers import FastJSONRenderer
+
+
+# Threads running the middleware of the ASGI views. The middleware of a list waits there for the
+# view's queries, which run in the default pool, a pool of its own keeps them from waiting for each other.
+middleware_executor = ThreadPoolExecutor(thread_name_prefix='asgi-middleware')
+
+
+def recycle_connections(function, *args):
+    """
+    Connections are per thread, they are recycled like Django does at the start and end of a request,
+    and their queries are added to the profile of the request (see ProfilingMiddleware).
+    """
+    close_old_connections()
+    try:
+        with profile_connections():
+            return function(*args)
+    finally:
+        close_old_connections()
+
+
+def run_in_thread(function, *args):
+    """
+    Run blocking (ORM) code in the default thread pool.
+    """
+    return sync_to_async(recycle_connections, thread_sensitive=False)(function, *args)
+
+
+class MiddlewareHandler(BaseHandler):
+    """
+    settings.MIDDLEWARE around `get_response`, the innermost handler of an ASGI view.
+    """
+
+    def __init__(self, get_response):
+        self.view_get_response = get_response
+        self.load_middleware()
+
+    def _get_response(self, request):
+        return self.view_get_response(request)
+
+    async def __call__(self, request):
+        loop = asyncio.get_running_loop()
+        request.event_loop = loop
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(middleware_executor, context.run, recycle_connections, self.get_response, request)
+
+
+def get_headers(response):
+    headers = [(key.encode('latin1'), value.encode('latin1')) for key, value in response.items()]
+    for cookie in response.cookies.values():
+        headers.append((b'Set-Cookie', cookie.output(header='').strip().encode('latin1')))
+    return headers
+
+
+class AsyncListView:
+    """
+    ASGI application serving GET requests of `view_class` (a CustomListAPIView).
+    Only page number pagination is run concurrently, other requests (e.g. keyset pages)
+    go through the view's regular list() in a worker thread.
+    """
+
+    def __init__(self, view_class, **initkwargs):
+        self.view_class = view_class
+        self.initkwargs = initkwargs
+        self.handler = MiddlewareHandler(self.get_response)
+
+    async def __call__(self, scope, receive, send):
+        body = io.BytesIO()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        response = await self.handler(ASGIRequest(scope, body))
+        try:
+            await send({'type': 'http.response.start', 'status': response.status_code, 'headers': get_headers(response)})
+            await send({'type': 'http.response.body', 'body': response.content})
+        finally:
+            response.close()
+
+    def get_response(self, request):
+        """
+        Innermost handler of the middleware, waits in its thread for the response made on the event loop.
+        """
+        return asyncio.run_coroutine_threadsafe(self.respond(request), request.event_loop).result()
+
+    async def respond(self, request):
+        view, response = await run_in_thread(self.prepare, request)
+        if response is None:
+            try:
+                response = await self.paginated_response(view)
+            except Exception as exc:
+                response = await run_in_thread(view.handle_exception, exc)
+        return await run_in_thread(self.render, view, response)
+
+    def prepare(self, django_request):
+        """
+        Everything before the queries: DRF request, authentication, permissions, negotiation,
+        response cache and filtering. Returns the view and, when the request does not take
+        the concurrent path, its complete response.
+        """
+        view = self.view_class(**self.initkwargs)
+        view.args, view.kwargs = (), {}
+        view.headers = {}
+        view.format_kwarg = None
+        request = view.initialize_request(django_request)
+        view.request = request
+        try:
+            view.initial(request)
+            if request.method != 'GET':
+                return view, view.http_method_not_allowed(request)
+            if not isinstance(view.paginator, Pagination) or self.get_page_number(view) is None:
+                return view, view.list(request)
+            view.response_cache_key = view.get_response_cache_key(request)
+            response = view.get_cached_list_response(request, view.response_cache_key)
+            if response is not None:
+                return view, response
+            view.filtered_queryset = view.filter_queryset(view.get_queryset())
+            return view, None
+        except Exception as exc:
+            return view, view.handle_exception(exc)
+
+    def get_page_number(self, view):
+        """
+        Positive page number of the request, None for anything the regular pagination has to handle (e.g. 'last').
+        """
+        paginator = view.paginator
+        try:
+            number = int(view.request.query_params.get(paginator.page_query_param, 1))
+        except ValueError:
+            return None
+        return number if number >= 1 else None
+
+    async def paginated_response(self, view):
+        request, paginator, queryset = view.request, view.paginator, view.filtered_queryset
+        number = self.get_page_number(view)
+        page_size = paginator.get_page_size(request)
+        paginator.request, paginator.view, paginator.count_exact = request, view, True
+
+        def count():
+            # the validators' aggregate query counts the rows, get_count() then finds it in the count cache
+            view.validators = view.get_list_validators(request)
+            return paginator.get_count(queryset)
+
+        offset = (number - 1) * page_size
+        count, rows = await asyncio.gather(
+            run_in_thread(count),
+            run_in_thread(lambda: list(queryset[offset:offset + page_size])),
+        )
+        response = view.get_not_modified_response(request, view.validators)
+        if response is not None:
+            return response
+        if number > 1 and not rows:
+            raise NotFound(paginator.invalid_page_message.format(page_number=number, message='That page contains no results'))
+        paginator.page = Page(rows, number, CountPaginator(queryset, page_size, count_function=lambda _: count))
+        return await run_in_thread(self.serialize, view, rows)
+
+    def serialize(self, view, rows):
+        with timer('serialize'):
+            data = view.get_serializer(rows, many=True).data
+        response = view.set_validators(view.get_paginated_response(data), view.validators)
+        view.cache_list_response(view.response_cache_key, response, view.validators)
+        return response
+
+    def render(self, view, response):
+        if isinstance(response, Response):
+            response = view.finalize_response(view.request, response)
+            response.render()
+        return response
+
+
+class EventStreamView(AsyncListView):
+    """
+    ASGI application streaming the changes of `channel` (see common.events) as Server-Sent Events.
+    The query string filters like on a list of `view_class`: created and updated rows matching
+    the filters are sent as `create` / `update` events with their serialized rows, updated rows
+    no longer matching as `remove` and deleted rows as `delete` events with their ids (clients
+    ignore ids they do not show). After a `reset` event clients reload the list.
+
+    The rows of an event are queried once per filter, streams with the same filter share them.
+    """
+    retry_ms = 3000
+    # (event, filter) rows kept for the streams sharing them
+    max_shared_rows = 256
+
+    def __init__(self, view_class, channel, **initkwargs):
+        super().__init__(view_class, **initkwargs)
+        self.channel = channel
+        self.heartbeat_seconds = getattr(settings, 'EVENT_STREAM_HEARTBEAT_SECONDS', 15)
+        self.renderer = FastJSONRenderer()
+        self.shared_rows = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        request = ASGIRequest(scope, io.BytesIO())
+        response = await self.handler(request)
+        view = getattr(response, 'event_stream_view', None)
+        if view is None:
+            try:
+                await send({'type': 'http.response.start', 'status': response.status_code, 'headers': get_headers(response)})
+                await send({'type': 'http.response.body', 'body': response.content})
+            finally:
+                response.close()
+            return
+
+        key = make_cache_key('stream', request.path, view.request.user.pk, normalize_query_params(view.request.query_params))
+        loop = asyncio.get_running_loop()
+        subscription = events.hub.subscribe(self.channel, loop, request.META.get('HTTP_LAST_EVENT_ID'))
+        disconnected = loop.create_task(self.wait_for_disconnect(receive))
+        next_event = None
+        try:
+            await send({'type': 'http.response.start', 'status': response.status_code, 'headers': get_headers(response)})
+            await self.send_body(send, 'retry: {}\n\n'.format(self.retry_ms).encode())
+            while True:
+                if next_event is None:
+                    next_event = loop.create_task(subscription.get())
+                done, _ = await asyncio.wait({next_event, disconnected}, timeout=self.heartbeat_seconds, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    return
+                if next_event not in done:
+                    # a comment, lets proxies and clients see the connection is alive
+                    await self.send_body(send, b': keep-alive\n\n')
+                    continue
+                event, next_event = next_event.result(), None
+                content = await self.encode_event(view, key, event)
+                if content:
+                    await self.send_body(send, content)
+        finally:
+            subscription.close()
+            for task in (next_event, disconnected):
+                if task is not None:
+                    task.cancel()
+            response.close()
+
+    async def send_body(self, send, content):
+        await send({'type': 'http.response.body', 'body': content, 'more_body': True})
+
+    def get_response(self, request):
+        """
+        Innermost handler of the middleware. A request that can be streamed gets the response
+        the events are sent with, its headers go through the middleware, its body does not.
+        """
+        view, response = self.prepare(request)
+        if response is not None:
+            return self.render(view, response)
+        response = StreamingHttpResponse((), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx would buffer the events
+        response['X-Accel-Buffering'] = 'no'
+        response.event_stream_view = view
+        return response
+
+    async def wait_for_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    def prepare(self, django_request):
+        """
+        Authentication, permissions and validation of the filters, returns the view and,
+        when the request can not be streamed, its error response.
+        """
+        view = self.view_class(**self.initkwargs)
+        view.args, view.kwargs = (), {}
+        view.headers = {}
+        view.format_kwarg = None
+        request = view.initialize_request(django_request)
+        view.request = request
+        try:
+            view.initial(request)
+            if request.method != 'GET':
+                return view, view.http_method_not_allowed(request)
+            view.filter_queryset(view.get_queryset())
+            return view, None
+        except Exception as exc:
+            return view, view.handle_exception(exc)
+
+    def get_rows(self, view, event):
+        """
+        Ids and serialized rows of the event's rows matching the filters.
+        """
+        # events are sent right after the commit, a replica may not have the rows yet
+        routers.deactivate_replica()
+        queryset = view.filter_queryset(view.get_queryset()).filter(pk__in=event['ids'])
+        # the serialized rows may leave out the id (?fields=)
+        pks = set(queryset.values_list('pk', flat=True)) if event['action'] == events.UPDATE else None
+        with timer('serialize'):
+            return pks, view.get_serializer(list(queryset), many=True).data
+
+    async def get_shared_rows(self, view, key, event):
+        shared_key = (event['id'], key, id(asyncio.get_running_loop()))
+        rows = self.shared_rows.get(shared_key)
+        if rows is None:
+            rows = self.shared_rows[shared_key] = asyncio.ensure_future(run_in_thread(self.get_rows, view, event))
+            while len(self.shared_rows) > self.max_shared_rows:
+                self.shared_rows.popitem(last=False)
+        return await asyncio.shield(rows)
+
+    async def encode_event(self, view, key, event):
+        messages = []
+        if event['action'] == events.RESET:
+            # an event without data is never dispatched by browsers
+            messages.append((events.RESET, {}))
+        elif event['action'] == events.DELETE:
+            messages.append((events.DELETE, event['ids']))
+        else:
+            pks, rows = await self.get_shared_rows(view, key, event)
+            if event['action'] == events.UPDATE:
+                removed = [pk for pk in event['ids'] if pk not in pks]
+                if removed:
+                    messages.append(('remove', removed))
+            if rows:
+                messages.append((event['action'], rows))
+        lines = []
+        for index, (name, data) in enumerate(messages, 1):
+            # the id of the event on its last message, Last-Event-ID resumes after all of them
+            if index == len(messages) and event['id']:
+                lines.append('id: {}'.format(event['id']).encode())
+            lines.append('event: {}'.format(name).encode())
+            lines.append(b'data: ' + self.renderer.render(data))
+            lines.append(b'')
+        return b''.join(line + b'\n' for line in lines)
+
+
+class PathRouter:
+    """
+    Sends HTTP requests for the given exact paths to their ASGI application, everything else to `default`.
+    """
+
+    def __init__(self, default, routes):
+        self.default = default
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in self.routes:
+            return await self.routes[scope['path']](scope, receive, send)
+        return await self.default(scope, receive, send)
@@ -0,0 +1,90 @@
+import datetime
+import hashlib
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+
+GENERATION_KEY = 'generation:{}'
+
+
+def get_generation(*models):
+    """
+    Current generation of each model. Any cache key that embeds these numbers
+    becomes unreachable as soon as one of the models is written.
+    They live in the default cache, which every process writing the models must share
+    (see CACHES in settings).
+    """
+    keys = [GENERATION_KEY.format(model._meta.label_lower) for model in models]
+    generations = cache.get_many(keys)
+    return tuple(generations.get(key, 0) for key in keys)
+
+
+def bump_generation(model, using=None):
+    """
+    Bumped right away and again when the transaction of the write commits: a reader that
+    cached the rows as they were before the commit, under the first new generation, is left behind.
+    """
+    key = GENERATION_KEY.format(model._meta.label_lower)
+    increment_generation(key)
+    transaction.on_commit(lambda: increment_generation(key), using=using)
+
+
+def increment_generation(key):
+    # add() is a no-op when the key exists, incr() is atomic on the backends that support it
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def normalize_query_params(query_params, exclude=()):
+    """
+    Canonical, order independent representation of a QueryDict.
+    Empty values are dropped since filters ignore them as well.
+    """
+    items = []
+    for key in sorted(query_params.keys()):
+        if key in exclude:
+            continue
+        values = [value for value in query_params.getlist(key) if value != '']
+        if values:
+            items.append((key, values))
+    return items
+
+
+def make_cache_key(prefix, *parts):
+    digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+    return '{}:{}'.format(prefix, digest)
+
+
+def canonical_value(value):
+    """
+    Equal filter values get equal representations: `amount_min=1.0` and `amount_min=1`,
+    or the same instant written in two time zones, produce the same key.
+    """
+    if isinstance(value, slice):
+        return canonical_value(value.start), canonical_value(value.stop)
+    if isinstance(value, (list, tuple)):
+        return tuple(canonical_value(item) for item in value)
+    if isinstance(value, (Decimal, float, int)) and not isinstance(value, bool):
+        return str(Decimal(str(value)).normalize())
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).isoformat()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def normalize_cleaned_data(cleaned_data):
+    """
+    Canonical representation of validated filter values, unset filters are dropped.
+    """
+    items = []
+    for key in sorted(cleaned_data.keys()):
+        value = cleaned_data[key]
+        if value in (None, '', [], ()) or value == slice(None, None):
+            continue
+        items.append((key, canonical_value(value)))
+    return items
@@ -16,3 +16,5 @@ INVALID_DATA = 'InvalidData'
 UNAUTHORIZED = 'Unauthorized'
 EMAIL_ERROR = 'EmailError'
 DOCUMENT_SHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_CONTENT_TYPE = 'text/csv; charset=utf-8'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
@@ -0,0 +1,49 @@
+"""
+Connection tuning, configured per database in settings.DATABASES:
+`PRAGMAS` are run on every new SQLite connection, `TRANSACTION_MODE` sets how its
+transactions begin, and with `CONN_HEALTH_CHECKS`
+(Django 4.1 checks these itself) a persistent connection is tested before a request reuses it.
+"""
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # on the raw sqlite3 connection, so the pragmas stay out of query logs and counts
+    for name, value in (connection.settings_dict.get('PRAGMAS') or {}).items():
+        connection.connection.execute('PRAGMA {} = {}'.format(name, value))
+    mode = connection.settings_dict.get('TRANSACTION_MODE')
+    if mode and not any(isinstance(wrapper, TransactionMode) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(TransactionMode(mode))
+
+
+class TransactionMode:
+    """
+    Execute wrapper starting atomic() blocks with BEGIN IMMEDIATE (or EXCLUSIVE) instead of Django's
+    deferred BEGIN (Django 5.1 has the `transaction_mode` option for this). A deferred transaction
+    that reads before it writes fails with "database is locked" at once, without waiting for the
+    busy timeout, when another connection wrote in between.
+    """
+
+    def __init__(self, mode):
+        self.sql = 'BEGIN {}'.format(mode)
+
+    def __call__(self, execute, sql, params, many, context):
+        return execute(self.sql if sql == 'BEGIN' else sql, params, many, context)
+
+
+@receiver(request_started)
+def check_persistent_connections(**kwargs):
+    """
+    Runs after Django's close_old_connections(), which only drops connections past CONN_MAX_AGE or after errors.
+    """
+    for connection in connections.all():
+        if connection.connection is None or not connection.settings_dict.get('CONN_HEALTH_CHECKS'):
+            continue
+        if not connection.is_usable():
+            connection.close()
@@ -0,0 +1,141 @@
+"""
+In-process fan-out of change events to open event streams (see async_views.EventStreamView).
+Signal handlers publish an event ({'action': 'create' / 'update' / 'delete', 'ids': [...]}) once
+their transaction commits, from whatever thread wrote; every subscriber gets it through a bounded
+queue on its own event loop. Recent events are kept, so a reconnecting client (Last-Event-ID)
+gets what it missed, or a `reset` event when they are gone.
+
+Only changes made by this process are seen: with several server processes, or writes from
+`run_jobs` workers, a stream misses the changes of the other processes.
+"""
+import asyncio
+import itertools
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
+# the client has to reload, e.g. after events were dropped
+RESET = 'reset'
+
+
+class Subscription:
+    def __init__(self, hub, channel, loop, maxsize):
+        self.hub = hub
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.lagged = False
+
+    def put(self, event):
+        """
+        Runs on the subscriber's loop. A client reading slower than events come loses them and gets a reset.
+        """
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    async def get(self):
+        if self.lagged:
+            self.lagged = False
+            event_id = None
+            while not self.queue.empty():
+                event_id = self.queue.get_nowait()['id']
+            return {'id': event_id, 'action': RESET}
+        return await self.queue.get()
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    def __init__(self, history_size=1000, queue_size=1000, reconnect_seconds=60):
+        self.history_size = history_size
+        self.queue_size = queue_size
+        # events are still kept this long after the last stream of a channel closed, for it to resume
+        self.reconnect_seconds = reconnect_seconds
+        # event ids of another process (before a restart) are never taken for ours
+        self.prefix = uuid.uuid4().hex[:8]
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._history = {}
+        self._last_closed = {}
+
+    def is_watched(self, channel):
+        """
+        Whether events of the channel are wanted: it has streams, or had some shortly before.
+        """
+        if self._subscriptions.get(channel):
+            return True
+        return time.monotonic() - self._last_closed.get(channel, float('-inf')) < self.reconnect_seconds
+
+    def subscribe(self, channel, loop, last_event_id=None):
+        """
+        With the id of the last event a client got, the events it missed are queued first.
+        """
+        subscription = Subscription(self, channel, loop, self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+            if last_event_id:
+                missed = self.get_missed(channel, last_event_id)
+                if missed is None:
+                    subscription.lagged = True
+                for event in missed or ():
+                    subscription.put(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.get(subscription.channel, set()).discard(subscription)
+            self._last_closed[subscription.channel] = time.monotonic()
+
+    def get_missed(self, channel, last_event_id):
+        """
+        Events after last_event_id, None when some of them are no longer kept.
+        """
+        prefix, _, number = last_event_id.partition('-')
+        if prefix != self.prefix or not number.isdigit():
+            return None
+        history = list(self._history.get(channel, ()))
+        if history and history[0]['number'] > int(number) + 1:
+            return None
+        return [event for event in history if event['number'] > int(number)]
+
+    def publish(self, channel, event):
+        with self._lock:
+            number = next(self._ids)
+            event = dict(event, id='{}-{}'.format(self.prefix, number), number=number)
+            self._history.setdefault(channel, deque(maxlen=self.history_size)).append(event)
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # the loop is closed, its stream ended without unsubscribing
+                self.unsubscribe(subscription)
+        return event
+
+
+hub = EventHub()
+
+
+def publish_changes(channel, action, ids, using=None):
+    """
+    Publish after the current transaction commits, so rolled back changes are never pushed.
+    More ids than EVENT_STREAM_MAX_IDS are sent as a reset.
+    """
+    if not hub.is_watched(channel) or not ids:
+        return
+    if len(ids) > getattr(settings, 'EVENT_STREAM_MAX_IDS', 1000):
+        event = {'action': RESET}
+    else:
+        event = {'action': action, 'ids': list(ids)}
+    transaction.on_commit(lambda: hub.publish(channel, event), using=using)
@@ -0,0 +1,176 @@
+"""
+Streaming writers for exports. Each writer takes an iterable of serialized rows (dicts,
+possibly nested) and yields the file in chunks, so memory does not grow with the row count.
+"""
+import csv
+import re
+import zipfile
+from itertools import chain
+from xml.sax.saxutils import escape
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from filters_tutorial_back.common.cons import CSV_CONTENT_TYPE, DOCUMENT_SHEET_CONTENT_TYPE, NDJSON_CONTENT_TYPE
+
+# Rows written between two yields of a streamed file.
+ROWS_PER_CHUNK = 500
+
+
+def flatten(data, prefix=''):
+    """
+    {'user': {'username': 'a'}} -> {'user.username': 'a'}
+    """
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def _peek(rows):
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return None, iter(())
+    return first, chain([first], rows)
+
+
+class _Buffer:
+    """
+    Write-only file object collecting what csv/zipfile write, drained after each chunk.
+    """
+
+    def __init__(self, empty=b''):
+        self.empty = empty
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = self.empty.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_csv(rows):
+    first, rows = _peek(rows)
+    if first is None:
+        return
+    buffer = _Buffer('')
+    writer = csv.writer(buffer)
+    header = list(flatten(first).keys())
+    writer.writerow(header)
+    for index, row in enumerate(rows, 1):
+        flat = flatten(row)
+        writer.writerow(['' if flat.get(column) is None else flat.get(column) for column in header])
+        if index % ROWS_PER_CHUNK == 0:
+            yield buffer.drain().encode('utf-8')
+    yield buffer.drain().encode('utf-8')
+
+
+def stream_ndjson(rows):
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    lines = []
+    for index, row in enumerate(rows, 1):
+        lines.append(encoder.encode(row))
+        if index % ROWS_PER_CHUNK == 0:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+XLSX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+XLSX_SHEET_END = '</sheetData></worksheet>'
+# Characters not allowed in XML 1.0
+ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return '<c t="b"><v>{}</v></c>'.format(int(value))
+    if isinstance(value, (int, float)):
+        return '<c><v>{}</v></c>'.format(value)
+    text = escape(ILLEGAL_XML_CHARS.sub('', str(value)))
+    return '<c t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>'.format(text)
+
+
+def _xlsx_row(values):
+    return '<row>{}</row>'.format(''.join(_xlsx_cell(value) for value in values))
+
+
+def stream_xlsx(rows):
+    """
+    Minimal single sheet workbook with inline strings. The zip is written to a
+    non seekable buffer, so zipfile streams entries with data descriptors.
+    """
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+        workbook.writestr('_rels/.rels', XLSX_RELS)
+        workbook.writestr('xl/workbook.xml', XLSX_WORKBOOK)
+        workbook.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+        with workbook.open('xl/worksheets/sheet1.xml', mode='w', force_zip64=True) as sheet:
+            sheet.write(XLSX_SHEET_START.encode('utf-8'))
+            first, rows = _peek(rows)
+            if first is not None:
+                header = list(flatten(first).keys())
+                sheet.write(_xlsx_row(header).encode('utf-8'))
+                lines = []
+                for index, row in enumerate(rows, 1):
+                    flat = flatten(row)
+                    lines.append(_xlsx_row(flat.get(column) for column in header))
+                    if index % ROWS_PER_CHUNK == 0:
+                        sheet.write(''.join(lines).encode('utf-8'))
+                        lines = []
+                        yield buffer.drain()
+                sheet.write(''.join(lines).encode('utf-8'))
+            sheet.write(XLSX_SHEET_END.encode('utf-8'))
+    yield buffer.drain()
+
+
+# format -> (writer, content type)
+EXPORT_FORMATS = {
+    'csv': (stream_csv, CSV_CONTENT_TYPE),
+    'ndjson': (stream_ndjson, NDJSON_CONTENT_TYPE),
+    'xlsx': (stream_xlsx, DOCUMENT_SHEET_CONTENT_TYPE),
+}
@@ -0,0 +1,131 @@
+"""
+Filtering with FilterSet classes compiled per parameter shape. Building a FilterSet copies
+every declared filter, creates their form fields and a form class, for every request. The
+shape of a request, which filters its query string sets (not their values), picks a cached
+subclass holding only those filters and a ready form class, so a request copies and validates
+just the filters it uses. Unset filters never filter anything, the result is the same.
+
+OrderingFilter lets views rename what an ordering parameter sorts on (`ordering_aliases`).
+"""
+import copy
+from collections import OrderedDict
+from threading import Lock
+
+from django.template import loader
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import filters
+
+_widgets = {}
+_shape_classes = {}
+_lock = Lock()
+
+
+def get_widgets(filterset_class):
+    """
+    Widget of each filter, they know the query parameters a filter reads (e.g. amount_min and amount_max).
+    """
+    widgets = _widgets.get(filterset_class)
+    if widgets is None:
+        widgets = _widgets[filterset_class] = OrderedDict(
+            (name, copy.deepcopy(filter_).field.widget) for name, filter_ in filterset_class.base_filters.items()
+        )
+    return widgets
+
+
+def get_shape(filterset_class, data):
+    """
+    Names of the filters the data sets, in declaration order. Empty values count, they are validated.
+    """
+    return tuple(name for name, widget in get_widgets(filterset_class).items() if not widget.value_omitted_from_data(data, {}, name))
+
+
+def get_shape_class(filterset_class, shape):
+    key = (filterset_class, shape)
+    shape_class = _shape_classes.get(key)
+    if shape_class is not None:
+        return shape_class
+    with _lock:
+        if key not in _shape_classes:
+            _shape_classes[key] = compile_shape_class(filterset_class, shape)
+    return _shape_classes[key]
+
+
+def compile_shape_class(filterset_class, shape):
+    fields = OrderedDict()
+    for name in shape:
+        filter_ = copy.deepcopy(filterset_class.base_filters[name])
+        filter_.model = filterset_class._meta.model  # for the label
+        fields[name] = filter_.field
+    form_class = type('{}Form'.format(filterset_class.__name__), (filterset_class._meta.form,), fields)
+
+    def get_form_class(self):
+        return form_class
+
+    def form(self):
+        if not hasattr(self, '_form'):
+            self._form = form_class(self.data, prefix=self.form_prefix) if self.is_bound else form_class(prefix=self.form_prefix)
+        return self._form
+
+    shape_class = type(filterset_class.__name__, (filterset_class,), {
+        'get_form_class': get_form_class,
+        'form': property(form),
+        'shape': shape,
+    })
+    # set after the class is created, the FilterSet metaclass would collect every filter again
+    shape_class.base_filters = OrderedDict((name, filterset_class.base_filters[name]) for name in shape)
+    return shape_class
+
+
+class FilterBackend(DjangoFilterBackend):
+    """
+    DjangoFilterBackend using the shape classes. The validated filters are kept on the view,
+    so the response cache key, the ETag and the list of one request share them.
+    The browsable API still renders the form of every filter.
+    """
+
+    def get_filterset_class(self, view, queryset=None):
+        """
+        FilterSets may list models with the same fields as their own in `source_models`
+        (e.g. a database view over the model and its archive), querysets of those pass too.
+        """
+        filterset_class = getattr(view, 'filterset_class', None)
+        if filterset_class is not None and queryset is not None and queryset.model in getattr(filterset_class, 'source_models', ()):
+            return filterset_class
+        return super().get_filterset_class(view, queryset)
+
+    def get_filterset(self, request, queryset, view):
+        filterset_class = self.get_filterset_class(view, queryset)
+        if filterset_class is None:
+            return None
+        shape_class = get_shape_class(filterset_class, get_shape(filterset_class, request.query_params))
+        filterset = shape_class(**self.get_filterset_kwargs(request, queryset, view))
+        forms = view.__dict__.setdefault('_filter_forms', {})
+        if shape_class in forms:
+            filterset._form = forms[shape_class]
+        else:
+            forms[shape_class] = filterset.form
+        return filterset
+
+    def to_html(self, request, queryset, view):
+        filterset_class = self.get_filterset_class(view, queryset)
+        if filterset_class is None:
+            return None
+        filterset = filterset_class(**self.get_filterset_kwargs(request, queryset, view))
+        return loader.get_template(self.template).render({'filter': filterset}, request)
+
+
+class OrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter applying the `ordering_aliases` of the view: names clients order by mapped to
+    the fields actually sorted on, e.g. a related field to its denormalized copy on the model.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        aliases = getattr(view, 'ordering_aliases', {})
+        if not ordering or not aliases:
+            return ordering
+        return [
+            ('-' if name.startswith('-') else '') + aliases.get(name.lstrip('-'), name.lstrip('-')) if isinstance(name, str) else name
+            for name in ordering
+        ]
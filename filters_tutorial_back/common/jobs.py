@@ -0,0 +1,261 @@
+"""
+Background jobs stored in the database. Requests enqueue a job and answer 202 Accepted at once,
+worker processes (`python manage.py run_jobs`) claim queued jobs, run the handler registered for
+their kind and store the result, which clients poll and download through the job endpoints.
+
+Any API request can be deferred as is (kind `request`): the worker replays it through the view
+it was routed to, a streamed response (export) is saved as the job's result file, any other
+response body as its JSON result.
+"""
+import io
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+import traceback
+from contextvars import ContextVar
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.files import File
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections, models
+from django.urls import resolve
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+REQUEST_JOB = 'request'
+
+_handlers = {}
+_current_job = ContextVar('job', default=None)
+
+
+def register(kind):
+    """
+    Decorator registering the handler of a job kind. Handlers are called with the job and its
+    params as keyword arguments and return the JSON result; they may set job.result_file.
+    """
+    def decorator(handler):
+        _handlers[kind] = handler
+        return handler
+    return decorator
+
+
+def get_handler(kind):
+    return _handlers.get(kind)
+
+
+def get_current_job():
+    return _current_job.get()
+
+
+def report_progress(done, total=None):
+    """
+    Progress of the running job, does nothing outside of a job.
+    """
+    job = _current_job.get()
+    if job is not None:
+        job.set_progress(done, total)
+
+
+class JobFailed(Exception):
+    """
+    Raised by handlers for an expected failure, without a traceback. The result is still stored.
+    """
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.message = message
+        self.result = result
+
+
+class BaseJob(models.Model):
+    class Meta:
+        abstract = True
+        ordering = ['-id']
+
+    kind = models.CharField(max_length=100)
+    # JSON
+    params = models.TextField(default='{}')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    # JSON
+    result = models.TextField(blank=True)
+    result_file = models.FileField(upload_to='jobs', blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    user = models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_started = models.DateTimeField(null=True, blank=True)
+    # written with every progress report, a running job without one for JOB_STALE_SECONDS is run again
+    date_heartbeat = models.DateTimeField(null=True, blank=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+
+    def get_params(self):
+        return json.loads(self.params or '{}')
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else None
+
+    @property
+    def is_finished(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    def set_progress(self, done, total=None):
+        self.progress = done
+        fields = {'progress': done, 'date_heartbeat': timezone.now()}
+        if total is not None:
+            self.total = fields['total'] = total
+        type(self)._default_manager.filter(pk=self.pk).update(**fields)
+
+    @classmethod
+    def enqueue(cls, kind, params=None, user=None):
+        if get_handler(kind) is None:
+            raise ValueError('Unknown job kind {}'.format(kind))
+        if user is not None and not user.is_authenticated:
+            user = None
+        return cls._default_manager.create(kind=kind, params=json.dumps(params or {}), user=user)
+
+    @classmethod
+    def claim(cls, worker):
+        """
+        The oldest queued job, marked as running for this worker. The conditional UPDATE lets
+        only one of the workers racing for a job have it, on any database.
+        """
+        manager = cls._default_manager
+        while True:
+            pk = manager.filter(status=QUEUED).order_by('id').values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            now = timezone.now()
+            claimed = manager.filter(pk=pk, status=QUEUED).update(
+                status=RUNNING, worker=worker, attempts=models.F('attempts') + 1, date_started=now, date_heartbeat=now
+            )
+            if claimed:
+                return manager.get(pk=pk)
+
+    @classmethod
+    def requeue_stale(cls, seconds, max_attempts):
+        """
+        Jobs of workers that died: run again, or failed after max_attempts.
+        """
+        stale = cls._default_manager.filter(status=RUNNING, date_heartbeat__lt=timezone.now() - timedelta(seconds=seconds))
+        stale.filter(attempts__gte=max_attempts).update(status=FAILED, error='Worker lost', date_finished=timezone.now())
+        return stale.filter(attempts__lt=max_attempts).update(status=QUEUED, worker='')
+
+    def run(self):
+        handler = get_handler(self.kind)
+        token = _current_job.set(self)
+        try:
+            if handler is None:
+                raise ValueError('Unknown job kind {}'.format(self.kind))
+            result = handler(self, **self.get_params())
+            self.result = json.dumps(result) if result is not None else ''
+            self.status = SUCCEEDED
+            if self.total is None or self.progress < self.total:
+                self.progress = self.total = self.total or 1
+        except JobFailed as e:
+            self.status = FAILED
+            self.error = e.message
+            self.result = json.dumps(e.result) if e.result is not None else ''
+        except Exception:
+            logger.exception('Job %s (%s) failed', self.pk, self.kind)
+            self.status = FAILED
+            self.error = traceback.format_exc()
+        finally:
+            _current_job.reset(token)
+        self.date_finished = timezone.now()
+        # an UPDATE, save() would insert the job again if it was deleted meanwhile
+        fields = ['status', 'progress', 'total', 'result', 'result_file', 'error', 'date_finished']
+        type(self)._default_manager.filter(pk=self.pk).update(**{name: getattr(self, name) for name in fields})
+        return self
+
+
+def work(model, name=None, poll_interval=1.0, burst=False):
+    """
+    Worker loop: runs queued jobs one at a time. With burst it returns when the queue is empty.
+    """
+    name = name or '{}:{}'.format(socket.gethostname(), os.getpid())
+    stale_seconds = getattr(settings, 'JOB_STALE_SECONDS', 600)
+    max_attempts = getattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+    done = 0
+    while True:
+        # a job is a request for the connections: closed when broken or past CONN_MAX_AGE
+        close_old_connections()
+        model.requeue_stale(stale_seconds, max_attempts)
+        job = model.claim(name)
+        if job is None:
+            if burst:
+                return done
+            time.sleep(poll_interval)
+            continue
+        logger.info('Job %s (%s) started by %s', job.pk, job.kind, name)
+        try:
+            job.run()
+        except Exception:
+            # the result could not be stored, the job is run again once stale
+            logger.exception('Job %s (%s) lost', job.pk, job.kind)
+            continue
+        logger.info('Job %s (%s) %s', job.pk, job.kind, job.status)
+        done += 1
+
+
+def get_request_params(request, exclude=()):
+    """
+    Params of a `request` job replaying the request.
+    """
+    query = [(key, value) for key, values in request.GET.lists() if key not in exclude for value in values]
+    return {
+        'method': request.method,
+        'path': request.path,
+        'query_string': urlencode(query),
+        'content_type': request.META.get('CONTENT_TYPE', ''),
+        'body': request.body.decode('utf-8'),
+    }
+
+
+@register(REQUEST_JOB)
+def replay_request(job, method, path, query_string, content_type, body):
+    body = body.encode('utf-8')
+    request = WSGIRequest({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_NAME': 'jobs',
+        'SERVER_PORT': '80',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+    })
+    if job.user is not None:
+        # taken by DRF's Request instead of authenticating
+        request._force_auth_user = job.user
+    match = resolve(path)
+    response = match.func(request, *match.args, **match.kwargs)
+    if response.streaming:
+        with tempfile.TemporaryFile() as file:
+            for chunk in response.streaming_content:
+                file.write(chunk)
+            filename = response.get('Content-Disposition', '').rpartition('filename=')[2].strip('"') or 'result'
+            job.result_file.save('{}/{}'.format(job.pk, filename), File(file), save=False)
+        return {'status': response.status_code, 'content_type': response['Content-Type']}
+    if hasattr(response, 'render'):
+        response.render()
+    result = {'status': response.status_code, 'data': json.loads(response.content.decode('utf-8')) if response.content else None}
+    if response.status_code >= 400:
+        raise JobFailed('HTTP {}'.format(response.status_code), result)
+    return result
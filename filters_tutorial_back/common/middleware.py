@@ -0,0 +1,184 @@
+import gzip
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from filters_tutorial_back.common import profiling, routers
+
+logger = logging.getLogger('filters_tutorial_back.profiling')
+
+PROFILING_DEFAULTS = {
+    'ENABLED': False,
+    # Share of requests that are profiled, 0..1
+    'SAMPLE_RATE': 1.0,
+    # Requests slower than this are logged as warnings together with their SQL, None disables the capture
+    'SLOW_REQUEST_MS': 500,
+    'SERVER_TIMING_HEADER': True,
+}
+
+
+def get_profiling_settings():
+    return dict(PROFILING_DEFAULTS, **getattr(settings, 'PROFILING', {}))
+
+
+class ProfilingMiddleware:
+    """
+    Records query count, database time and the time of the phases reported with
+    profiling.timer() (pagination count, page fetch, serialization) plus rendering,
+    exposes them in a Server-Timing header and logs them as JSON.
+    Removed from the middleware chain when PROFILING['ENABLED'] is False.
+    """
+
+    def __init__(self, get_response):
+        self.options = get_profiling_settings()
+        if not self.options['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = self.options['SAMPLE_RATE']
+        if sample_rate < 1 and random.random() >= sample_rate:
+            return self.get_response(request)
+
+        slow_ms = self.options['SLOW_REQUEST_MS']
+        profile = profiling.Profile(capture_sql=slow_ms is not None)
+        token = profiling.activate(profile)
+        try:
+            with profiling.profile_connections(profile):
+                response = self.get_response(request)
+        finally:
+            profiling.deactivate(token)
+
+        render_start = getattr(request, '_profiling_render_start', None)
+        if render_start is not None:
+            profile.add('render', time.perf_counter() - render_start)
+        if self.options['SERVER_TIMING_HEADER']:
+            response['Server-Timing'] = profile.server_timing()
+        self.log(request, response, profile, slow_ms)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook and before the response returns to __call__
+        request._profiling_render_start = time.perf_counter()
+        return response
+
+    def log(self, request, response, profile, slow_ms):
+        data = profile.as_dict()
+        data.update(method=request.method, path=request.get_full_path(), status=response.status_code)
+        if slow_ms is not None and data['total_ms'] >= slow_ms:
+            data['sql'] = [{'sql': sql, 'params': repr(params), 'ms': round(duration * 1000, 3)} for sql, params, duration in profile.queries]
+            logger.warning(json.dumps(data), extra={'profile': data})
+        else:
+            logger.info(json.dumps(data), extra={'profile': data})
+
+
+class ReplicaPinMiddleware:
+    """
+    Pins clients to the primary database for REPLICA_PIN_SECONDS after each write request,
+    so their next reads do not hit a replica that has not caught up yet.
+    """
+    safe_methods = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in self.safe_methods and routers.get_replicas():
+            routers.pin(response)
+        return response
+
+
+COMPRESSION_DEFAULTS = {
+    # Smaller responses are sent as they are, compressing them costs more than the bytes saved
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 4,
+    'BROTLI_QUALITY': 4,
+    # Content types worth compressing, by prefix
+    'CONTENT_TYPES': ('application/json', 'text/'),
+}
+
+
+def get_compression_settings():
+    return dict(COMPRESSION_DEFAULTS, **getattr(settings, 'COMPRESSION', {}))
+
+
+def parse_accept_encoding(header):
+    """
+    Accept-Encoding as {coding: quality}.
+    """
+    codings = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        name, _, value = params.strip().partition('=')
+        if name.strip() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        if coding:
+            codings[coding.strip().lower()] = quality
+    return codings
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses of at least COMPRESSION['MIN_SIZE'] bytes with brotli (when the brotli
+    package is installed) or gzip, whichever the client prefers. Streamed responses (exports)
+    are gzipped. Like Django's GZipMiddleware, it makes strong ETags weak.
+    """
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.options = get_compression_settings()
+
+    def get_coding(self, request, streaming=False):
+        codings = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        default = codings.get('*', 0.0)
+        candidates = [('br', codings.get('br', default))] if brotli is not None and not streaming else []
+        candidates.append(('gzip', codings.get('gzip', default)))
+        coding, quality = max(candidates, key=lambda candidate: candidate[1])  # br wins ties
+        return coding if quality > 0 else None
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '')
+        if response.has_header('Content-Encoding') or not content_type.startswith(self.options['CONTENT_TYPES']):
+            return response
+        # Server-Sent Events would wait in the compressor's buffer
+        if content_type.startswith('text/event-stream'):
+            return response
+        if not response.streaming and len(response.content) < self.options['MIN_SIZE']:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = self.get_coding(request, response.streaming)
+        if coding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response['Content-Length']
+        else:
+            if coding == 'br':
+                response.content = brotli.compress(response.content, quality=self.options['BROTLI_QUALITY'])
+            else:
+                response.content = gzip.compress(response.content, compresslevel=self.options['GZIP_LEVEL'], mtime=0)
+            response['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = coding
+        return response
@@ -1,16 +1,242 @@
-from collections import OrderedDict
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import partial, reduce
 
-from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from filters_tutorial_back.common.cache import get_generation, make_cache_key, normalize_query_params
+from filters_tutorial_back.common.profiling import timer
+from filters_tutorial_back.common.queryset import estimate_count
+
+COUNT_ESTIMATED = 'estimated'
+
+
+class CountPaginator(DjangoPaginator):
+    """
+    Django paginator that delegates counting to the pagination class.
+    """
+
+    def __init__(self, object_list, per_page, count_function=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_function = count_function
+
+    @cached_property
+    def count(self):
+        if self.count_function is None:
+            return super().count
+        return self.count_function(self.object_list)
 
 
 class Pagination(PageNumberPagination):
+    """
+    Page number pagination. Counts are cached per filter combination until the
+    listed models are written again; `count=estimated` uses database statistics
+    for large result sets, in which case `count_exact` is False.
+    """
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    count_cache_timeout = getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 60)
+    count_estimate_threshold = getattr(settings, 'PAGINATION_COUNT_ESTIMATE_THRESHOLD', 10000)
+    # Parameters that do not change the number of rows.
+    count_ignored_params = ('page', 'page_size', 'ordering', 'count', 'format', 'fields', 'expand', 'explain')
+
+    @property
+    def django_paginator_class(self):
+        return partial(CountPaginator, count_function=self.get_count)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.view = view
+        self.count_exact = True
+        return super().paginate_queryset(queryset, request, view)
+
+    def counts_exactly(self, request):
+        return request.query_params.get(self.count_query_param) != COUNT_ESTIMATED
+
+    def get_count(self, queryset):
+        with timer('count'):
+            return self._get_count(queryset)
+
+    def _get_count(self, queryset):
+        if not self.counts_exactly(self.request):
+            estimate = estimate_count(queryset)
+            if estimate is not None and estimate >= self.count_estimate_threshold:
+                self.count_exact = False
+                return estimate
+
+        if getattr(self.view, 'explain', False) or not self.count_cache_timeout:
+            return queryset.count()
+        key = self.get_count_cache_key(queryset)
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
+    def get_count_cache_key(self, queryset):
+        models = getattr(self.view, 'cache_models', None) or [queryset.model]
+        params = normalize_query_params(self.request.query_params, exclude=self.count_ignored_params)
+        return make_cache_key('count', self.request.path, queryset.db, get_generation(*models), params)
+
+    def cache_count(self, request, view, queryset, count):
+        """
+        Count of the filtered rows the view ran itself, e.g. in the aggregate of its validators.
+        """
+        if self.count_cache_timeout:
+            self.request, self.view = request, view
+            cache.set(self.get_count_cache_key(queryset), count, self.count_cache_timeout)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'data': data,
+            'pagination': {
+                'count': self.page.paginator.count,
+                'count_exact': self.count_exact
+            }
+        })
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination. Instead of `OFFSET n` the next page is selected with
+    `WHERE (ordering columns) > (values of the last row)`, so every page costs the same
+    and no COUNT(*) is run. Works with any ordering made of model fields; the primary
+    key is appended as tiebreaker so the ordering is always total.
+    The mode is chosen by sending the `cursor` parameter (empty for the first page).
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
     page_size_query_param = 'page_size'
+    max_page_size = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.fields = [self.get_field(queryset.model, name.lstrip('-')) for name in self.ordering]
+
+        position, reverse = self.decode_cursor(request)
+        ordering = [self.invert(name) for name in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        values_select = queryset.query.values_select
+        if values_select:
+            # rows are dicts, the cursor values have to be part of them
+            missing = [name.lstrip('-') for name in self.ordering if name.lstrip('-') not in values_select]
+            if missing:
+                queryset = queryset.values(*values_select, *missing)
+        if position is not None:
+            queryset = queryset.filter(self.get_seek_filter(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.first, self.last = (results[0], results[-1]) if results else (None, None)
+        return results
 
     def get_paginated_response(self, data):
-        return Response(OrderedDict({
+        return Response({
             'data': data,
             'pagination': {
-                'count': self.page.paginator.count
+                'next': self.encode_cursor(self.last, reverse=False) if self.has_next else None,
+                'previous': self.encode_cursor(self.first, reverse=True) if self.has_previous else None,
             }
-        }))
+        })
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not all(isinstance(name, str) and name != '?' for name in ordering):
+            raise NotFound('Keyset pagination requires ordering on model fields')
+        ordering = ['-id' if name == '-pk' else 'id' if name == 'pk' else name for name in ordering]
+        pk_name = queryset.model._meta.pk.name
+        if not any(name.lstrip('-') == pk_name for name in ordering):
+            descending = ordering[0].startswith('-') if ordering else False
+            ordering.append('-' + pk_name if descending else pk_name)
+        return ordering
+
+    @staticmethod
+    def get_field(model, lookup):
+        field = None
+        try:
+            for part in lookup.split('__'):
+                field = model._meta.get_field(part)
+                model = field.related_model
+        except FieldDoesNotExist:
+            raise NotFound('Can not paginate on {}'.format(lookup))
+        if field.is_relation:
+            field = field.target_field
+        return field
+
+    @staticmethod
+    def invert(name):
+        return name[1:] if name.startswith('-') else '-' + name
+
+    @staticmethod
+    def get_seek_filter(ordering, position):
+        """
+        Lexicographic comparison on the ordering columns:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+        """
+        conditions = []
+        for index, name in enumerate(ordering):
+            lookup = name.lstrip('-')
+            condition = Q(**{'{}__{}'.format(lookup, 'lt' if name.startswith('-') else 'gt'): position[index]})
+            for previous, value in zip(ordering[:index], position[:index]):
+                condition &= Q(**{previous.lstrip('-'): value})
+            conditions.append(condition)
+        return reduce(lambda left, right: left | right, conditions)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if cursor['o'] != self.ordering:
+                raise ValueError('Ordering has changed')
+            position = [field.to_python(value) for field, value in zip(self.fields, cursor['p'])]
+            if len(position) != len(self.ordering):
+                raise ValueError('Position does not match ordering')
+            return position, bool(cursor['r'])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        position = [self.get_value(obj, name.lstrip('-')) for name in self.ordering]
+        # str() keeps full precision of Decimal and datetime values, field.to_python() reads them back
+        cursor = json.dumps({'o': self.ordering, 'p': position, 'r': reverse}, default=str, separators=(',', ':'))
+        return urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def get_value(obj, lookup):
+        if isinstance(obj, dict):
+            return obj[lookup]
+        *relations, attname = lookup.split('__')
+        for relation in relations:
+            obj = getattr(obj, relation)
+        field = obj._meta.get_field(attname)
+        return getattr(obj, field.attname)
@@ -0,0 +1,118 @@
+"""
+Per request profiling. ProfilingMiddleware activates a Profile for sampled requests;
+code that wants to report a phase wraps it in `timer(name)`, which does nothing when
+no profile is active.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+
+_current_profile = ContextVar('profile', default=None)
+
+# Plan steps reading a whole table: SQLite's SCAN without an index, PostgreSQL's Seq Scan
+TABLE_SCAN_RE = re.compile(r'^SCAN (TABLE )?\S+( AS \S+)?$|\bSeq Scan\b')
+
+
+class Profile:
+    """
+    Timings of one request. Worker threads of the request (see profile_connections()) report
+    to it concurrently, their database time adds up and may exceed the total.
+    """
+    def __init__(self, capture_sql=False):
+        self.start = time.perf_counter()
+        self.capture_sql = capture_sql
+        self.timings = OrderedDict()
+        self.query_count = 0
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper, see connection.execute_wrapper().
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.query_count += 1
+                self.timings['db'] = self.timings.get('db', 0) + duration
+                if self.capture_sql:
+                    self.queries.append((sql, params, duration))
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        data = OrderedDict([('total_ms', round(self.total * 1000, 3)), ('queries', self.query_count)])
+        for name, seconds in self.timings.items():
+            data[name + '_ms'] = round(seconds * 1000, 3)
+        return data
+
+    def server_timing(self):
+        entries = ['total;dur={:.3f}'.format(self.total * 1000)]
+        for name, seconds in self.timings.items():
+            entry = '{};dur={:.3f}'.format(name, seconds * 1000)
+            if name == 'db':
+                entry += ';desc="{} queries"'.format(self.query_count)
+            entries.append(entry)
+        return ', '.join(entries)
+
+
+def get_current_profile():
+    return _current_profile.get()
+
+
+def activate(profile):
+    return _current_profile.set(profile)
+
+
+def deactivate(token):
+    _current_profile.reset(token)
+
+
+@contextmanager
+def profile_connections(profile=None):
+    """
+    Records the queries of the calling thread's connections in `profile`, by default the active one.
+    Connections are per thread: code run for the request in other threads enters this again there.
+    """
+    profile = profile or _current_profile.get()
+    with ExitStack() as stack:
+        if profile is not None:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+        yield
+
+
+@contextmanager
+def timer(name):
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+def explain(connection, sql, params):
+    """
+    The database's plan for a query, one line per step.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('{} {}'.format(connection.ops.explain_query_prefix(), sql), params)
+        return [str(row[-1]) for row in cursor.fetchall()]
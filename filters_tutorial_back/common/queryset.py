@@ -0,0 +1,105 @@
+import json
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+
+@lru_cache(maxsize=None)
+def get_related_fields(serializer_class, fieldset=None):
+    """
+    Walk the (nested) fields of a serializer and collect the relations it will read.
+    Returns a tuple (select_related, prefetch_related) of lookup paths, so that
+    a list view can fetch every row it serializes with a constant number of queries.
+    Joins added by filters or ordering on the same relation are reused by select_related.
+    """
+    select_related, prefetch_related = [], []
+    _collect_related_fields(serializer_class(context={'fieldset': fieldset}), '', select_related, prefetch_related)
+    return tuple(select_related), tuple(prefetch_related)
+
+
+def _collect_related_fields(serializer, prefix, select_related, prefetch_related):
+    for field in serializer.fields.values():
+        if not isinstance(field, BaseSerializer) or field.source == '*':
+            continue
+        path = prefix + field.source.replace('.', '__')
+        if isinstance(field, ListSerializer):
+            prefetch_related.append(path)
+        else:
+            select_related.append(path)
+            _collect_related_fields(field, path + '__', select_related, prefetch_related)
+
+
+@lru_cache(maxsize=None)
+def get_loaded_fields(serializer_class, fieldset):
+    """
+    Model fields read by the serializer trimmed to `fieldset`, as lookups for `queryset.only()`.
+    None when a field is not a plain model field or relation, then whole rows are loaded.
+    """
+    lookups = []
+    if not _collect_loaded_fields(serializer_class(context={'fieldset': fieldset}), '', lookups):
+        return None
+    return tuple(lookups)
+
+
+def _collect_loaded_fields(serializer, prefix, lookups):
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+    if model is None:
+        return False
+    lookups.append(prefix + model._meta.pk.name)
+    for field in serializer.fields.values():
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return False
+        if isinstance(field, ListSerializer) or not model_field.concrete or model_field.many_to_many:
+            return False
+        lookups.append(prefix + model_field.name)
+        if isinstance(field, BaseSerializer) and not _collect_loaded_fields(field, prefix + model_field.name + '__', lookups):
+            return False
+    return True
+
+
+def optimize_queryset(queryset, serializer_class, fieldset=None):
+    """
+    Apply select_related/prefetch_related needed by the given serializer and,
+    for a sparse fieldset, only() the columns it reads.
+    """
+    if serializer_class is None:
+        return queryset
+    select_related, prefetch_related = get_related_fields(serializer_class, fieldset)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    if fieldset is not None and fieldset.fields is not None:
+        loaded_fields = get_loaded_fields(serializer_class, fieldset)
+        if loaded_fields is not None:
+            queryset = queryset.only(*loaded_fields)
+    return queryset
+
+
+def estimate_count(queryset):
+    """
+    Row estimate from the database statistics instead of a COUNT(*).
+    PostgreSQL estimates any query through the planner, SQLite only knows the size
+    of whole tables (after ANALYZE). Returns None when no estimate is available.
+    """
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            sql, params = queryset.order_by().values('pk').query.sql_with_params()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        if connection.vendor == 'sqlite' and not queryset.query.where:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
@@ -0,0 +1,36 @@
+"""
+JSON rendering with orjson, a C encoder that writes UTF-8 bytes directly. Its output is the one
+of DRF's JSONRenderer (compact, unicode, datetimes in ISO 8601 with Z for UTC) except for floats:
+exponents are written without sign and padding (1e16, not 1e+16, the same number), and NaN and
+Infinity become null where JSONRenderer, with STRICT_JSON, raises a ValueError. Values orjson does not
+know (Decimal, lazy strings, ...) go through DRF's encoder, data it refuses (integers beyond 64 bits)
+is rendered by JSONRenderer. Without orjson installed, for indented output (browsable API) or with
+STRICT_JSON off (NaN and Infinity written as such), JSONRenderer renders.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ORJSON_OPTIONS = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+
+
+class FastJSONRenderer(JSONRenderer):
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii or not self.strict:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, default=self.encoder.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # JSONRenderer escapes the line and paragraph separators, which JavaScript strings can not hold
+        if b'\xe2\x80\xa8' in content or b'\xe2\x80\xa9' in content:
+            content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return content
@@ -0,0 +1,59 @@
+"""
+Read replicas. Every query goes to the primary ('default') unless a view activates a replica
+for its request (see api_views.ReplicaReadMixin), so only reads that tolerate replication lag
+leave the primary. Clients that wrote recently carry a cookie (set by ReplicaPinMiddleware)
+and keep reading from the primary, so they see their own writes.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_PIN_COOKIE = 'replica_pin'
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def is_pinned(request):
+    return REPLICA_PIN_COOKIE in request.COOKIES
+
+
+def pin(response):
+    response.set_cookie(REPLICA_PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 10), httponly=True)
+
+
+def activate_replica():
+    """
+    Send the reads of the current request (context) to one replica, picked at random.
+    Returns False when no replica is configured.
+    """
+    replicas = get_replicas()
+    if not replicas:
+        return False
+    _read_alias.set(random.choice(replicas))
+    return True
+
+
+def deactivate_replica():
+    # set() rather than reset(token): the ASGI views activate and deactivate in different worker threads
+    _read_alias.set(None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # without this, instances loaded from a replica would be saved back to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,82 @@
+"""
+Full-text search over an index table maintained by database triggers.
+SQLite uses an FTS5 virtual table, PostgreSQL a table with a GIN indexed tsvector column.
+In both the searchable document is the column named like the table itself (FTS5 requires that),
+so the same field, lookup and rank expression work on either backend.
+"""
+import re
+
+from django.db import NotSupportedError
+from django.db.models import FloatField, Func, Lookup, TextField
+
+# Words of the search text, everything else (quotes, operators) is dropped.
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def get_words(value):
+    return WORD_RE.findall(value or '')
+
+
+def to_fts5_query(value):
+    """
+    Every word has to match, the last one as a prefix so results show up while typing.
+    """
+    words = ['"{}"'.format(word) for word in get_words(value)]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def to_tsquery(value):
+    words = get_words(value)
+    if words:
+        words[-1] += ':*'
+    return ' & '.join(words)
+
+
+class SearchDocumentField(TextField):
+    """
+    The searchable document of an index table, filtered with `__match`.
+    """
+
+
+@SearchDocumentField.register_lookup
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError('Full-text search is not supported on {}'.format(connection.vendor))
+
+    def as_sqlite(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        return '{} MATCH %s'.format(lhs), lhs_params + [to_fts5_query(self.rhs)]
+
+    def as_postgresql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        return "{} @@ to_tsquery('simple', %s)".format(lhs), lhs_params + [to_tsquery(self.rhs)]
+
+
+class SearchRank(Func):
+    """
+    Relevance of a match, lower is better: FTS5's bm25() and the negated ts_rank().
+    `weights` are per column of the FTS5 table, PostgreSQL uses the weights set in the document.
+    """
+    output_field = FloatField()
+
+    def __init__(self, expression, value, weights=()):
+        super().__init__(expression)
+        self.value = value
+        self.weights = weights
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError('Full-text search is not supported on {}'.format(connection.vendor))
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # bm25() takes the table (hidden column) itself, the MATCH of the query provides the words
+        sql, params = compiler.compile(self.source_expressions[0])
+        weights = ''.join(', {:f}'.format(weight) for weight in self.weights)
+        return 'bm25({}{})'.format(sql, weights), params
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return "-ts_rank({}, to_tsquery('simple', %s))".format(sql), params + [to_tsquery(self.value)]
@@ -0,0 +1,238 @@
+import decimal
+from collections import namedtuple
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError as DjangoValidationError
+from rest_framework import fields as drf_fields
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.serializers import BaseSerializer, ListSerializer
+from rest_framework.settings import api_settings
+
+
+# Sparse fieldset of a request: `fields` is a tuple of field names (None for all of them),
+# `expand` the nested serializers rendered as objects.
+Fieldset = namedtuple('Fieldset', ['fields', 'expand'])
+
+
+def apply_fieldset(fields, fieldset):
+    """
+    Trim a serializer's fields to `fieldset`, in place. Fields named in `expand` are included
+    as well; with a field list, nested serializers that are not expanded become primary keys.
+    """
+    if fieldset is None or fieldset.fields is None:
+        return fields
+    selected = set(fieldset.fields) | set(fieldset.expand)
+    for name, field in list(fields.items()):
+        if name not in selected:
+            del fields[name]
+        elif isinstance(field, BaseSerializer) and name not in fieldset.expand:
+            fields[name] = PrimaryKeyRelatedField(read_only=True, many=isinstance(field, ListSerializer), source=field.source)
+    return fields
+
+
+class SparseFieldsetMixin:
+    """
+    Model serializer mixin applying the `fieldset` of the serializer context (see CustomListAPIView.get_fieldset).
+    Only the top level serializer is trimmed.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent.parent if isinstance(self.parent, ListSerializer) else self.parent
+        if parent is None:
+            apply_fieldset(fields, self.context.get('fieldset'))
+        return fields
+
+
+class ValuesSerializer(BaseSerializer):
+    """
+    Read only serializer for rows of `queryset.values()`, producing exactly the output of
+    `model_serializer_class`. The field tree of the model serializer is compiled once into
+    a flat list of (lookup, converter) pairs, so a row is rendered with one dict lookup and
+    one cheap conversion per field instead of DRF's per field machinery and model instances.
+
+    Only plain model fields and nested (single) model serializers are supported. A `fieldset`
+    in the context is honoured when the model serializer uses SparseFieldsetMixin, each fieldset
+    has its own plan.
+    """
+    model_serializer_class = None
+
+    @classmethod
+    def get_plan(cls, fieldset=None):
+        if '_plans' not in cls.__dict__:
+            if cls.model_serializer_class is None:
+                raise ImproperlyConfigured("'%s' should include a `model_serializer_class` attribute." % cls.__name__)
+            cls._plans = {}
+        if fieldset not in cls._plans:
+            cls._plans[fieldset] = _compile(cls.model_serializer_class(context={'fieldset': fieldset}), '')
+        return cls._plans[fieldset]
+
+    @classmethod
+    def get_values_fields(cls, fieldset=None):
+        """
+        Lookups to pass to `queryset.values()`.
+        """
+        lookups = []
+        _collect_lookups(cls.get_plan(fieldset), lookups)
+        return lookups
+
+    def to_representation(self, row):
+        return _render(self.get_plan(self.context.get('fieldset')), row)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        kwargs['child'] = cls()
+        return ValuesListSerializer(*args, **kwargs)
+
+
+class ValuesListSerializer(ListSerializer):
+
+    def to_representation(self, data):
+        plan = self.child.get_plan(self.context.get('fieldset'))
+        return [_render(plan, row) for row in data]
+
+
+def _render(plan, row):
+    fields, null_lookup = plan
+    if null_lookup is not None and row[null_lookup] is None:
+        return None
+    data = {}
+    for name, lookup, convert in fields:
+        if convert is None:
+            data[name] = _render(lookup, row)
+        else:
+            value = row[lookup]
+            data[name] = None if value is None else convert(value)
+    return data
+
+
+def _collect_lookups(plan, lookups):
+    fields, null_lookup = plan
+    if null_lookup is not None:
+        lookups.append(null_lookup)
+    for name, lookup, convert in fields:
+        if convert is None:
+            _collect_lookups(lookup, lookups)
+        else:
+            lookups.append(lookup)
+
+
+def _compile(serializer, prefix, null_lookup=None):
+    """
+    Plan of a serializer: ([(field name, lookup, converter)], lookup that is NULL when the whole object is).
+    Nested serializers are stored as (field name, nested plan, None).
+    """
+    fields = []
+    for field in serializer._readable_fields:
+        if field.source == '*' or isinstance(field, (ListSerializer, drf_fields.SerializerMethodField)):
+            raise ImproperlyConfigured("Field '{}' can not be read from queryset values.".format(field.field_name))
+        lookup = prefix + field.source.replace('.', '__')
+        if isinstance(field, BaseSerializer):
+            fields.append((field.field_name, _compile(field, lookup + '__', null_lookup=lookup), None))
+        else:
+            fields.append((field.field_name, lookup, _get_converter(field)))
+    return fields, null_lookup
+
+
+def _get_converter(field):
+    if isinstance(field, PrimaryKeyRelatedField):
+        # values() returns the key itself
+        return field.pk_field.to_representation if field.pk_field is not None else _identity
+    if isinstance(field, drf_fields.DecimalField):
+        return _decimal_converter(field)
+    if isinstance(field, drf_fields.DateTimeField):
+        return _datetime_converter(field)
+    if isinstance(field, drf_fields.BooleanField):
+        return bool
+    if isinstance(field, drf_fields.IntegerField):
+        return int
+    if type(field) in (drf_fields.CharField, drf_fields.EmailField, drf_fields.SlugField):
+        return str
+    return field.to_representation
+
+
+def _identity(value):
+    return value
+
+
+def _decimal_converter(field):
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.localize or field.decimal_places is None:
+        return field.to_representation
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        value = value.quantize(exponent, rounding=rounding, context=context)
+        return '{:f}'.format(value) if coerce_to_string else value
+    return convert
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != drf_fields.ISO_8601:
+        return field.to_representation
+
+    def convert(value):
+        if not value:
+            return None
+        value = field.enforce_timezone(value).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+class BulkListSerializer(ListSerializer):
+    """
+    List serializer for bulk writes. Related objects referenced by primary key are
+    loaded with one query per field for the whole list, instead of one per item.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            return super().to_internal_value(data)
+        fields = [
+            field for field in self.child._writable_fields
+            if isinstance(field, PrimaryKeyRelatedField) and field.queryset is not None and field.pk_field is None
+        ]
+        querysets = {field: field.queryset for field in fields}
+        try:
+            for field in fields:
+                field.queryset = _PreloadedQuerySet(field.get_queryset(), [item.get(field.field_name) for item in data if isinstance(item, dict)])
+            return super().to_internal_value(data)
+        finally:
+            for field, queryset in querysets.items():
+                field.queryset = queryset
+
+
+class _PreloadedQuerySet:
+    """
+    Stands in for the queryset of a PrimaryKeyRelatedField, answering get(pk=...) from memory.
+    """
+
+    def __init__(self, queryset, pks):
+        self.model = queryset.model
+        self.pk_field = self.model._meta.pk
+        self.objects = queryset.in_bulk({pk for pk in map(self.to_python, pks) if pk is not None})
+
+    def to_python(self, value):
+        try:
+            return self.pk_field.to_python(value)
+        except DjangoValidationError:
+            return None
+
+    def get(self, pk):
+        if isinstance(pk, (dict, list, bool)):
+            raise TypeError(pk)
+        value = self.to_python(pk)
+        if value is None:
+            raise ValueError(pk)
+        try:
+            return self.objects[value]
+        except KeyError:
+            raise self.model.DoesNotExist
@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Sent after bulk writes that bypass post_save/post_delete (bulk_create, queryset.update()/delete()).
+# Arguments: sender (model), action ('create', 'update' or 'delete'), objs (created instances) or queryset (affected rows),
+# fields (names of the fields an update set, when known).
+post_bulk_change = Signal()
+
+BULK_CREATE = 'create'
+BULK_UPDATE = 'update'
+BULK_DELETE = 'delete'
@@ -43,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'filters_tutorial_back.common.middleware.ProfilingMiddleware',
+    'filters_tutorial_back.common.middleware.CompressionMiddleware',
+    'filters_tutorial_back.common.middleware.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -55,16 +58,77 @@ MIDDLEWARE = [
 
 CORS_ORIGIN_ALLOW_ALL = True
 
+# Request profiling, see filters_tutorial_back.common.middleware.ProfilingMiddleware
+PROFILING = {
+    'ENABLED': os.environ.get('PROFILING_ENABLED') == '1',
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', 1.0)),
+    'SLOW_REQUEST_MS': 500,
+}
+
+# ?explain=1 on list endpoints returns their SQL and query plans, defaults to DEBUG
+# QUERY_EXPLAIN_ENABLED = False
+
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': (
-        'django_filters.rest_framework.DjangoFilterBackend',
-        'rest_framework.filters.OrderingFilter'
+        'filters_tutorial_back.common.filters.FilterBackend',
+        'filters_tutorial_back.common.filters.OrderingFilter'
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
     'PAGE_SIZE': 10,
     'DEFAULT_PAGINATION_CLASS': 'filters_tutorial_back.common.pagination.Pagination',
+    'DEFAULT_RENDERER_CLASSES': [
+        'filters_tutorial_back.common.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Response compression, see filters_tutorial_back.common.middleware.CompressionMiddleware
+COMPRESSION = {
+    'MIN_SIZE': 1024,
+}
+
+# Seconds a pagination count is cached for a filter combination (0 disables the cache)
+PAGINATION_COUNT_CACHE_TIMEOUT = 60
+# `?count=estimated` only uses the database estimate above this many rows
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = 10000
+# Seconds a list response is cached, for views declaring cache_models (0 disables the cache)
+LIST_RESPONSE_CACHE_TIMEOUT = 30
+# Seconds the ETag / Last-Modified inputs (newest change and count) of a list are cached
+LIST_VALIDATORS_CACHE_TIMEOUT = 60
+# Rows per INSERT and maximum list size of bulk create requests
+BULK_CREATE_BATCH_SIZE = 500
+BULK_CREATE_MAX_ITEMS = 10000
+
+# Background jobs, run by `python manage.py run_jobs`. A running job that reports no progress for
+# JOB_STALE_SECONDS is taken as lost with its worker and run again, up to JOB_MAX_ATTEMPTS times.
+JOB_STALE_SECONDS = 600
+JOB_MAX_ATTEMPTS = 3
+
+# Changes feed (/orders/changes/): changes of the last seconds are held back until concurrent
+# transactions committed, tombstones of deleted orders are kept this many days (orders.prune_tombstones job)
+DELTA_SYNC_SETTLE_SECONDS = 5
+DELTA_SYNC_TOMBSTONE_DAYS = 30
+
+# Event streams (/stream/orders/): seconds between keep-alive comments of an idle stream, writes
+# changing more rows are sent as a `reset` event (clients reload) instead of their ids
+EVENT_STREAM_HEARTBEAT_SECONDS = 15
+EVENT_STREAM_MAX_IDS = 1000
+
+# `python manage.py archive_orders` (or the orders.archive job) moves orders created this many days ago,
+# and deleted orders unchanged for ORDER_ARCHIVE_DELETED_DAYS, to sc_order_archive
+ORDER_ARCHIVE_DAYS = 365
+ORDER_ARCHIVE_DELETED_DAYS = 30
+
+# Cached counts, validators and responses are keyed on the generations of their models (see common.cache),
+# kept in the default cache. LocMemCache is per process: with several web processes, or `run_jobs` workers
+# (reindex, archive, replayed bulk requests), use a backend they share, e.g.
+# 'django.core.cache.backends.filebased.FileBasedCache' with a common LOCATION, or Redis.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
 }
 
 ROOT_URLCONF = 'filters_tutorial_back.urls'
@@ -98,6 +162,37 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database, e.g. DATABASE_REPLICAS=/data/replica1.sqlite3,/data/replica2.sqlite3
+# List and retrieve GETs read from them, see filters_tutorial_back.common.routers
+DATABASE_REPLICAS = []
+for number, name in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+    alias = 'replica{}'.format(number)
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+# DATABASE_PROFILE=performance keeps connections open between requests (checked before reuse)
+# and tunes SQLite: WAL lets readers run alongside the writer, synchronous=NORMAL syncs on
+# checkpoints only, plus a 256MB memory map and a 64MB page cache per connection. Write
+# transactions take the lock when they begin, so concurrent writers wait instead of failing.
+# See filters_tutorial_back.common.db, `python manage.py benchmark mixed_load` compares the profiles.
+DATABASE_PERFORMANCE_PROFILE = {
+    'CONN_MAX_AGE': 600,
+    'CONN_HEALTH_CHECKS': True,
+    'TRANSACTION_MODE': 'IMMEDIATE',
+    'PRAGMAS': {'journal_mode': 'wal', 'synchronous': 'normal', 'mmap_size': 256 * 2 ** 20, 'cache_size': -64 * 2 ** 10},
+}
+if os.environ.get('DATABASE_PROFILE') == 'performance':
+    for database in DATABASES.values():
+        database.update(DATABASE_PERFORMANCE_PROFILE)
+
+DATABASE_ROUTERS = ['filters_tutorial_back.common.routers.ReplicaRouter']
+# Seconds a client keeps reading from the primary after a write, longer than the replication lag
+REPLICA_PIN_SECONDS = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -133,3 +228,6 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Uploaded files and job results
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
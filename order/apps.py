@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class OrderConfig(AppConfig):
     name = 'order'
+
+    def ready(self):
+        from filters_tutorial_back.common import db  # noqa: F401
+        from order import jobs, signals  # noqa: F401
@@ -0,0 +1,386 @@
+"""
+Benchmarks for the orders API, run with `python manage.py benchmark <name>`.
+Each benchmark is registered with @benchmark, writes its report through `write` and
+receives the command options as keyword arguments. It may return a summary dict with
+p95_ms, which the command compares against --max-p95.
+Seed data for them with `python manage.py seed_orders`.
+"""
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections, connection, connections, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+
+from filters_tutorial_back.common.async_views import AsyncListView
+from filters_tutorial_back.common.middleware import brotli, get_compression_settings
+from filters_tutorial_back.common.renderers import FastJSONRenderer, orjson
+from order.models import Order
+from order.serializers import OrderSerializer, OrderValuesSerializer
+from order.views import OrderListCreateAPIView
+
+BENCHMARKS = {}
+
+
+def benchmark(function):
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def measure(function, repeat):
+    """
+    Run function `repeat` times, returns the timings in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def percentile(timings, percent):
+    ordered = sorted(timings)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def format_row(*columns):
+    return ''.join('{:>14}'.format(column) for column in columns)
+
+
+@benchmark
+def serializers(write, repeat=20, sizes=(10, 100, 1000), **options):
+    """
+    OrderSerializer over model instances against OrderValuesSerializer over values(),
+    both rendered to JSON. Timings include the query.
+    """
+    renderer = JSONRenderer()
+    write(format_row('rows', 'serializer ms', 'values ms', 'speedup'))
+    for size in sizes:
+        def model_serializer():
+            orders = Order.objects.select_related('user')[:size]
+            return renderer.render(OrderSerializer(orders, many=True).data)
+
+        def values_serializer():
+            rows = Order.objects.values(*OrderValuesSerializer.get_values_fields())[:size]
+            return renderer.render(OrderValuesSerializer(rows, many=True).data)
+
+        if model_serializer() != values_serializer():
+            raise AssertionError('OrderValuesSerializer output differs from OrderSerializer')
+        slow = statistics.median(measure(model_serializer, repeat))
+        fast = statistics.median(measure(values_serializer, repeat))
+        write(format_row(size, '{:.2f}'.format(slow), '{:.2f}'.format(fast), '{:.1f}x'.format(slow / fast)))
+
+
+@benchmark
+def bulk_create(write, repeat=20, rows=500, **options):
+    """
+    POST /orders/ one object per request against one list payload. Everything is rolled back.
+    """
+    client = Client()
+    url = reverse('orders')
+    write(format_row('mode', 'rows', 'seconds', 'rows/s'))
+    with transaction.atomic():
+        user = User.objects.create(username='benchmark-bulk-create')
+        payload = [{'user': user.pk, 'customer': 'Benchmark {}'.format(i), 'amount': i + 1, 'price': '10.00', 'notes': 'Benchmark'} for i in range(rows)]
+
+        start = time.perf_counter()
+        for item in payload:
+            client.post(url, json.dumps(item), content_type='application/json')
+        single = time.perf_counter() - start
+
+        timings = measure(lambda: client.post(url, json.dumps(payload), content_type='application/json'), max(1, repeat // 4))
+        bulk = statistics.median(timings) / 1000
+        transaction.set_rollback(True)
+
+    write(format_row('single', rows, '{:.3f}'.format(single), '{:.0f}'.format(rows / single)))
+    write(format_row('bulk', rows, '{:.3f}'.format(bulk), '{:.0f}'.format(rows / bulk)))
+
+
+@benchmark
+def render(write, repeat=20, sizes=(100, 1000), **options):
+    """
+    Rendering a page of /orders/ (OrderSerializer output in the pagination envelope) with DRF's
+    JSONRenderer and FastJSONRenderer, then the bytes on the wire with gzip and brotli at the
+    levels CompressionMiddleware uses, and the time compressing takes.
+    """
+    if orjson is None:
+        write('orjson is not installed, FastJSONRenderer falls back to JSONRenderer')
+    compression = get_compression_settings()
+    codings = [('gzip', lambda content: gzip.compress(content, compresslevel=compression['GZIP_LEVEL'], mtime=0))]
+    if brotli is not None:
+        codings.append(('br', lambda content: brotli.compress(content, quality=compression['BROTLI_QUALITY'])))
+    write(format_row('rows', 'renderer', 'ms', 'speedup', 'coding', 'bytes', 'ms'))
+    for size in sizes:
+        data = {'data': OrderSerializer(Order.objects.select_related('user')[:size], many=True).data, 'pagination': {'count': size, 'count_exact': True}}
+        content = JSONRenderer().render(data)
+        if FastJSONRenderer().render(data) != content:
+            raise AssertionError('FastJSONRenderer output differs from JSONRenderer')
+        slow = statistics.median(measure(lambda: JSONRenderer().render(data), repeat))
+        fast = statistics.median(measure(lambda: FastJSONRenderer().render(data), repeat))
+        write(format_row(size, 'JSONRenderer', '{:.2f}'.format(slow), '', 'identity', len(content), ''))
+        write(format_row(size, 'FastJSON', '{:.2f}'.format(fast), '{:.1f}x'.format(slow / fast)))
+        for coding, compress in codings:
+            elapsed = statistics.median(measure(lambda: compress(content), repeat))
+            write(format_row(size, '', '', '', coding, len(compress(content)), '{:.2f}'.format(elapsed)))
+
+
+ORDERINGS = [None, None, 'id', '-date_created', 'price', '-amount', 'customer', 'user__last_name']
+PAGE_SIZES = [10, 10, 10, 25, 50, 100]
+PAGES = [1, 1, 1, 2, 3]
+# Broad queries also browse deep pages
+DEEP_PAGES = PAGES + [10, 50, 200]
+
+
+def random_list_params(rng, customers, usernames, dates):
+    """
+    One /orders/ query as dashboards send them: a filter kind, ordering and page.
+    """
+    kind = rng.choice(['none', 'deleted', 'customer', 'amount', 'price', 'date', 'username', 'combined'])
+    params = {'page_size': rng.choice(PAGE_SIZES), 'page': rng.choice(DEEP_PAGES if kind in ('none', 'deleted') else PAGES)}
+    ordering = rng.choice(ORDERINGS)
+    if ordering:
+        params['ordering'] = ordering
+    if kind in ('deleted', 'combined'):
+        params['deleted'] = 'false'
+    if kind in ('customer', 'combined'):
+        params['customer'] = rng.choice(customers)[:rng.randint(3, 6)]
+    if kind in ('amount', 'combined'):
+        low = rng.randint(1, 900)
+        params.update(amount_min=low, amount_max=low + rng.randint(10, 100))
+    if kind == 'price':
+        low = rng.randint(1, 900)
+        params.update(price_min=low, price_max=low + rng.randint(10, 100))
+    if kind in ('date', 'combined'):
+        start = rng.choice(dates)
+        params.update(date_created_after=start.isoformat(), date_created_before=(start + datetime.timedelta(days=rng.randint(1, 60))).isoformat())
+    if kind == 'username':
+        params['username'] = rng.choice(usernames)[-3:]
+    return kind, params
+
+
+@benchmark
+def api(write, requests=300, seed=1, cached=False, **options):
+    """
+    Random but reproducible mix of filters, orderings and page sizes against /orders/
+    through the test client. Latency percentiles and queries per request, per filter kind.
+    Caches are cleared before each request unless `cached` is set.
+    """
+    rng = random.Random(seed)
+    client = Client()
+    url = reverse('orders')
+    customers = list(Order.objects.values_list('customer', flat=True)[:200]) or ['customer']
+    usernames = list(User.objects.values_list('username', flat=True)[:200]) or ['user']
+    dates = list(Order.objects.dates('date_created', 'day')) or [datetime.date.today()]
+
+    timings, queries, errors = defaultdict(list), defaultdict(list), 0
+    request_logger = logging.getLogger('django.request')
+    level, request_logger.level = request_logger.level, logging.ERROR  # no warning per 404
+    for _ in range(requests):
+        kind, params = random_list_params(rng, customers, usernames, dates)
+        if not cached:
+            cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = client.get(url, params)
+            elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            errors += 1  # e.g. a page past the end
+        for key in (kind, 'all'):
+            timings[key].append(elapsed)
+            queries[key].append(len(context.captured_queries))
+    request_logger.setLevel(level)
+
+    write(format_row('kind', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'queries/req'))
+    for kind in sorted(timings, key=lambda key: (key == 'all', key)):
+        write(format_row(
+            kind, len(timings[kind]),
+            *('{:.2f}'.format(percentile(timings[kind], percent)) for percent in (50, 95, 99)),
+            '{:.2f}'.format(statistics.mean(queries[kind]))
+        ))
+    write('{} responses other than 200'.format(errors))
+    return {'p95_ms': percentile(timings['all'], 95)}
+
+
+@benchmark
+def async_list(write, requests=300, seed=1, concurrency=50, threads=4, delay=0.05, **options):
+    """
+    The same request mix against the WSGI view and the ASGI list view, sent by `concurrency`
+    clients that need `delay` seconds to read a response. Both servers get `threads` threads:
+    a WSGI thread stays busy while its client reads, the ASGI view only holds threads for queries.
+    Latencies include the time a request waits for a free thread.
+    """
+    rng = random.Random(seed)
+    customers = list(Order.objects.values_list('customer', flat=True)[:200]) or ['customer']
+    usernames = list(User.objects.values_list('username', flat=True)[:200]) or ['user']
+    dates = list(Order.objects.dates('date_created', 'day')) or [datetime.date.today()]
+    query_strings = [urlencode(random_list_params(rng, customers, usernames, dates)[1]) for _ in range(requests)]
+    application = AsyncListView(OrderListCreateAPIView)
+
+    def wsgi_request(query_string):
+        try:
+            status = Client().get(reverse('orders'), QUERY_STRING=query_string).status_code
+        finally:
+            close_old_connections()
+        time.sleep(delay)
+        return status
+
+    async def asgi_request(query_string):
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/async/orders/', 'root_path': '', 'scheme': 'http',
+            'query_string': query_string.encode('latin1'), 'headers': [], 'server': ('testserver', 80),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+            if message['type'] == 'http.response.body':
+                await asyncio.sleep(delay)
+
+        await application(scope, receive, send)
+        return messages[0]['status']
+
+    async def run(name):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(threads)
+        loop.set_default_executor(executor)
+        clients = asyncio.Semaphore(concurrency)
+
+        async def client(query_string):
+            async with clients:
+                start = time.perf_counter()
+                if name == 'wsgi':
+                    status = await loop.run_in_executor(executor, wsgi_request, query_string)
+                else:
+                    status = await asgi_request(query_string)
+                return status, (time.perf_counter() - start) * 1000
+
+        return await asyncio.gather(*(client(query_string) for query_string in query_strings))
+
+    request_logger = logging.getLogger('django.request')
+    level, request_logger.level = request_logger.level, logging.ERROR
+    write(format_row('path', 'requests', 'seconds', 'req/s', 'p50 ms', 'p95 ms', 'non 200'))
+    summary = {}
+    for name in ('wsgi', 'asgi'):
+        cache.clear()
+        start = time.perf_counter()
+        results = asyncio.run(run(name))
+        elapsed = time.perf_counter() - start
+        timings = [timing for status, timing in results]
+        summary[name] = percentile(timings, 95)
+        write(format_row(
+            name, len(results), '{:.2f}'.format(elapsed), '{:.1f}'.format(len(results) / elapsed),
+            '{:.2f}'.format(percentile(timings, 50)), '{:.2f}'.format(summary[name]),
+            sum(status != 200 for status, timing in results)
+        ))
+    request_logger.setLevel(level)
+    return {'p95_ms': summary['asgi']}
+
+
+MIXED_LOAD_PROFILES = [
+    ('default', {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'TRANSACTION_MODE': None, 'PRAGMAS': {'journal_mode': 'delete'}}),
+    ('performance', settings.DATABASE_PERFORMANCE_PROFILE),
+]
+
+
+@benchmark
+def mixed_load(write, requests=300, seed=1, concurrency=8, write_share=0.2, **options):
+    """
+    `concurrency` client threads send the same mix of /orders/ reads and order creations (`write_share`),
+    first with the default database settings (a new connection per request, rollback journal),
+    then with settings.DATABASE_PERFORMANCE_PROFILE. The created orders are deleted afterwards
+    and the database gets its journal mode back. SQLite only.
+    """
+    if connection.vendor != 'sqlite':
+        write('mixed_load needs SQLite, skipped')
+        return {}
+    rng = random.Random(seed)
+    customers = list(Order.objects.values_list('customer', flat=True)[:200]) or ['customer']
+    usernames = list(User.objects.values_list('username', flat=True)[:200]) or ['user']
+    dates = list(Order.objects.dates('date_created', 'day')) or [datetime.date.today()]
+    user = User.objects.order_by('pk').first() or User.objects.create(username='benchmark-mixed-load')
+    marker = 'Benchmark mixed load'
+    jobs = []
+    for number in range(requests):
+        if rng.random() < write_share:
+            payload = {'user': user.pk, 'customer': marker, 'amount': number + 1, 'price': '10.00', 'notes': marker}
+            jobs.append(('write', json.dumps(payload)))
+        else:
+            jobs.append(('read', urlencode(random_list_params(rng, customers, usernames, dates)[1])))
+
+    def worker(queue, lock, results):
+        client = Client(raise_request_exception=False)
+        try:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    kind, data = queue.pop()
+                start = time.perf_counter()
+                if kind == 'write':
+                    response = client.post(reverse('orders'), data, content_type='application/json')
+                else:
+                    response = client.get(reverse('orders'), QUERY_STRING=data)
+                results.append((kind, response.status_code, (time.perf_counter() - start) * 1000))
+        finally:
+            connections.close_all()  # persistent connections belong to this thread
+
+    original = dict(connections.databases[connection.alias])
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        journal_mode = cursor.fetchone()[0]
+    request_logger = logging.getLogger('django.request')
+    level, request_logger.level = request_logger.level, logging.CRITICAL  # no log per locked database
+    write(format_row('profile', 'kind', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'errors'))
+    summary = {}
+    try:
+        for name, profile in MIXED_LOAD_PROFILES:
+            connections.close_all()
+            connections.databases[connection.alias].update(profile)
+            connection.ensure_connection()  # applies the journal mode to the file
+            cache.clear()
+            queue, lock, results = list(reversed(jobs)), threading.Lock(), []
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as executor:
+                for _ in range(concurrency):
+                    executor.submit(worker, queue, lock, results)
+            elapsed = time.perf_counter() - start
+            for kind in ('read', 'write', 'all'):
+                rows = [(status, timing) for row_kind, status, timing in results if kind in (row_kind, 'all')]
+                timings = [timing for status, timing in rows]
+                if not timings:
+                    continue
+                write(format_row(
+                    name, kind, len(rows), '{:.1f}'.format(len(rows) / elapsed),
+                    '{:.2f}'.format(percentile(timings, 50)), '{:.2f}'.format(percentile(timings, 95)),
+                    sum(status >= 500 for status, timing in rows)
+                ))
+            summary[name] = percentile([timing for kind, status, timing in results], 95)
+    finally:
+        request_logger.setLevel(level)
+        connections.close_all()
+        connections.databases[connection.alias].clear()
+        connections.databases[connection.alias].update(original)
+        Order.objects.filter(customer=marker, notes=marker).delete()
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+    return {'p95_ms': summary.get('performance', 0)}
@@ -1,6 +1,19 @@
+from django.db.models import Q
 from django_filters import rest_framework as filters
 
-from order.models import Order
+from filters_tutorial_back.common.search import SearchRank, get_words
+from order.models import Order, OrderDailySummary, OrderWithArchive, has_triggers
+
+# bm25() weights of the FTS5 columns: customer, notes, user_name
+SEARCH_WEIGHTS = (10.0, 1.0, 5.0)
+# searched with icontains on databases without the index
+SEARCH_FIELDS = ['customer', 'notes', 'user_first_name', 'user_last_name', 'user_username']
+
+# ?archive=: archived orders are listed when the date_created range needs them, always or never
+ARCHIVE_AUTO = 'auto'
+ARCHIVE_INCLUDE = 'include'
+ARCHIVE_EXCLUDE = 'exclude'
+ARCHIVE_CHOICES = [(ARCHIVE_AUTO, 'Auto'), (ARCHIVE_INCLUDE, 'Include'), (ARCHIVE_EXCLUDE, 'Exclude')]
 
 
 class OrderFilter(filters.FilterSet):
@@ -8,9 +21,16 @@ class OrderFilter(filters.FilterSet):
     amount = filters.RangeFilter()
     price = filters.RangeFilter()
     date_created = filters.DateTimeFromToRangeFilter()
-    user__first_name = filters.CharFilter(lookup_expr='icontains')
-    user__last_name = filters.CharFilter(lookup_expr='icontains')
-    username = filters.CharFilter(field_name='user__username', method='get_username')
+    # the copies of the user's names on the order, no join to auth_user. LIKE '%value%' is served by
+    # trigram indexes on PostgreSQL (migration 0013), elsewhere it scans sc_order
+    user__first_name = filters.CharFilter(field_name='user_first_name', lookup_expr='icontains')
+    user__last_name = filters.CharFilter(field_name='user_last_name', lookup_expr='icontains')
+    username = filters.CharFilter(field_name='user_username', method='get_username')
+    q = filters.CharFilter(method='search')
+    archive = filters.ChoiceFilter(choices=ARCHIVE_CHOICES, method='filter_archive')
+    # filters of date_created ranges, the archive is read when they reach into it
+    date_range_filters = ['date_created']
+    source_models = [OrderWithArchive]
 
     class Meta:
         model = Order
@@ -43,3 +63,68 @@ class OrderFilter(filters.FilterSet):
         return queryset.filter(**{
             name + '__icontains': value
             })
+
+    def filter_archive(self, queryset, name, value):
+        """
+        Picks the table, see get_source_queryset().
+        """
+        return queryset
+
+    def get_source_queryset(self):
+        """
+        The orders the (valid) filters apply to: sc_order, or OrderWithArchive when archived orders
+        can match. By default only a date_created range starting before the newest archived order
+        reaches into the archive (ranges combine, the latest start counts), a list without one shows
+        the orders of sc_order.
+        Searches (q) cover sc_order only, the archive is not indexed.
+        """
+        data = self.form.cleaned_data
+        archive = data.get('archive') or ARCHIVE_AUTO
+        if archive == ARCHIVE_EXCLUDE or data.get('q'):
+            return Order.objects.all()
+        if archive == ARCHIVE_INCLUDE:
+            return OrderWithArchive.objects.all()
+        ranges = [data[name] for name in self.date_range_filters if data.get(name)]
+        if not ranges:
+            return Order.objects.all()
+        starts = [date_range.start for date_range in ranges if date_range.start is not None]
+        return Order.objects.spanning(max(starts) if starts else None, deleted=data.get('deleted'))
+
+    def search(self, queryset, name, value):
+        """
+        Full-text search over customer, notes and the user's names, best matches first.
+        An explicit `ordering` parameter still takes precedence.
+        Without the index (see TRIGGER_VENDORS) every word has to be contained in one of the fields.
+        """
+        words = get_words(value)
+        if not words:
+            return queryset
+        if not has_triggers(queryset.db):
+            for word in words:
+                condition = Q()
+                for field in SEARCH_FIELDS:
+                    condition |= Q(**{field + '__icontains': word})
+                queryset = queryset.filter(condition)
+            return queryset.order_by('-id')
+        rank = SearchRank('search__document', value, weights=SEARCH_WEIGHTS)
+        return queryset.filter(search__document__match=value).order_by(rank.asc(), '-id')
+
+
+class OrderAggregateFilter(OrderFilter):
+    # whole days, both ends included: day_after=2020-01-01&day_before=2020-01-31
+    day = filters.DateFromToRangeFilter(field_name='date_created')
+    date_range_filters = ['date_created', 'day']
+
+
+class OrderDailySummaryFilter(filters.FilterSet):
+    """
+    The filters of OrderAggregateFilter that OrderDailySummary rows can answer, under the same names.
+    """
+    day = filters.DateFromToRangeFilter()
+    user__first_name = filters.CharFilter(lookup_expr='icontains')
+    user__last_name = filters.CharFilter(lookup_expr='icontains')
+    username = filters.CharFilter(field_name='user__username', lookup_expr='icontains')
+
+    class Meta:
+        model = OrderDailySummary
+        fields = ['deleted']
@@ -0,0 +1,145 @@
+"""
+Background job handlers of orders, see filters_tutorial_back.common.jobs.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from filters_tutorial_back.common.cache import bump_generation
+from filters_tutorial_back.common.jobs import register, report_progress
+from order.models import Order, OrderArchive, OrderDailySummary, OrderTombstone, has_triggers
+
+logger = logging.getLogger(__name__)
+
+# Statements rebuilding the rows of sc_order_search for an id range (see migration 0005)
+SEARCH_REINDEX = {
+    'sqlite': [
+        'DELETE FROM sc_order_search WHERE rowid BETWEEN %s AND %s',
+        '''INSERT INTO sc_order_search (rowid, customer, notes, user_name)
+            SELECT o.id, o.customer, o.notes, u.first_name || ' ' || u.last_name || ' ' || u.username
+            FROM sc_order o LEFT JOIN auth_user u ON u.id = o.user_id WHERE o.id BETWEEN %s AND %s''',
+    ],
+    'postgresql': [
+        'DELETE FROM sc_order_search WHERE rowid BETWEEN %s AND %s',
+        '''INSERT INTO sc_order_search (rowid, sc_order_search)
+            SELECT id, sc_order_search_document(customer, notes, user_id) FROM sc_order WHERE id BETWEEN %s AND %s''',
+    ],
+}
+# Day of an order in SQL (see migration 0006)
+SUMMARY_DAY = {
+    'sqlite': 'date(date_created)',
+    'postgresql': "(date_created AT TIME ZONE 'UTC')::date",
+}
+# Databases with `ANALYZE <table>`
+ANALYZE_VENDORS = ('sqlite', 'postgresql')
+# Columns an order keeps in sc_order_archive
+ARCHIVE_COLUMNS = (
+    'id, user_id, user_first_name, user_last_name, user_username, customer, amount, price, notes, deleted, date_created, date_last_updated'
+)
+
+
+@register('orders.reindex')
+def reindex_orders(job, chunk_size=10000):
+    """
+    Rebuild the search index and the daily summaries (archived orders included) from sc_order,
+    which the triggers keep in sync but which drift after e.g. restoring sc_order alone. The index
+    is rebuilt one id range per transaction, so searches keep finding the other orders and writers
+    wait briefly. Databases without the triggers (see TRIGGER_VENDORS) have neither to rebuild.
+    """
+    connection = connections[Order.objects.db]
+    if not has_triggers(connection.alias):
+        logger.warning('No search index or order summaries on %s, nothing to reindex', connection.vendor)
+        return {'orders': Order.objects.count(), 'summaries': 0}
+    last_id = Order.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    chunks = last_id // chunk_size + 1
+    # the summaries are the last step
+    report_progress(0, chunks + 1)
+    with connection.cursor() as cursor:
+        for chunk in range(chunks):
+            start, end = chunk * chunk_size, (chunk + 1) * chunk_size - 1
+            with transaction.atomic(using=connection.alias):
+                for statement in SEARCH_REINDEX[connection.vendor]:
+                    cursor.execute(statement, [start, end])
+            report_progress(chunk + 1)
+        cursor.execute('DELETE FROM sc_order_search WHERE rowid > %s', [last_id])
+
+        table = OrderDailySummary._meta.db_table
+        with transaction.atomic(using=connection.alias):
+            cursor.execute('DELETE FROM {}'.format(table))
+            summaries = 0
+            # archived orders in rows of their own (migration 0011)
+            for orders, archived in ((Order, False), (OrderArchive, True)):
+                cursor.execute(
+                    'INSERT INTO {table} (user_id, day, deleted, archived, order_count, amount_sum, price_sum) '
+                    'SELECT user_id, {day}, deleted, %s, COUNT(*), SUM(amount), SUM(price) FROM {orders} GROUP BY user_id, {day}, deleted'.format(
+                        table=table, day=SUMMARY_DAY[connection.vendor], orders=orders._meta.db_table
+                    ),
+                    [archived]
+                )
+                summaries += cursor.rowcount
+    report_progress(chunks + 1)
+    # cached search results and aggregates
+    bump_generation(Order, using=connection.alias)
+    return {'orders': Order.objects.count(), 'summaries': summaries}
+
+
+@register('orders.prune_tombstones')
+def prune_tombstones(job):
+    """
+    Drop tombstones older than DELTA_SYNC_TOMBSTONE_DAYS, the changes feed refuses older watermarks.
+    """
+    days = getattr(settings, 'DELTA_SYNC_TOMBSTONE_DAYS', 30)
+    deleted, _ = OrderTombstone.objects.filter(date_deleted__lt=timezone.now() - datetime.timedelta(days=days)).delete()
+    return {'deleted': deleted}
+
+
+@register('orders.archive')
+def archive_orders(job, days=None, deleted_days=None, batch_size=500):
+    """
+    Move orders created more than `days` ago and deleted orders unchanged for `deleted_days`
+    (defaults: ORDER_ARCHIVE_DAYS, ORDER_ARCHIVE_DELETED_DAYS) to sc_order_archive. One batch per
+    transaction, the triggers of migrations 0009 and 0011 keep them out of the tombstones and move
+    them to the archived summary rows.
+    """
+    now = timezone.now()
+    days = getattr(settings, 'ORDER_ARCHIVE_DAYS', 365) if days is None else days
+    deleted_days = getattr(settings, 'ORDER_ARCHIVE_DELETED_DAYS', 30) if deleted_days is None else deleted_days
+    archivable = Order.objects.filter(
+        Q(date_created__lt=now - datetime.timedelta(days=days))
+        | Q(deleted=True, date_last_updated__lt=now - datetime.timedelta(days=deleted_days))
+    )
+    total = archivable.count()
+    report_progress(0, total)
+    connection = connections[Order.objects.db]
+    date_archived = connection.ops.adapt_datetimefield_value(now)
+    archived = last_id = 0
+    with connection.cursor() as cursor:
+        while True:
+            with transaction.atomic(using=connection.alias):
+                # locked, an order changed meanwhile is not moved with its old values
+                ids = list(archivable.filter(id__gt=last_id).order_by('id').select_for_update().values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                placeholders = ', '.join(['%s'] * len(ids))
+                cursor.execute(
+                    'INSERT INTO {archive} ({columns}, date_archived) SELECT {columns}, %s FROM sc_order WHERE id IN ({ids})'.format(
+                        archive=OrderArchive._meta.db_table, columns=ARCHIVE_COLUMNS, ids=placeholders
+                    ),
+                    [date_archived] + ids
+                )
+                cursor.execute('DELETE FROM sc_order WHERE id IN ({})'.format(placeholders), ids)
+            archived += len(ids)
+            last_id = ids[-1]
+            report_progress(archived)
+        if archived and connection.vendor in ANALYZE_VENDORS:
+            # both tables changed size, stale statistics make the planner pick bad plans for sc_order_with_archive
+            for table in ('sc_order', OrderArchive._meta.db_table):
+                cursor.execute('ANALYZE {}'.format(table))
+    if archived:
+        # cached lists and counts
+        bump_generation(Order, using=connection.alias)
+    return {'archived': archived}
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from order.jobs import archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move old and deleted orders from sc_order to sc_order_archive in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive orders created more than this many days ago (default: ORDER_ARCHIVE_DAYS)')
+        parser.add_argument(
+            '--deleted-days', type=int, help='Archive deleted orders unchanged for this many days (default: ORDER_ARCHIVE_DELETED_DAYS)'
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders moved per transaction')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        result = archive_orders(None, days=options['days'], deleted_days=options['deleted_days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('{} orders archived in {:.1f}s'.format(result['archived'], time.perf_counter() - start)))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from order.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Run benchmarks of the orders API against the configured database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Benchmarks to run: {} (default: all)'.format(', '.join(sorted(BENCHMARKS))))
+        parser.add_argument('--repeat', type=int, default=20, help='Measurements per case')
+        parser.add_argument('--requests', type=int, default=300, help='Requests sent by the api benchmark')
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the random request mix')
+        parser.add_argument('--cached', action='store_true', help='Keep the count/response caches between requests')
+        parser.add_argument('--concurrency', type=int, default=50, help='Concurrent clients of the async_list benchmark')
+        parser.add_argument('--max-p95', type=float, help='Fail when a benchmark reports a p95 above this many milliseconds')
+
+    def handle(self, *args, **options):
+        names = options['names'] or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError('Unknown benchmark: {}'.format(', '.join(unknown)))
+        kwargs = {key: options[key] for key in ('repeat', 'requests', 'seed', 'cached', 'concurrency')}
+        failed = []
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            summary = BENCHMARKS[name](self.stdout.write, **kwargs) or {}
+            if options['max_p95'] is not None and summary.get('p95_ms', 0) > options['max_p95']:
+                failed.append('{} p95 {:.2f}ms'.format(name, summary['p95_ms']))
+        if failed:
+            raise CommandError('Over --max-p95: {}'.format(', '.join(failed)))
@@ -0,0 +1,55 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from filters_tutorial_back.common.jobs import work
+from order.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (exports, bulk changes, reindexing) in a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help='Worker processes, 1 runs the jobs in this process')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between checks of an empty queue')
+        parser.add_argument('--burst', action='store_true', help='Stop once the queue is empty')
+
+    def handle(self, *args, **options):
+        self.check_journal_mode()
+        kwargs = {'poll_interval': options['poll_interval'], 'burst': options['burst']}
+        if options['processes'] <= 1:
+            done = work(Job, **kwargs)
+            self.stdout.write('{} jobs'.format(done))
+            return
+
+        # forked workers open their own connections, a shared socket or file handle breaks
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=work, args=(Job,), kwargs=kwargs, daemon=True) for _ in range(options['processes'])]
+        for process in processes:
+            process.start()
+        self.stdout.write('{} workers started'.format(len(processes)))
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+        self.stdout.write('Workers stopped')
+
+    def check_journal_mode(self):
+        """
+        In SQLite's default rollback journal a long job reading (an export) keeps every writer,
+        web requests included, from committing. WAL lets them run alongside.
+        """
+        connection = connections[Job.objects.db]
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            mode = cursor.fetchone()[0]
+        if mode != 'wal':
+            self.stderr.write(self.style.WARNING(
+                'SQLite journal_mode is {}, jobs will block writes of web requests. Run with DATABASE_PROFILE=performance.'.format(mode)
+            ))
@@ -0,0 +1,100 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+from faker import Faker
+
+from filters_tutorial_back.common.signals import BULK_CREATE, post_bulk_change
+from order.models import Order
+
+# Faker is slow per value, rows are assembled from pools generated once.
+NAME_POOL_SIZE = 2000
+NOTES_POOL_SIZE = 500
+# Column order of the generated rows
+ORDER_FIELDS = ['user', 'user_first_name', 'user_last_name', 'user_username', 'customer', 'amount', 'price', 'notes', 'deleted', 'date_created', 'date_last_updated']
+
+
+class Command(BaseCommand):
+    help = 'Generate fake users and orders with batched inserts. The same --seed gives the same data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--days', type=int, default=3 * 365, help='Orders are spread over this many days back from now')
+        parser.add_argument('--deleted-ratio', type=float, default=0.1)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        # separate generators, so orders stay the same whether or not the users already exist
+        rng = random.Random('{}-orders'.format(options['seed']))
+        fake = Faker()
+        fake.seed_instance(options['seed'])
+        first_names = [fake.first_name() for _ in range(NAME_POOL_SIZE)]
+        last_names = [fake.last_name() for _ in range(NAME_POOL_SIZE)]
+        customers = [fake.name() for _ in range(NAME_POOL_SIZE)]
+        notes = [fake.paragraph(nb_sentences=3) for _ in range(NOTES_POOL_SIZE)]
+
+        user_ids = self.create_users(options['users'], options['seed'], first_names, last_names)
+        self.stdout.write('{} users'.format(len(user_ids)))
+        # the orders' copies of the user names
+        user_names = {row[0]: row[1:] for row in User.objects.filter(id__in=user_ids).values_list('id', 'first_name', 'last_name', 'username')}
+
+        last_id = Order.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        now = timezone.now()
+        created = 0
+        while created < options['orders']:
+            size = min(options['batch_size'], options['orders'] - created)
+            rows = []
+            for _ in range(size):
+                date_created = now - datetime.timedelta(seconds=rng.randint(0, options['days'] * 86400))
+                user_id = rng.choice(user_ids)
+                rows.append((
+                    user_id,
+                    *user_names[user_id],
+                    rng.choice(customers),
+                    rng.randint(1, 1000),
+                    Decimal(rng.randint(100, 100000)) / 100,
+                    rng.choice(notes),
+                    rng.random() < options['deleted_ratio'],
+                    date_created,
+                    date_created + datetime.timedelta(seconds=rng.randint(0, 30 * 86400)),
+                ))
+            self.insert_orders(rows)
+            created += size
+            self.stdout.write('{} orders ({:.0f} rows/s)'.format(created, created / (time.perf_counter() - start)))
+
+        post_bulk_change.send(sender=Order, action=BULK_CREATE, queryset=Order.objects.filter(id__gt=last_id))
+        self.stdout.write(self.style.SUCCESS('Done in {:.1f}s'.format(time.perf_counter() - start)))
+
+    def create_users(self, count, seed, first_names, last_names):
+        rng = random.Random('{}-users'.format(seed))
+        prefix = 'seed{}_'.format(seed)
+        existing = User.objects.filter(username__startswith=prefix).count()
+        users = [
+            User(username='{}{}'.format(prefix, index), first_name=rng.choice(first_names), last_name=rng.choice(last_names), password='!')
+            for index in range(count)
+        ][existing:]
+        User.objects.bulk_create(users)
+        return list(User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', flat=True))
+
+    def insert_orders(self, rows):
+        """
+        Plain executemany: bulk_create would overwrite date_created through auto_now_add.
+        """
+        # the connection object itself, django.db.connection is a proxy that costs a lookup per access
+        connection = connections[Order.objects.db]
+        qn = connection.ops.quote_name
+        fields = [Order._meta.get_field(name) for name in ORDER_FIELDS]
+        rows = [[field.get_db_prep_save(value, connection) for field, value in zip(fields, row)] for row in rows]
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            qn(Order._meta.db_table), ', '.join(qn(field.column) for field in fields), ', '.join(['%s'] * len(fields))
+        )
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
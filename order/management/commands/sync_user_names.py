@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from order.models import Order, OrderArchive
+
+
+class Command(BaseCommand):
+    help = "Copy the users' names into their orders (and archived orders) where they differ, one id range per transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Ids per transaction')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        batch_size = options['batch_size']
+        for model in (Order, OrderArchive):
+            last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+            changed = 0
+            for first_id in range(0, last_id + 1, batch_size):
+                with transaction.atomic(using=model.objects.db):
+                    changed += model.objects.filter(id__gte=first_id, id__lt=first_id + batch_size).sync_user_names()
+            self.stdout.write('{}: {} updated'.format(model._meta.verbose_name_plural, changed))
+        self.stdout.write(self.style.SUCCESS('Done in {:.1f}s'.format(time.perf_counter() - start)))
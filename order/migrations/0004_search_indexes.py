@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import migrations
+
+# `icontains` becomes `UPPER(col) LIKE UPPER('%value%')` on PostgreSQL, which no btree can serve
+# with its leading wildcard. A GIN trigram index (pg_trgm) over the same UPPER() expression can.
+# SQLite has no index type for LIKE '%value%', nothing is created there.
+#
+# Expression indexes can not be declared on models, so migration state does not know these; they are
+# plain SQL with its reverse. The auth_user ones are made by this app on a table it does not own: they
+# are skipped with a swapped AUTH_USER_MODEL, and IF [NOT] EXISTS keeps both directions safe when the
+# table or the index is already gone (e.g. `migrate auth zero` after a reinstall of this app).
+
+CREATE_INDEX = 'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (UPPER({column}::text) gin_trgm_ops)'
+DROP_INDEX = 'DROP INDEX IF EXISTS {name}'
+
+# (table, column, index name)
+ORDER_COLUMNS = [
+    ('sc_order', 'customer', 'sc_order_customer_trgm'),
+]
+USER_COLUMNS = [
+    ('auth_user', 'first_name', 'auth_user_first_name_trgm'),
+    ('auth_user', 'last_name', 'auth_user_last_name_trgm'),
+    ('auth_user', 'username', 'auth_user_username_trgm'),
+]
+
+
+def get_columns():
+    if settings.AUTH_USER_MODEL != 'auth.User':
+        return ORDER_COLUMNS
+    return ORDER_COLUMNS + USER_COLUMNS
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm', params=None)
+    for table, column, name in get_columns():
+        schema_editor.execute(CREATE_INDEX.format(name=name, table=table, column=column), params=None)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, _, name in get_columns():
+        schema_editor.execute(DROP_INDEX.format(name=name), params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('order', '0003_order_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,122 @@
+import logging
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import filters_tutorial_back.common.search
+
+logger = logging.getLogger(__name__)
+
+# The index is filled and updated by triggers, so bulk_create(), queryset.update(),
+# raw inserts (seed_orders) and renamed users keep it in sync as well as save()/delete().
+
+SQLITE_DOCUMENT = "(SELECT first_name || ' ' || last_name || ' ' || username FROM auth_user WHERE id = new.user_id)"
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE sc_order_search USING fts5(customer, notes, user_name, tokenize = 'unicode61 remove_diacritics 2')",
+    '''CREATE TRIGGER sc_order_search_insert AFTER INSERT ON sc_order BEGIN
+        INSERT INTO sc_order_search (rowid, customer, notes, user_name) VALUES (new.id, new.customer, new.notes, {document});
+    END'''.format(document=SQLITE_DOCUMENT),
+    '''CREATE TRIGGER sc_order_search_update AFTER UPDATE OF customer, notes, user_id ON sc_order BEGIN
+        DELETE FROM sc_order_search WHERE rowid = old.id;
+        INSERT INTO sc_order_search (rowid, customer, notes, user_name) VALUES (new.id, new.customer, new.notes, {document});
+    END'''.format(document=SQLITE_DOCUMENT),
+    '''CREATE TRIGGER sc_order_search_delete AFTER DELETE ON sc_order BEGIN
+        DELETE FROM sc_order_search WHERE rowid = old.id;
+    END''',
+    '''CREATE TRIGGER sc_order_search_user_update AFTER UPDATE OF first_name, last_name, username ON auth_user BEGIN
+        UPDATE sc_order_search SET user_name = new.first_name || ' ' || new.last_name || ' ' || new.username
+        WHERE rowid IN (SELECT id FROM sc_order WHERE user_id = new.id);
+    END''',
+    '''INSERT INTO sc_order_search (rowid, customer, notes, user_name)
+        SELECT o.id, o.customer, o.notes, u.first_name || ' ' || u.last_name || ' ' || u.username
+        FROM sc_order o LEFT JOIN auth_user u ON u.id = o.user_id''',
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS sc_order_search_user_update',
+    'DROP TRIGGER IF EXISTS sc_order_search_delete',
+    'DROP TRIGGER IF EXISTS sc_order_search_update',
+    'DROP TRIGGER IF EXISTS sc_order_search_insert',
+    'DROP TABLE IF EXISTS sc_order_search',
+]
+
+# Customer counts most, then the user's names, then the notes.
+POSTGRESQL_CREATE = [
+    '''CREATE TABLE sc_order_search (
+        rowid integer PRIMARY KEY REFERENCES sc_order (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        sc_order_search tsvector NOT NULL
+    )''',
+    'CREATE INDEX sc_order_search_gin ON sc_order_search USING gin (sc_order_search)',
+    '''CREATE FUNCTION sc_order_search_document(customer text, notes text, user_id integer) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('simple', coalesce(customer, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce((SELECT concat_ws(' ', first_name, last_name, username) FROM auth_user WHERE id = user_id), '')), 'B')
+            || setweight(to_tsvector('simple', coalesce(notes, '')), 'C')
+    $$ LANGUAGE sql STABLE''',
+    '''CREATE FUNCTION sc_order_search_sync() RETURNS trigger AS $$ BEGIN
+        INSERT INTO sc_order_search (rowid, sc_order_search) VALUES (NEW.id, sc_order_search_document(NEW.customer, NEW.notes, NEW.user_id))
+        ON CONFLICT (rowid) DO UPDATE SET sc_order_search = EXCLUDED.sc_order_search;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql''',
+    '''CREATE TRIGGER sc_order_search_sync AFTER INSERT OR UPDATE OF customer, notes, user_id ON sc_order
+        FOR EACH ROW EXECUTE PROCEDURE sc_order_search_sync()''',
+    '''CREATE FUNCTION sc_order_search_user_sync() RETURNS trigger AS $$ BEGIN
+        UPDATE sc_order_search s SET sc_order_search = sc_order_search_document(o.customer, o.notes, o.user_id)
+        FROM sc_order o WHERE o.id = s.rowid AND o.user_id = NEW.id;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql''',
+    '''CREATE TRIGGER sc_order_search_user_sync AFTER UPDATE OF first_name, last_name, username ON auth_user
+        FOR EACH ROW EXECUTE PROCEDURE sc_order_search_user_sync()''',
+    '''INSERT INTO sc_order_search (rowid, sc_order_search)
+        SELECT id, sc_order_search_document(customer, notes, user_id) FROM sc_order''',
+]
+
+POSTGRESQL_DROP = [
+    'DROP TRIGGER IF EXISTS sc_order_search_user_sync ON auth_user',
+    'DROP TRIGGER IF EXISTS sc_order_search_sync ON sc_order',
+    'DROP FUNCTION IF EXISTS sc_order_search_user_sync()',
+    'DROP FUNCTION IF EXISTS sc_order_search_sync()',
+    'DROP FUNCTION IF EXISTS sc_order_search_document(text, text, integer)',
+    'DROP TABLE IF EXISTS sc_order_search',
+]
+
+STATEMENTS = {
+    'sqlite': (SQLITE_CREATE, SQLITE_DROP),
+    'postgresql': (POSTGRESQL_CREATE, POSTGRESQL_DROP),
+}
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in STATEMENTS:
+        logger.warning('Full-text search is not supported on %s, OrderFilter.search() uses icontains', vendor)
+        return
+    for statement in STATEMENTS[vendor][0]:
+        schema_editor.execute(statement, params=None)
+
+
+def drop_search_index(apps, schema_editor):
+    for statement in STATEMENTS.get(schema_editor.connection.vendor, ((), ()))[1]:
+        schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0004_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSearch',
+            fields=[
+                ('order', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search', serialize=False, to='order.Order')),
+                ('document', filters_tutorial_back.common.search.SearchDocumentField(db_column='sc_order_search')),
+            ],
+            options={
+                'db_table': 'sc_order_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
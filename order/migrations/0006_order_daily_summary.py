@@ -0,0 +1,138 @@
+import logging
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+logger = logging.getLogger(__name__)
+
+# Every write to sc_order moves the order out of the summary row of its old
+# (user, day, deleted) and into the one of its new values. Rows left without orders are removed.
+
+SQLITE_KEY = 'user_id = {row}.user_id AND day = date({row}.date_created) AND deleted = {row}.deleted'
+
+SQLITE_REMOVE = '''
+    UPDATE sc_order_daily_summary SET order_count = order_count - 1, amount_sum = amount_sum - old.amount, price_sum = price_sum - old.price
+    WHERE {key};
+    DELETE FROM sc_order_daily_summary WHERE {key} AND order_count = 0;
+'''.format(key=SQLITE_KEY.format(row='old'))
+
+SQLITE_ADD = '''
+    INSERT INTO sc_order_daily_summary (user_id, day, deleted, order_count, amount_sum, price_sum)
+    VALUES (new.user_id, date(new.date_created), new.deleted, 1, new.amount, new.price)
+    ON CONFLICT (user_id, day, deleted) DO UPDATE SET
+        order_count = order_count + 1, amount_sum = amount_sum + excluded.amount_sum, price_sum = price_sum + excluded.price_sum;
+'''
+
+SQLITE_CREATE = [
+    'CREATE TRIGGER sc_order_daily_summary_insert AFTER INSERT ON sc_order BEGIN {} END'.format(SQLITE_ADD),
+    '''CREATE TRIGGER sc_order_daily_summary_update AFTER UPDATE OF user_id, amount, price, deleted, date_created ON sc_order
+        WHEN old.user_id IS NOT new.user_id OR old.amount IS NOT new.amount OR old.price IS NOT new.price
+            OR old.deleted IS NOT new.deleted OR date(old.date_created) IS NOT date(new.date_created)
+        BEGIN {} {} END'''.format(SQLITE_REMOVE, SQLITE_ADD),
+    'CREATE TRIGGER sc_order_daily_summary_delete AFTER DELETE ON sc_order BEGIN {} END'.format(SQLITE_REMOVE),
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS sc_order_daily_summary_delete',
+    'DROP TRIGGER IF EXISTS sc_order_daily_summary_update',
+    'DROP TRIGGER IF EXISTS sc_order_daily_summary_insert',
+]
+
+POSTGRESQL_DAY = "({row}.date_created AT TIME ZONE 'UTC')::date"
+POSTGRESQL_KEY = 'user_id = {row}.user_id AND day = ' + POSTGRESQL_DAY + ' AND deleted = {row}.deleted'
+
+POSTGRESQL_CREATE = [
+    '''CREATE FUNCTION sc_order_daily_summary_sync() RETURNS trigger AS $$ BEGIN
+        IF TG_OP = 'UPDATE' AND (OLD.user_id, OLD.amount, OLD.price, OLD.deleted, {old_day})
+                IS NOT DISTINCT FROM (NEW.user_id, NEW.amount, NEW.price, NEW.deleted, {new_day}) THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE sc_order_daily_summary SET order_count = order_count - 1, amount_sum = amount_sum - OLD.amount, price_sum = price_sum - OLD.price
+            WHERE {old_key};
+            DELETE FROM sc_order_daily_summary WHERE {old_key} AND order_count = 0;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO sc_order_daily_summary (user_id, day, deleted, order_count, amount_sum, price_sum)
+            VALUES (NEW.user_id, {new_day}, NEW.deleted, 1, NEW.amount, NEW.price)
+            ON CONFLICT (user_id, day, deleted) DO UPDATE SET
+                order_count = sc_order_daily_summary.order_count + 1,
+                amount_sum = sc_order_daily_summary.amount_sum + EXCLUDED.amount_sum,
+                price_sum = sc_order_daily_summary.price_sum + EXCLUDED.price_sum;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql'''.format(
+        old_key=POSTGRESQL_KEY.format(row='OLD'), old_day=POSTGRESQL_DAY.format(row='OLD'), new_day=POSTGRESQL_DAY.format(row='NEW')
+    ),
+    '''CREATE TRIGGER sc_order_daily_summary_sync AFTER INSERT OR DELETE OR UPDATE OF user_id, amount, price, deleted, date_created ON sc_order
+        FOR EACH ROW EXECUTE PROCEDURE sc_order_daily_summary_sync()''',
+]
+
+POSTGRESQL_DROP = [
+    'DROP TRIGGER IF EXISTS sc_order_daily_summary_sync ON sc_order',
+    'DROP FUNCTION IF EXISTS sc_order_daily_summary_sync()',
+]
+
+# (create, drop, day of an order in SQL)
+STATEMENTS = {
+    'sqlite': (SQLITE_CREATE, SQLITE_DROP, 'date(date_created)'),
+    'postgresql': (POSTGRESQL_CREATE, POSTGRESQL_DROP, "(date_created AT TIME ZONE 'UTC')::date"),
+}
+
+
+def create_summary_triggers(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in STATEMENTS:
+        logger.warning('Order summaries are not supported on %s, aggregates read the orders', vendor)
+        return
+    create, _, day = STATEMENTS[vendor]
+    for statement in create:
+        schema_editor.execute(statement, params=None)
+    schema_editor.execute(
+        'INSERT INTO sc_order_daily_summary (user_id, day, deleted, order_count, amount_sum, price_sum) '
+        'SELECT user_id, {day}, deleted, COUNT(*), SUM(amount), SUM(price) FROM sc_order GROUP BY user_id, {day}, deleted'.format(day=day),
+        params=None
+    )
+
+
+def drop_summary_triggers(apps, schema_editor):
+    for statement in STATEMENTS.get(schema_editor.connection.vendor, ((), (), ''))[1]:
+        schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('order', '0005_order_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDailySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('amount_sum', models.BigIntegerField(default=0)),
+                ('price_sum', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'order daily summary',
+                'verbose_name_plural': 'order daily summaries',
+                'db_table': 'sc_order_daily_summary',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='orderdailysummary',
+            index=models.Index(fields=['day'], name='sc_order_daily_summary_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderdailysummary',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'deleted'), name='sc_order_daily_summary_key'),
+        ),
+        migrations.RunPython(create_summary_triggers, drop_summary_triggers),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 3.0.6 on 2026-10-18 09:16
+
+import logging
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+# A tombstone per deleted order, whatever deletes it (API, cascades, raw SQL), with the time in the
+# text format Django writes SQLite datetimes in (no fraction for whole seconds, else microseconds),
+# so they compare equal to the watermarks of the changes feed.
+
+SQLITE_NOW = """CASE WHEN strftime('%f', 'now') LIKE '%.000' THEN strftime('%Y-%m-%d %H:%M:%S', 'now')
+    ELSE strftime('%Y-%m-%d %H:%M:%f', 'now') || '000' END"""
+
+SQLITE_CREATE = [
+    '''CREATE TRIGGER sc_order_tombstone_delete AFTER DELETE ON sc_order BEGIN
+        INSERT INTO sc_order_tombstone (order_id, date_deleted) VALUES (old.id, {now});
+    END'''.format(now=SQLITE_NOW),
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS sc_order_tombstone_delete',
+]
+
+POSTGRESQL_CREATE = [
+    '''CREATE FUNCTION sc_order_tombstone_sync() RETURNS trigger AS $$ BEGIN
+        INSERT INTO sc_order_tombstone (order_id, date_deleted) VALUES (OLD.id, now());
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql''',
+    '''CREATE TRIGGER sc_order_tombstone_sync AFTER DELETE ON sc_order
+        FOR EACH ROW EXECUTE PROCEDURE sc_order_tombstone_sync()''',
+]
+
+POSTGRESQL_DROP = [
+    'DROP TRIGGER IF EXISTS sc_order_tombstone_sync ON sc_order',
+    'DROP FUNCTION IF EXISTS sc_order_tombstone_sync()',
+]
+
+STATEMENTS = {
+    'sqlite': (SQLITE_CREATE, SQLITE_DROP),
+    'postgresql': (POSTGRESQL_CREATE, POSTGRESQL_DROP),
+}
+
+
+def create_tombstone_trigger(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in STATEMENTS:
+        logger.warning('Order tombstone triggers are not supported on %s, order.signals writes the tombstones', vendor)
+        return
+    for statement in STATEMENTS[vendor][0]:
+        schema_editor.execute(statement, params=None)
+
+
+def drop_tombstone_trigger(apps, schema_editor):
+    for statement in STATEMENTS.get(schema_editor.connection.vendor, ((), ()))[1]:
+        schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0007_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.PositiveIntegerField()),
+                ('date_deleted', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'order tombstone',
+                'verbose_name_plural': 'order tombstones',
+                'db_table': 'sc_order_tombstone',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['date_last_updated', 'id'], name='sc_order_updated_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ordertombstone',
+            index=models.Index(fields=['date_deleted', 'order_id'], name='sc_order_tombstone_deleted_idx'),
+        ),
+        migrations.RunPython(create_tombstone_trigger, drop_tombstone_trigger),
+    ]
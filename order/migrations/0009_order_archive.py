@@ -0,0 +1,133 @@
+# Generated by Django 3.0.6 on 2026-10-18 09:25
+
+from importlib import import_module
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Orders are archived by moving them: inserted into sc_order_archive, then deleted from sc_order in
+# the same transaction. The delete triggers skip orders found in the archive, so archiving writes no
+# tombstone (the order was not deleted) and keeps the order in the daily summaries; the search index
+# drops it, searches cover sc_order only.
+
+summary = import_module('order.migrations.0006_order_daily_summary')
+tombstone = import_module('order.migrations.0008_order_tombstone')
+
+COLUMNS = 'id, user_id, customer, amount, price, notes, deleted, date_created, date_last_updated'
+
+CREATE_VIEW = 'CREATE VIEW sc_order_with_archive AS SELECT {columns} FROM sc_order UNION ALL SELECT {columns} FROM sc_order_archive'.format(columns=COLUMNS)
+DROP_VIEW = 'DROP VIEW IF EXISTS sc_order_with_archive'
+
+SQLITE_NOT_ARCHIVED = 'WHEN NOT EXISTS (SELECT 1 FROM sc_order_archive WHERE id = old.id)'
+
+SQLITE_CREATE = [
+    'DROP TRIGGER sc_order_tombstone_delete',
+    '''CREATE TRIGGER sc_order_tombstone_delete AFTER DELETE ON sc_order {when} BEGIN
+        INSERT INTO sc_order_tombstone (order_id, date_deleted) VALUES (old.id, {now});
+    END'''.format(when=SQLITE_NOT_ARCHIVED, now=tombstone.SQLITE_NOW),
+    'DROP TRIGGER sc_order_daily_summary_delete',
+    'CREATE TRIGGER sc_order_daily_summary_delete AFTER DELETE ON sc_order {} BEGIN {} END'.format(SQLITE_NOT_ARCHIVED, summary.SQLITE_REMOVE),
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER sc_order_daily_summary_delete',
+    summary.SQLITE_CREATE[2],
+    'DROP TRIGGER sc_order_tombstone_delete',
+    tombstone.SQLITE_CREATE[0],
+]
+
+POSTGRESQL_NOT_ARCHIVED = """
+        IF TG_OP = 'DELETE' AND EXISTS (SELECT 1 FROM sc_order_archive WHERE id = OLD.id) THEN
+            RETURN NULL;
+        END IF;"""
+
+
+def replace_function(statement, guard=''):
+    return statement.replace('CREATE FUNCTION', 'CREATE OR REPLACE FUNCTION', 1).replace('$$ BEGIN', '$$ BEGIN' + guard, 1)
+
+
+POSTGRESQL_CREATE = [
+    replace_function(tombstone.POSTGRESQL_CREATE[0], POSTGRESQL_NOT_ARCHIVED),
+    replace_function(summary.POSTGRESQL_CREATE[0], POSTGRESQL_NOT_ARCHIVED),
+]
+
+POSTGRESQL_DROP = [
+    replace_function(tombstone.POSTGRESQL_CREATE[0]),
+    replace_function(summary.POSTGRESQL_CREATE[0]),
+]
+
+STATEMENTS = {
+    'sqlite': (SQLITE_CREATE, SQLITE_DROP),
+    'postgresql': (POSTGRESQL_CREATE, POSTGRESQL_DROP),
+}
+
+
+def create_archive_view(apps, schema_editor):
+    # the triggers replaced here only exist where 0006 and 0008 created them
+    for statement in [CREATE_VIEW] + STATEMENTS.get(schema_editor.connection.vendor, ([], []))[0]:
+        schema_editor.execute(statement, params=None)
+
+
+def drop_archive_view(apps, schema_editor):
+    for statement in STATEMENTS.get(schema_editor.connection.vendor, ([], []))[1] + [DROP_VIEW]:
+        schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('order', '0008_order_tombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderWithArchive',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('customer', models.CharField(max_length=255)),
+                ('amount', models.PositiveIntegerField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('notes', models.TextField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('date_created', models.DateTimeField()),
+                ('date_last_updated', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'sc_order_with_archive',
+                'ordering': ['-id'],
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderArchive',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('customer', models.CharField(max_length=255)),
+                ('amount', models.PositiveIntegerField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('notes', models.TextField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('date_created', models.DateTimeField()),
+                ('date_last_updated', models.DateTimeField()),
+                ('date_archived', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'archived order',
+                'verbose_name_plural': 'archived orders',
+                'db_table': 'sc_order_archive',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='orderarchive',
+            index=models.Index(fields=['deleted', 'date_created'], name='sc_order_archive_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderarchive',
+            index=models.Index(fields=['date_created'], name='sc_order_archive_created_idx'),
+        ),
+        migrations.RunPython(create_archive_view, drop_archive_view),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 3.0.6 on 2026-10-18 09:30
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# Columns are added with ALTER TABLE ... ADD COLUMN: on SQLite, AddField rebuilds the table, which
+# drops its triggers (search index, summaries, tombstones). The database keeps the '' default, so
+# raw inserts get empty names that the post_bulk_change handler then fills in.
+
+archive = import_module('order.migrations.0009_order_archive')
+
+# (column, User column, length)
+USER_NAME_COLUMNS = [
+    ('user_first_name', 'first_name', 30),
+    ('user_last_name', 'last_name', 150),
+    ('user_username', 'username', 150),
+]
+TABLES = ['sc_order', 'sc_order_archive']
+
+ADD_COLUMNS = [
+    "ALTER TABLE {} ADD COLUMN {} varchar({}) NOT NULL DEFAULT ''".format(table, column, length)
+    for table in TABLES for column, _, length in USER_NAME_COLUMNS
+]
+DROP_COLUMNS = ['ALTER TABLE {} DROP COLUMN {}'.format(table, column) for table in TABLES for column, _, _ in USER_NAME_COLUMNS]
+
+BACKFILL = [
+    'UPDATE {table} SET {columns}'.format(table=table, columns=', '.join(
+        "{column} = COALESCE((SELECT {user_column} FROM auth_user WHERE auth_user.id = {table}.user_id), '')".format(
+            column=column, user_column=user_column, table=table
+        ) for column, user_column, _ in USER_NAME_COLUMNS
+    ))
+    for table in TABLES
+]
+
+COLUMNS = archive.COLUMNS + ', ' + ', '.join(column for column, _, _ in USER_NAME_COLUMNS)
+CREATE_VIEW = 'CREATE VIEW sc_order_with_archive AS SELECT {columns} FROM sc_order UNION ALL SELECT {columns} FROM sc_order_archive'.format(columns=COLUMNS)
+
+
+def add_view_columns(apps, schema_editor):
+    for statement in BACKFILL + [archive.DROP_VIEW, CREATE_VIEW]:
+        schema_editor.execute(statement, params=None)
+
+
+def remove_view_columns(apps, schema_editor):
+    for statement in [archive.DROP_VIEW, archive.CREATE_VIEW]:
+        schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0009_order_archive'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(ADD_COLUMNS, DROP_COLUMNS),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name=model_name,
+                    name=column,
+                    field=models.CharField(blank=True, default='', max_length=length),
+                )
+                for model_name in ['order', 'orderarchive'] for column, _, length in USER_NAME_COLUMNS
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_first_name'], name='sc_order_user_first_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_last_name'], name='sc_order_user_last_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_username'], name='sc_order_user_username_idx'),
+        ),
+        migrations.RunPython(add_view_columns, remove_view_columns),
+    ]
@@ -0,0 +1,183 @@
+# Generated by Django 3.0.6 on 2026-10-19 10:05
+
+import logging
+from importlib import import_module
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+# Archived orders keep their own summary rows (archived = true): sc_order counts into the rows of
+# archived = false, sc_order_archive into those of archived = true. Archiving moves an order from
+# one to the other (the insert into the archive adds it, the delete from sc_order removes it), so a
+# summary answers for sc_order alone or with the archive, like OrderFilter.get_source_queryset().
+
+summary = import_module('order.migrations.0006_order_daily_summary')
+archive = import_module('order.migrations.0009_order_archive')
+
+# (table, archived)
+TABLES = [('sc_order', 'false'), ('sc_order_archive', 'true')]
+
+SQLITE_KEY = 'user_id = {row}.user_id AND day = date({row}.date_created) AND deleted = {row}.deleted AND archived = {archived}'
+
+SQLITE_REMOVE = '''
+    UPDATE sc_order_daily_summary SET order_count = order_count - 1, amount_sum = amount_sum - old.amount, price_sum = price_sum - old.price
+    WHERE {key};
+    DELETE FROM sc_order_daily_summary WHERE {key} AND order_count = 0;
+'''
+
+SQLITE_ADD = '''
+    INSERT INTO sc_order_daily_summary (user_id, day, deleted, archived, order_count, amount_sum, price_sum)
+    VALUES (new.user_id, date(new.date_created), new.deleted, {archived}, 1, new.amount, new.price)
+    ON CONFLICT (user_id, day, deleted, archived) DO UPDATE SET
+        order_count = order_count + 1, amount_sum = amount_sum + excluded.amount_sum, price_sum = price_sum + excluded.price_sum;
+'''
+
+
+def sqlite_triggers(table, archived):
+    remove = SQLITE_REMOVE.format(key=SQLITE_KEY.format(row='old', archived=archived))
+    add = SQLITE_ADD.format(archived=archived)
+    return [
+        'CREATE TRIGGER {table}_daily_summary_insert AFTER INSERT ON {table} BEGIN {add} END'.format(table=table, add=add),
+        '''CREATE TRIGGER {table}_daily_summary_update AFTER UPDATE OF user_id, amount, price, deleted, date_created ON {table}
+            WHEN old.user_id IS NOT new.user_id OR old.amount IS NOT new.amount OR old.price IS NOT new.price
+                OR old.deleted IS NOT new.deleted OR date(old.date_created) IS NOT date(new.date_created)
+            BEGIN {remove} {add} END'''.format(table=table, remove=remove, add=add),
+        'CREATE TRIGGER {table}_daily_summary_delete AFTER DELETE ON {table} BEGIN {remove} END'.format(table=table, remove=remove),
+    ]
+
+
+SQLITE_DROP_OLD = summary.SQLITE_DROP
+SQLITE_CREATE = [statement for table, archived in TABLES for statement in sqlite_triggers(table, archived)]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS {}_daily_summary_{}'.format(table, operation)
+    for table, _ in TABLES for operation in ('delete', 'update', 'insert')
+]
+# 0006 and the delete trigger of 0009, which skips archived orders
+SQLITE_RESTORE = summary.SQLITE_CREATE[:2] + archive.SQLITE_CREATE[3:]
+
+POSTGRESQL_DAY = summary.POSTGRESQL_DAY
+POSTGRESQL_KEY = 'user_id = {row}.user_id AND day = ' + POSTGRESQL_DAY + ' AND deleted = {row}.deleted AND archived = TG_ARGV[0]::boolean'
+
+POSTGRESQL_DROP_OLD = ['DROP TRIGGER IF EXISTS sc_order_daily_summary_sync ON sc_order']
+POSTGRESQL_CREATE = [
+    # the archived flag of the table's rows is the trigger's argument
+    '''CREATE OR REPLACE FUNCTION sc_order_daily_summary_sync() RETURNS trigger AS $$ BEGIN
+        IF TG_OP = 'UPDATE' AND (OLD.user_id, OLD.amount, OLD.price, OLD.deleted, {old_day})
+                IS NOT DISTINCT FROM (NEW.user_id, NEW.amount, NEW.price, NEW.deleted, {new_day}) THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE sc_order_daily_summary SET order_count = order_count - 1, amount_sum = amount_sum - OLD.amount, price_sum = price_sum - OLD.price
+            WHERE {old_key};
+            DELETE FROM sc_order_daily_summary WHERE {old_key} AND order_count = 0;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO sc_order_daily_summary (user_id, day, deleted, archived, order_count, amount_sum, price_sum)
+            VALUES (NEW.user_id, {new_day}, NEW.deleted, TG_ARGV[0]::boolean, 1, NEW.amount, NEW.price)
+            ON CONFLICT (user_id, day, deleted, archived) DO UPDATE SET
+                order_count = sc_order_daily_summary.order_count + 1,
+                amount_sum = sc_order_daily_summary.amount_sum + EXCLUDED.amount_sum,
+                price_sum = sc_order_daily_summary.price_sum + EXCLUDED.price_sum;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql'''.format(
+        old_key=POSTGRESQL_KEY.format(row='OLD'), old_day=POSTGRESQL_DAY.format(row='OLD'), new_day=POSTGRESQL_DAY.format(row='NEW')
+    ),
+] + [
+    '''CREATE TRIGGER {table}_daily_summary_sync AFTER INSERT OR DELETE OR UPDATE OF user_id, amount, price, deleted, date_created ON {table}
+        FOR EACH ROW EXECUTE PROCEDURE sc_order_daily_summary_sync('{archived}')'''.format(table=table, archived=archived)
+    for table, archived in TABLES
+]
+POSTGRESQL_DROP = ['DROP TRIGGER IF EXISTS {table}_daily_summary_sync ON {table}'.format(table=table) for table, _ in TABLES]
+# the function of 0009, which skips archived orders, and the trigger of 0006
+POSTGRESQL_RESTORE = archive.POSTGRESQL_CREATE[1:2] + summary.POSTGRESQL_CREATE[1:]
+
+# (drop the triggers of 0006/0009, create, drop, restore those of 0006/0009, day of an order in SQL)
+STATEMENTS = {
+    'sqlite': (SQLITE_DROP_OLD, SQLITE_CREATE, SQLITE_DROP, SQLITE_RESTORE, 'date(date_created)'),
+    'postgresql': (POSTGRESQL_DROP_OLD, POSTGRESQL_CREATE, POSTGRESQL_DROP, POSTGRESQL_RESTORE, "(date_created AT TIME ZONE 'UTC')::date"),
+}
+
+REBUILD = (
+    'INSERT INTO sc_order_daily_summary (user_id, day, deleted, archived, order_count, amount_sum, price_sum) '
+    'SELECT user_id, {day}, deleted, {archived}, COUNT(*), SUM(amount), SUM(price) FROM {table} GROUP BY user_id, {day}, deleted'
+)
+REBUILD_WITH_ARCHIVE = (
+    'INSERT INTO sc_order_daily_summary (user_id, day, deleted, order_count, amount_sum, price_sum) '
+    'SELECT user_id, {day}, deleted, COUNT(*), SUM(amount), SUM(price) FROM sc_order_with_archive GROUP BY user_id, {day}, deleted'
+)
+
+
+def get_statements(schema_editor):
+    """
+    None on databases without the triggers of 0006, where aggregates read the orders.
+    """
+    return STATEMENTS.get(schema_editor.connection.vendor)
+
+
+def drop_summary_triggers(apps, schema_editor):
+    """
+    The triggers of sc_order go first, the summary table is rebuilt with its new key.
+    """
+    statements = get_statements(schema_editor)
+    if statements is None:
+        return
+    for statement in statements[0]:
+        schema_editor.execute(statement, params=None)
+
+
+def restore_summary_triggers(apps, schema_editor):
+    statements = get_statements(schema_editor)
+    if statements is None:
+        return
+    for statement in statements[3]:
+        schema_editor.execute(statement, params=None)
+    schema_editor.execute(REBUILD_WITH_ARCHIVE.format(day=statements[4]), params=None)
+
+
+def create_summary_triggers(apps, schema_editor):
+    statements = get_statements(schema_editor)
+    if statements is None:
+        logger.warning('Order summaries are not supported on %s, aggregates read the orders', schema_editor.connection.vendor)
+        return
+    for statement in statements[1]:
+        schema_editor.execute(statement, params=None)
+    schema_editor.execute('DELETE FROM sc_order_daily_summary', params=None)
+    for table, archived in TABLES:
+        schema_editor.execute(REBUILD.format(day=statements[4], archived=archived, table=table), params=None)
+
+
+def remove_summary_triggers(apps, schema_editor):
+    statements = get_statements(schema_editor)
+    if statements is None:
+        return
+    for statement in statements[2]:
+        schema_editor.execute(statement, params=None)
+    # rebuilt without the archived flag by restore_summary_triggers(), the old key would not fit these rows
+    schema_editor.execute('DELETE FROM sc_order_daily_summary', params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0010_order_user_names'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_summary_triggers, restore_summary_triggers),
+        migrations.RemoveConstraint(
+            model_name='orderdailysummary',
+            name='sc_order_daily_summary_key',
+        ),
+        migrations.AddField(
+            model_name='orderdailysummary',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddConstraint(
+            model_name='orderdailysummary',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'deleted', 'archived'), name='sc_order_daily_summary_key'),
+        ),
+        migrations.RunPython(create_summary_triggers, remove_summary_triggers),
+    ]
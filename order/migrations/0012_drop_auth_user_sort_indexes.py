@@ -0,0 +1,26 @@
+from django.db import migrations
+
+# Btree indexes an earlier 0004 created on auth_user for sorting orders by the user's names. The
+# orderings read the copies on sc_order since 0010, and the LIKE '%value%' of the name filters
+# never used them. Databases migrated since then do not have them.
+DROPPED_INDEXES = ['auth_user_first_name_idx', 'auth_user_last_name_idx']
+# the only ones that ran that 0004
+VENDORS = ('sqlite', 'postgresql')
+
+
+def drop_sort_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in VENDORS:
+        return
+    for name in DROPPED_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name), params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0011_order_daily_summary_archived'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_sort_indexes, migrations.RunPython.noop),
+    ]
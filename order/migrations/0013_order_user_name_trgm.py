@@ -0,0 +1,45 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# The name filters of OrderFilter are icontains on the copies 0010 added. Like customer in 0004 they get
+# trigram indexes on PostgreSQL; elsewhere no index serves LIKE '%value%' and only the orderings on
+# first and last name are indexed. The btree on user_username served neither, there is no such ordering.
+
+search_indexes = import_module('order.migrations.0004_search_indexes')
+
+# (table, column, index name)
+COLUMNS = [
+    ('sc_order', 'user_first_name', 'sc_order_user_first_name_trgm'),
+    ('sc_order', 'user_last_name', 'sc_order_user_last_name_trgm'),
+    ('sc_order', 'user_username', 'sc_order_user_username_trgm'),
+]
+
+
+def create_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column, name in COLUMNS:
+        schema_editor.execute(search_indexes.CREATE_INDEX.format(name=name, table=table, column=column), params=None)
+
+
+def drop_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for _, _, name in COLUMNS:
+        schema_editor.execute(search_indexes.DROP_INDEX.format(name=name), params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0012_drop_auth_user_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='sc_order_user_username_idx',
+        ),
+        migrations.RunPython(create_name_indexes, drop_name_indexes),
+    ]
@@ -1,5 +1,78 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connections, models
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from filters_tutorial_back.common.jobs import BaseJob
+from filters_tutorial_back.common.search import SearchDocumentField
+
+
+# Order column: User field, the copies of the user's names filters and orderings use without a join
+USER_NAME_FIELDS = {
+    'user_first_name': 'first_name',
+    'user_last_name': 'last_name',
+    'user_username': 'username',
+}
+
+# Databases the migrations install the triggers of sc_order on (search index, daily summaries,
+# tombstones). Elsewhere searches use icontains, aggregates read the orders and the tombstones
+# are written by order.signals.
+TRIGGER_VENDORS = ('sqlite', 'postgresql')
+
+
+def has_triggers(using):
+    return connections[using].vendor in TRIGGER_VENDORS
+
+
+class OrderQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        bulk_create() sends no pre_save, the names are copied here. Users not loaded on the orders are read in one query.
+        """
+        objs = list(objs)
+        missing = {obj.user_id for obj in objs if obj.user_id is not None and not self.model.user.is_cached(obj)}
+        users = User.objects.using(self.db).in_bulk(missing) if missing else {}
+        for obj in objs:
+            user = users.get(obj.user_id) or (obj.user if self.model.user.is_cached(obj) else None)
+            if user is not None:
+                for field, user_field in USER_NAME_FIELDS.items():
+                    setattr(obj, field, getattr(user, user_field))
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def sync_user_names(self):
+        """
+        Copy the names of their users into the orders that hold other ones, returns how many changed.
+        date_last_updated moves with them, the changes feed sends the orders again.
+        """
+        stale = Q()
+        for field, user_field in USER_NAME_FIELDS.items():
+            stale |= ~Q(**{field: F('user__' + user_field)})
+        users = User.objects.filter(pk=models.OuterRef('user_id'))
+        return self.filter(stale).update(date_last_updated=timezone.now(), **{
+            field: models.Subquery(users.values(user_field)[:1]) for field, user_field in USER_NAME_FIELDS.items()
+        })
+
+
+class OrderManager(models.Manager.from_queryset(OrderQuerySet)):
+    def get_archive_horizon(self, deleted=None):
+        """
+        date_created of the newest archived order (of the deleted flag), None when none is archived.
+        Every order created after it is in sc_order.
+        """
+        queryset = OrderArchive.objects.all()
+        if deleted is not None:
+            queryset = queryset.filter(deleted=deleted)
+        return queryset.aggregate(horizon=Max('date_created'))['horizon']
+
+    def spanning(self, date_from=None, deleted=None):
+        """
+        Orders created from date_from on (None: since ever): sc_order alone when no archived order
+        is in the range, else sc_order together with sc_order_archive (OrderWithArchive).
+        """
+        horizon = self.get_archive_horizon(deleted)
+        if horizon is not None and (date_from is None or date_from <= horizon):
+            return OrderWithArchive.objects.all()
+        return self.get_queryset()
 
 
 class Order(models.Model):
@@ -8,8 +81,29 @@ class Order(models.Model):
         verbose_name_plural = 'orders'
         db_table = 'sc_order'
         ordering = ['-id']
+        indexes = [
+            # OrderFilter lookups, mostly combined with deleted=false
+            models.Index(fields=['deleted', '-id'], name='sc_order_deleted_id_idx'),
+            models.Index(fields=['deleted', 'date_created'], name='sc_order_deleted_created_idx'),
+            models.Index(fields=['deleted', 'amount'], name='sc_order_deleted_amount_idx'),
+            models.Index(fields=['deleted', 'price'], name='sc_order_deleted_price_idx'),
+            # ordering_fields of OrderListCreateAPIView
+            models.Index(fields=['date_created'], name='sc_order_created_idx'),
+            models.Index(fields=['amount'], name='sc_order_amount_idx'),
+            models.Index(fields=['price'], name='sc_order_price_idx'),
+            models.Index(fields=['customer'], name='sc_order_customer_idx'),
+            # changes feed, keyset on (date_last_updated, id)
+            models.Index(fields=['date_last_updated', 'id'], name='sc_order_updated_id_idx'),
+            # orderings on the user's names, their icontains filters have trigram indexes on PostgreSQL (0013)
+            models.Index(fields=['user_first_name'], name='sc_order_user_first_name_idx'),
+            models.Index(fields=['user_last_name'], name='sc_order_user_last_name_idx'),
+        ]
 
     user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='orders', default=1)
+    # copies of the user's names (USER_NAME_FIELDS), kept in sync by order/signals.py
+    user_first_name = models.CharField(max_length=30, blank=True, default='')
+    user_last_name = models.CharField(max_length=150, blank=True, default='')
+    user_username = models.CharField(max_length=150, blank=True, default='')
     customer = models.CharField(max_length=255)
     amount = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -18,3 +112,140 @@ class Order(models.Model):
     deleted = models.BooleanField(default=False)
     date_created = models.DateTimeField(auto_now_add=True)
     date_last_updated = models.DateTimeField(auto_now=True)
+
+    objects = OrderManager()
+
+
+class OrderArchive(models.Model):
+    """
+    Orders moved out of sc_order by `python manage.py archive_orders` (old, or deleted a while ago),
+    so sc_order and its indexes only hold the orders in use. Read only, under their original ids.
+    """
+    class Meta:
+        verbose_name = 'archived order'
+        verbose_name_plural = 'archived orders'
+        db_table = 'sc_order_archive'
+        ordering = ['-id']
+        indexes = [
+            # the archive horizon (OrderManager.get_archive_horizon) and date ranges
+            models.Index(fields=['deleted', 'date_created'], name='sc_order_archive_deleted_idx'),
+            models.Index(fields=['date_created'], name='sc_order_archive_created_idx'),
+        ]
+
+    id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='archived_orders')
+    # copies of the user's names (USER_NAME_FIELDS)
+    user_first_name = models.CharField(max_length=30, blank=True, default='')
+    user_last_name = models.CharField(max_length=150, blank=True, default='')
+    user_username = models.CharField(max_length=150, blank=True, default='')
+    customer = models.CharField(max_length=255)
+    amount = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    notes = models.TextField()
+
+    deleted = models.BooleanField(default=False)
+    date_created = models.DateTimeField()
+    date_last_updated = models.DateTimeField()
+    date_archived = models.DateTimeField()
+
+    objects = OrderQuerySet.as_manager()
+
+
+class OrderWithArchive(models.Model):
+    """
+    sc_order and sc_order_archive as one table, a UNION ALL view (migration 0009). Queried when
+    a date range reaches into the archive, see OrderManager.spanning().
+    """
+    class Meta:
+        managed = False
+        db_table = 'sc_order_with_archive'
+        ordering = ['-id']
+
+    id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(to=User, on_delete=models.DO_NOTHING, related_name='+')
+    user_first_name = models.CharField(max_length=30)
+    user_last_name = models.CharField(max_length=150)
+    user_username = models.CharField(max_length=150)
+    customer = models.CharField(max_length=255)
+    amount = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    notes = models.TextField()
+
+    deleted = models.BooleanField(default=False)
+    date_created = models.DateTimeField()
+    date_last_updated = models.DateTimeField()
+
+
+class OrderSearch(models.Model):
+    """
+    Full-text index of an order: customer, notes and the user's names.
+    Created and kept in sync by database triggers (migration 0005), never written by Django.
+    Missing on databases without them (see TRIGGER_VENDORS).
+    """
+    class Meta:
+        managed = False
+        db_table = 'sc_order_search'
+
+    # FTS5 tables are keyed by rowid
+    order = models.OneToOneField(to=Order, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search')
+    document = SearchDocumentField(db_column='sc_order_search')
+
+
+class OrderTombstone(models.Model):
+    """
+    An order deleted from sc_order, so the changes feed can report it.
+    Written by a database trigger (migration 0008) on every delete, by order.signals on
+    databases without one (see TRIGGER_VENDORS).
+    """
+    class Meta:
+        verbose_name = 'order tombstone'
+        verbose_name_plural = 'order tombstones'
+        db_table = 'sc_order_tombstone'
+        indexes = [
+            models.Index(fields=['date_deleted', 'order_id'], name='sc_order_tombstone_deleted_idx'),
+        ]
+
+    # not a foreign key, the order is gone
+    order_id = models.PositiveIntegerField()
+    date_deleted = models.DateTimeField()
+
+
+class OrderDailySummary(models.Model):
+    """
+    Orders per user, day (UTC) and deleted flag with their totals, so dashboards do not scan sc_order.
+    Maintained incrementally by database triggers on sc_order (migration 0006), archived orders
+    in rows of their own by those on sc_order_archive (migration 0011).
+    """
+    class Meta:
+        verbose_name = 'order daily summary'
+        verbose_name_plural = 'order daily summaries'
+        db_table = 'sc_order_daily_summary'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day', 'deleted', 'archived'], name='sc_order_daily_summary_key'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='sc_order_daily_summary_day_idx'),
+        ]
+
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='order_summaries')
+    day = models.DateField()
+    deleted = models.BooleanField(default=False)
+    # totals of orders in sc_order_archive
+    archived = models.BooleanField(default=False)
+    order_count = models.PositiveIntegerField(default=0)
+    amount_sum = models.BigIntegerField(default=0)
+    price_sum = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+
+class Job(BaseJob):
+    """
+    Background job (export, bulk change, reindex), run by `python manage.py run_jobs`.
+    """
+    class Meta(BaseJob.Meta):
+        verbose_name = 'job'
+        verbose_name_plural = 'jobs'
+        db_table = 'sc_job'
+        indexes = [
+            # claimed oldest first
+            models.Index(fields=['status', 'id'], name='sc_job_status_id_idx'),
+        ]
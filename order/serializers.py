@@ -1,7 +1,10 @@
 from django.contrib.auth.models import User
-from rest_framework.serializers import ModelSerializer
+from django.urls import reverse
+from rest_framework.serializers import JSONField, ModelSerializer, SerializerMethodField, ValidationError
 
-from order.models import Order
+from filters_tutorial_back.common.serializers import BulkListSerializer, SparseFieldsetMixin, ValuesSerializer
+
+from order.models import Job, Order
 
 
 class UserSerializer(ModelSerializer):
@@ -10,9 +13,71 @@ class UserSerializer(ModelSerializer):
         fields = ['username', 'first_name', 'last_name']
 
 
-class OrderSerializer(ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, ModelSerializer):
     user = UserSerializer()
 
     class Meta:
         model = Order
         fields = ['id', 'customer', 'amount', 'price', 'notes', 'deleted', 'date_created', 'date_last_updated', 'user']
+
+
+class OrderWriteSerializer(ModelSerializer):
+    class Meta:
+        model = Order
+        fields = ['id', 'customer', 'amount', 'price', 'notes', 'deleted', 'date_created', 'date_last_updated', 'user']
+        read_only_fields = ['date_created', 'date_last_updated']
+        list_serializer_class = BulkListSerializer
+
+
+class OrderValuesSerializer(ValuesSerializer):
+    """
+    Fast list rendering of OrderSerializer from queryset values.
+    """
+    model_serializer_class = OrderSerializer
+
+
+class JobSerializer(ModelSerializer):
+    """
+    Submitted with `kind` and `params`, read back with its progress and result.
+    """
+    params = JSONField(write_only=True, required=False, default=dict)
+    result = SerializerMethodField()
+    result_url = SerializerMethodField()
+    error = SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'params', 'status', 'progress', 'total', 'result', 'result_url', 'error', 'attempts',
+            'date_created', 'date_started', 'date_finished'
+        ]
+        read_only_fields = ['status', 'progress', 'total', 'attempts', 'date_created', 'date_started', 'date_finished']
+
+    def validate_kind(self, value):
+        kinds = getattr(self.context.get('view'), 'job_kinds', [])
+        if value not in kinds:
+            raise ValidationError('Unknown job kind {}, choose from {}'.format(value, ', '.join(kinds)))
+        return value
+
+    def validate_params(self, value):
+        if not isinstance(value, dict):
+            raise ValidationError('Expected an object')
+        return value
+
+    def create(self, validated_data):
+        request = self.context.get('request')
+        return Job.enqueue(validated_data['kind'], validated_data.get('params'), user=getattr(request, 'user', None))
+
+    def get_result(self, obj):
+        return obj.get_result()
+
+    def get_result_url(self, obj):
+        if not obj.is_finished:
+            return None
+        url = reverse('job-result', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_error(self, obj):
+        # the traceback stays in the database, clients get its last line
+        return obj.error.strip().splitlines()[-1] if obj.error.strip() else None
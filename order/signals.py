@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from filters_tutorial_back.common import events
+from filters_tutorial_back.common.cache import bump_generation
+from filters_tutorial_back.common.events import publish_changes
+from filters_tutorial_back.common.signals import BULK_DELETE, BULK_UPDATE, post_bulk_change
+from order.models import USER_NAME_FIELDS, Order, OrderArchive, OrderTombstone, has_triggers
+
+# event stream of orders, see filters_tutorial_back/asgi.py
+ORDERS_CHANNEL = 'orders'
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_bulk_change, sender=Order)
+def invalidate_cached_queries(sender, using=None, queryset=None, **kwargs):
+    """
+    Cached counts and responses embed the model generations, bumping them drops every entry at once.
+    """
+    bump_generation(sender, using=using or (queryset.db if queryset is not None else None))
+
+
+@receiver(post_save, sender=Order)
+def publish_saved_order(sender, instance, created, using, **kwargs):
+    publish_changes(ORDERS_CHANNEL, events.CREATE if created else events.UPDATE, [instance.pk], using=using)
+
+
+@receiver(post_delete, sender=Order)
+def publish_deleted_order(sender, instance, using, **kwargs):
+    publish_changes(ORDERS_CHANNEL, events.DELETE, [instance.pk], using=using)
+
+
+@receiver(post_delete, sender=Order)
+def write_order_tombstone(sender, instance, using, **kwargs):
+    """
+    The tombstone the trigger of migration 0008 writes, on databases without it.
+    Orders moved by archive_orders are deleted with SQL and get none, as with the trigger.
+    """
+    if not has_triggers(using):
+        OrderTombstone.objects.using(using).create(order_id=instance.pk, date_deleted=timezone.now())
+
+
+@receiver(post_bulk_change, sender=Order)
+def publish_bulk_order_changes(sender, action, objs=None, queryset=None, **kwargs):
+    """
+    Deleted rows are published by post_delete, which queryset.delete() still sends for each row.
+    """
+    if action == BULK_DELETE or not events.hub.is_watched(ORDERS_CHANNEL):
+        return
+    if objs is not None:
+        ids = [obj.pk for obj in objs]
+        if None in ids:
+            # bulk_create() sets the ids on PostgreSQL only
+            action = events.RESET
+    else:
+        # one more than the limit is enough to send a reset
+        ids = list(queryset.values_list('pk', flat=True)[:getattr(settings, 'EVENT_STREAM_MAX_IDS', 1000) + 1])
+    publish_changes(ORDERS_CHANNEL, action, ids, using=queryset.db if queryset is not None else None)
+
+
+@receiver(pre_save, sender=Order)
+def copy_user_names(sender, instance, **kwargs):
+    """
+    The user's names are copied on the order (USER_NAME_FIELDS), filters and orderings read them without a join.
+    """
+    if instance.user_id is not None:
+        for field, user_field in USER_NAME_FIELDS.items():
+            setattr(instance, field, getattr(instance.user, user_field))
+
+
+@receiver(post_bulk_change, sender=Order)
+def sync_bulk_user_names(sender, action, queryset=None, fields=None, **kwargs):
+    """
+    Orders moved to another user by a bulk update. bulk_create() copies the names itself (OrderQuerySet).
+    """
+    if action == BULK_UPDATE and 'user' in (fields or ()):
+        queryset.sync_user_names()
+
+
+@receiver(post_save, sender=User)
+def sync_order_user_names(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Renamed users. Writes that bypass save() (queryset.update(), raw SQL) need `python manage.py sync_user_names`.
+    """
+    if created or (update_fields is not None and not set(update_fields) & set(USER_NAME_FIELDS.values())):
+        # e.g. the last_login of a login
+        return
+    for model in (Order, OrderArchive):
+        model.objects.filter(user=instance).sync_user_names()
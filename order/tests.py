@@ -1,3 +1,1338 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import json
+import sqlite3
+import tempfile
+import zipfile
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.signals import request_started
+from django.db import connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import Count, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from filters_tutorial_back.asgi import application
+from filters_tutorial_back.common.async_views import AsyncListView
+from filters_tutorial_back.common.filters import get_shape_class
+from filters_tutorial_back.common.pagination import Pagination
+from filters_tutorial_back.common.renderers import FastJSONRenderer
+from filters_tutorial_back.common.routers import REPLICA_PIN_COOKIE
+from filters_tutorial_back.common.queryset import optimize_queryset
+from filters_tutorial_back.common.serializers import Fieldset
+from filters_tutorial_back.common.signals import post_bulk_change
+from order.filters import OrderFilter
+from order.jobs import reindex_orders
+from order.models import Job, Order, OrderArchive, OrderDailySummary, OrderTombstone
+from order.serializers import OrderSerializer, OrderValuesSerializer
+from order.views import OrderChangesAPIView, OrderListCreateAPIView
+
+
+def create_orders(count, users=3, using='default'):
+    users = [User.objects.db_manager(using).create(username='user{}'.format(i), first_name='First{}'.format(i), last_name='Last{}'.format(i)) for i in range(users)]
+    return Order.objects.using(using).bulk_create([
+        Order(user=users[i % len(users)], customer='Customer {}'.format(i), amount=i + 1, price=Decimal('10.50') + i, notes='Notes {}'.format(i))
+        for i in range(count)
+    ])
+
+
+class OrderTestCase(TestCase):
+    def setUp(self):
+        # bulk_create sends no signals, so cached counts/responses of a previous test would survive
+        cache.clear()
+
+
+class OrderListQueryCountTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(20, users=10)
+
+    def test_list_does_not_query_users_per_row(self):
+        # One COUNT for the pagination and one SELECT for the page.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('orders'), {'page_size': 20})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']), 20)
+        self.assertIn('username', response.data['data'][0]['user'])
+
+    def test_ordering_and_filtering_on_user_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('orders'), {'page_size': 20, 'ordering': 'user__last_name', 'username': 'user1'})
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['pagination']['count'], 2)
+        # filtered and counted on the copies of the user's names, the page joins auth_user for the serializer only
+        self.assertNotIn('auth_user', queries[0]['sql'])
+        self.assertIn('ORDER BY "sc_order"."user_last_name"', queries[1]['sql'])
+
+
+class OrderKeysetPaginationTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(25, users=4)
+        for order in Order.objects.all():
+            order.price = Decimal(order.amount % 4)  # ties, so the id tiebreaker matters
+            order.save()
+
+    def walk(self, params, direction='next'):
+        ids, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get(reverse('orders'), dict(params, cursor=cursor, page_size=7))
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data['pagination'])
+            ids += [row['id'] for row in response.data['data']]
+            cursor = response.data['pagination'][direction]
+        return ids, response
+
+    def test_walks_every_ordering_field(self):
+        for ordering in ['id', '-price', 'customer', 'amount', '-date_created', 'user__first_name', '-user__last_name', 'deleted']:
+            expected = [row['id'] for row in self.client.get(reverse('orders'), {'ordering': ordering, 'page_size': 100}).data['data']]
+            ids, _ = self.walk({'ordering': ordering})
+            self.assertEqual(len(ids), 25, ordering)
+            self.assertEqual(len(set(ids)), 25, ordering)
+            if ordering in ('id', 'customer', 'amount'):
+                self.assertEqual(ids, expected, ordering)
+
+    def test_previous_returns_the_same_pages(self):
+        forward, response = self.walk({'ordering': 'price'})
+        cursor = response.data['pagination']['previous']
+        backward = [row['id'] for row in response.data['data']]
+        while cursor is not None:
+            response = self.client.get(reverse('orders'), {'ordering': 'price', 'cursor': cursor, 'page_size': 7})
+            backward = [row['id'] for row in response.data['data']] + backward
+            cursor = response.data['pagination']['previous']
+        self.assertEqual(backward, forward)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('orders'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class OrderCountCacheTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(12)
+
+    def test_count_is_cached_until_an_order_is_written(self):
+        params = {'customer': 'customer', 'amount_min': 2}
+        self.assertEqual(self.client.get(reverse('orders'), params).data['pagination']['count'], 11)
+        # page and ordering do not change the count, the cached value is reused
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('orders'), dict(params, ordering='price', page=2))
+        self.assertEqual(response.data['pagination'], {'count': 11, 'count_exact': True})
+
+        Order.objects.first().delete()
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('orders'), params)
+        self.assertEqual(response.data['pagination']['count'], 10)
+
+    def test_validators_fill_the_count_cache(self):
+        with mock.patch.multiple(OrderListCreateAPIView, response_cache_timeout=0, validators_cache_timeout=0):
+            # the aggregate of the validators and the page
+            with self.assertNumQueries(2):
+                self.client.get(reverse('orders'), {'page_size': 5})
+            # and the COUNT of the paginator
+            with mock.patch.object(Pagination, 'count_cache_timeout', 0), self.assertNumQueries(3):
+                self.client.get(reverse('orders'), {'page_size': 5})
+
+    def test_estimated_count(self):
+        response = self.client.get(reverse('orders'), {'count': 'estimated'})
+        self.assertEqual(response.data['pagination'], {'count': 12, 'count_exact': True})
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cache.clear()  # the previous response is cached
+        with mock.patch.object(Pagination, 'count_estimate_threshold', 5):
+            response = self.client.get(reverse('orders'), {'count': 'estimated'})
+            self.assertEqual(response.data['pagination'], {'count': 12, 'count_exact': False})
+            # filtered queries have no estimate on SQLite and stay exact
+            response = self.client.get(reverse('orders'), {'count': 'estimated', 'amount_max': 3})
+            self.assertEqual(response.data['pagination'], {'count': 3, 'count_exact': True})
+
+
+class OrderResponseCacheTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(12)
+
+    def assert_cached(self, query_string):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('orders') + query_string)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        return response
+
+    def test_equivalent_queries_share_an_entry(self):
+        response = self.client.get(reverse('orders') + '?amount_min=2&customer=Customer&page=2&page_size=5')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        cached = self.assert_cached('?page_size=5&customer=Customer&amount_min=2.00&page=2&amount_max=')
+        self.assertEqual(cached.data, response.data)
+
+    def test_writes_evict_cached_pages(self):
+        self.client.get(reverse('orders'))
+        self.assert_cached('')
+
+        order = Order.objects.get(amount=12)
+        order.customer = 'Renamed'
+        order.save()
+        response = self.client.get(reverse('orders'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['data'][0]['customer'], 'Renamed')
+
+        user = order.user
+        user.first_name = 'Renamed'
+        user.save()
+        response = self.client.get(reverse('orders'))
+        self.assertEqual(response.data['data'][0]['user']['first_name'], 'Renamed')
+
+    def test_commit_bumps_the_generation_again(self):
+        Order.objects.get(amount=12).save()
+        # cached before the test's transaction commits, by a process that can not see the write yet
+        self.client.get(reverse('orders'), {'cursor': ''})
+        self.assertEqual(self.client.get(reverse('orders'), {'cursor': ''})['X-Cache'], 'HIT')
+        for _, function in connection.run_on_commit:
+            function()
+        self.assertEqual(self.client.get(reverse('orders'), {'cursor': ''})['X-Cache'], 'MISS')
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}):
+                self.client.get(reverse('orders'), {'ordering': 'price'})
+                self.assert_cached('?ordering=price')
+                Order.objects.first().delete()
+                self.assertEqual(self.client.get(reverse('orders'), {'ordering': 'price'})['X-Cache'], 'MISS')
+
+
+class OrderFilterShapeTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(12)
+
+    def test_shape_class_holds_the_set_filters(self):
+        shape_class = get_shape_class(OrderFilter, ('customer', 'amount'))
+        self.assertIs(get_shape_class(OrderFilter, ('customer', 'amount')), shape_class)
+        self.assertEqual(list(shape_class.base_filters), ['customer', 'amount'])
+        self.assertEqual(list(shape_class().form.fields), ['customer', 'amount'])
+
+    def test_unset_filters_do_not_change_the_result(self):
+        with mock.patch.object(OrderListCreateAPIView, 'response_cache_timeout', 0):
+            response = self.client.get(reverse('orders'), {'customer': 'Customer 1', 'amount_min': 2})
+            same = self.client.get(reverse('orders'), {'customer': 'Customer 1', 'amount_min': 2, 'price_min': '', 'q': ''})
+        self.assertEqual(response.data['pagination']['count'], 3)
+        self.assertEqual(same.data, response.data)
+        invalid = self.client.get(reverse('orders'), {'amount_min': 'x'})
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_filters_are_validated_once_per_request(self):
+        form_class = get_shape_class(OrderFilter, ('customer',)).get_form_class(None)
+        with mock.patch.object(form_class, 'full_clean', autospec=True, side_effect=form_class.full_clean) as full_clean:
+            self.client.get(reverse('orders'), {'customer': 'Customer'})
+        # cache key, validators and page share the form
+        self.assertEqual(full_clean.call_count, 1)
+
+
+class OrderExplainTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(12)
+
+    @override_settings(QUERY_EXPLAIN_ENABLED=True)
+    def test_explain(self):
+        response = self.client.get(reverse('orders'), {'explain': 1, 'customer': 'Customer', 'page_size': 5})
+        self.assertEqual(response.status_code, 200)
+        data = response.data['data']
+        self.assertEqual((data['status'], data['filters']), (200, ['customer']))
+        # the count and the page, not cached
+        self.assertEqual(len(data['queries']), 2)
+        self.assertIn('COUNT', data['queries'][0]['sql'])
+        self.assertIn('%Customer%', data['queries'][0]['params'])
+        self.assertTrue(data['queries'][1]['plan'])
+        # icontains reads every order
+        self.assertTrue(any('order' in step for step in data['queries'][1]['table_scans']))
+        self.assertEqual(len(self.client.get(reverse('orders'), {'explain': 1}).data['data']['queries']), 2)
+
+    @override_settings(QUERY_EXPLAIN_ENABLED=False)
+    def test_explain_disabled(self):
+        response = self.client.get(reverse('orders'), {'explain': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']), 10)
+
+
+@mock.patch.object(OrderChangesAPIView, 'settle_seconds', 0)
+class OrderChangesTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(12)
+
+    def sync(self, since=None, **params):
+        upserts, deletes = [], []
+        while True:
+            response = self.client.get(reverse('orders-changes'), dict(params, since=since) if since else params)
+            self.assertEqual(response.status_code, 200)
+            data = response.data['data']
+            upserts += data['upserts']
+            deletes += data['deletes']
+            since = data['watermark']
+            if not data['has_more']:
+                return upserts, deletes, since
+
+    def test_delta_sync(self):
+        upserts, deletes, since = self.sync(page_size=5)
+        self.assertEqual(sorted(row['id'] for row in upserts), sorted(Order.objects.values_list('id', flat=True)))
+        self.assertEqual(deletes, [])
+        self.assertEqual(self.sync(since)[:2], ([], []))
+
+        updated, deleted = Order.objects.order_by('id')[:2]
+        updated.customer = 'Renamed'
+        updated.save()
+        deleted_id = deleted.pk
+        deleted.delete()
+        Order.objects.filter(pk=updated.pk + 5).update(deleted=True, date_last_updated=timezone.now())
+        upserts, deletes, since = self.sync(since, fields='id,customer,deleted')
+        self.assertEqual(upserts, [{'id': updated.pk, 'customer': 'Renamed', 'deleted': False}, {'id': updated.pk + 5, 'customer': 'Customer 5', 'deleted': True}])
+        self.assertEqual(deletes, [deleted_id])
+
+        # deletes are recorded whatever deletes the row
+        user = User.objects.get(username='user2')
+        ids = sorted(user.orders.values_list('id', flat=True))
+        user.delete()
+        self.assertEqual(sorted(self.sync(since)[1]), ids)
+
+    def test_renamed_user_is_sent_again(self):
+        since = self.sync()[2]
+        user = User.objects.get(username='user1')
+        user.first_name = 'Renamed'
+        user.save()
+        upserts = self.sync(since, fields='id,user', expand='user')[0]
+        self.assertEqual(sorted(row['id'] for row in upserts), sorted(user.orders.values_list('id', flat=True)))
+        self.assertTrue(all(row['user']['first_name'] == 'Renamed' for row in upserts))
+
+    def test_recent_changes_are_held_back(self):
+        since = self.sync()[2]
+        Order.objects.update(customer='Renamed', date_last_updated=timezone.now())
+        with mock.patch.object(OrderChangesAPIView, 'settle_seconds', 60):
+            self.assertEqual(self.sync(since)[:2], ([], []))
+        self.assertEqual(len(self.sync(since)[0]), 12)
+
+    def test_expired_watermark(self):
+        since = self.sync()[2]
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(days=31)):
+            response = self.client.get(reverse('orders-changes'), {'since': since})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(self.client.get(reverse('orders-changes'), {'since': 'x'}).status_code, 400)
+
+        Order.objects.first().delete()
+        OrderTombstone.objects.update(date_deleted=timezone.now() - datetime.timedelta(days=31))
+        self.assertEqual(Job.enqueue('orders.prune_tombstones').run().get_result(), {'deleted': 1})
+
+
+class OrderArchiveTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(12)
+        # amount 1-4 created two years ago, amount 5-6 deleted two months ago
+        old = timezone.now() - datetime.timedelta(days=730)
+        Order.objects.filter(amount__lte=4).update(date_created=old, date_last_updated=old)
+        Order.objects.filter(amount__in=[5, 6]).update(deleted=True, date_last_updated=timezone.now() - datetime.timedelta(days=60))
+
+    def archive(self):
+        out = io.StringIO()
+        call_command('archive_orders', batch_size=2, stdout=out)
+        self.assertIn('6 orders archived', out.getvalue())
+
+    def list_amounts(self, **params):
+        response = self.client.get(reverse('orders'), dict(params, page_size=100))
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['amount'] for row in response.data['data'])
+
+    def test_archive_orders(self):
+        summaries = list(OrderDailySummary.objects.values_list('user', 'day', 'deleted', 'order_count', 'price_sum'))
+        self.archive()
+        self.assertEqual(sorted(Order.objects.values_list('amount', flat=True)), list(range(7, 13)))
+        self.assertEqual(sorted(OrderArchive.objects.values_list('amount', flat=True)), list(range(1, 7)))
+        # not deleted: no tombstones, still in the summaries
+        self.assertFalse(OrderTombstone.objects.exists())
+        self.assertCountEqual(OrderDailySummary.objects.values_list('user', 'day', 'deleted', 'order_count', 'price_sum'), summaries)
+        self.assertEqual(Job.enqueue('orders.archive').run().get_result(), {'archived': 0})
+
+    def test_lists_read_the_archive_when_needed(self):
+        self.archive()
+        recent = (timezone.now() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.list_amounts(), list(range(7, 13)))
+            self.assertEqual(self.list_amounts(date_created_after=recent, deleted='false'), list(range(7, 13)))
+        self.assertFalse(any('sc_order_with_archive' in query['sql'] for query in queries))
+        # the deleted orders were archived recently
+        self.assertEqual(self.list_amounts(date_created_after=recent), list(range(5, 13)))
+        self.assertEqual(self.list_amounts(date_created_before=recent, fields='amount'), [1, 2, 3, 4])
+        self.assertEqual(self.list_amounts(archive='include', amount_max=2), [1, 2])
+        self.assertEqual(self.list_amounts(archive='exclude', date_created_before=recent), [])
+        self.assertEqual(self.client.get(reverse('orders'), {'archive': 'all'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('orders-aggregates'), {'archive': 'include'}).data['data'][0]['count'], 12)
+
+    def test_aggregate_paths_agree_on_archived_orders(self):
+        self.archive()
+        old = (timezone.now() - datetime.timedelta(days=800)).strftime('%Y-%m-%d')
+
+        def aggregate(source, **params):
+            # a cached response has no X-Aggregate-Source
+            cache.clear()
+            response = self.client.get(reverse('orders-aggregates'), params)
+            self.assertEqual(response['X-Aggregate-Source'], source)
+            return response.data['data']
+
+        for params in ({}, {'group_by': 'user'}, {'group_by': 'day'}, {'archive': 'include', 'group_by': 'user'}, {'day_after': old}):
+            # any amount, but only the query path can filter on it
+            self.assertEqual(aggregate('summary', **params), aggregate('query', amount_min=0, **params))
+        self.assertEqual(aggregate('summary')[0]['count'], 6)
+        self.assertEqual(aggregate('summary', archive='include')[0]['count'], 12)
+        self.assertEqual(aggregate('summary', day_after=old)[0]['count'], 12)
+        self.assertEqual(self.client.get(reverse('orders')).data['pagination']['count'], 6)
+        # reindexing rebuilds the archived rows too
+        summaries = list(OrderDailySummary.objects.values_list('user', 'day', 'deleted', 'archived', 'order_count', 'price_sum'))
+        Job.enqueue('orders.reindex').run()
+        self.assertCountEqual(OrderDailySummary.objects.values_list('user', 'day', 'deleted', 'archived', 'order_count', 'price_sum'), summaries)
+
+
+class OrderUserNamesTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(6, users=2)
+
+    def assertNamesInSync(self):
+        for order in Order.objects.select_related('user'):
+            self.assertEqual(
+                (order.user_first_name, order.user_last_name, order.user_username),
+                (order.user.first_name, order.user.last_name, order.user.username)
+            )
+
+    def test_names_are_copied(self):
+        self.assertNamesInSync()
+        user = User.objects.get(username='user0')
+        order = Order.objects.create(user=user, customer='Customer', amount=1, price=Decimal('1.00'))
+        self.assertEqual(order.user_username, 'user0')
+        order.user = User.objects.get(username='user1')
+        order.save()
+        self.assertEqual(Order.objects.get(pk=order.pk).user_username, 'user1')
+
+    def test_renamed_user(self):
+        user = User.objects.get(username='user0')
+        user.last_name = 'Renamed'
+        user.save()
+        self.assertEqual(Order.objects.filter(user_last_name='Renamed').count(), 3)
+        self.assertNamesInSync()
+        with self.assertNumQueries(1):
+            # no name changed
+            user.save(update_fields=['last_login'])
+
+    def test_sync_user_names_command(self):
+        User.objects.filter(username='user1').update(first_name='Changed')
+        out = io.StringIO()
+        call_command('sync_user_names', batch_size=2, stdout=out)
+        self.assertIn('orders: 3 updated', out.getvalue())
+        self.assertNamesInSync()
+
+    def test_filter_and_ordering_without_join(self):
+        User.objects.filter(username='user1').update(last_name='Aaa')
+        call_command('sync_user_names', stdout=io.StringIO())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('orders'), {'ordering': 'user__last_name', 'user__last_name': 'aa', 'fields': 'id,amount'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(row['amount'] for row in response.data['data']), [2, 4, 6])
+        self.assertFalse(any('auth_user' in query['sql'] for query in queries))
+
+
+class OrderConditionalGetTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(12)
+
+    def test_list_not_modified(self):
+        params = {'customer': 'Customer', 'page_size': 5}
+        with mock.patch.multiple(OrderListCreateAPIView, response_cache_timeout=0, validators_cache_timeout=0):
+            response = self.client.get(reverse('orders'), params)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Last-Modified', response)
+            etag = response['ETag']
+            # the aggregate query alone answers, the page is neither fetched nor counted
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('orders'), params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual((response.status_code, response['ETag'], response.content), (304, etag, b''))
+
+        self.assertEqual(self.client.get(reverse('orders'), params)['ETag'], etag)
+        # validators and page come from the response cache, nothing is queried or serialized
+        with self.assertNumQueries(0), mock.patch.object(OrderSerializer, 'to_representation') as to_representation:
+            response = self.client.get(reverse('orders'), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        to_representation.assert_not_called()
+        # other parameters are another representation
+        self.assertEqual(self.client.get(reverse('orders'), dict(params, page=2), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_writes_change_the_list_validators(self):
+        etag = self.client.get(reverse('orders'))['ETag']
+        self.assertEqual(self.client.get(reverse('orders'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        order = Order.objects.get(amount=3)
+        order.save()
+        self.assertEqual(self.client.get(reverse('orders'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(reverse('orders'))['ETag']
+        order.delete()  # the count changes while the newest timestamp may not
+        self.assertEqual(self.client.get(reverse('orders'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_not_modified(self):
+        order = Order.objects.first()
+        response = self.client.get(reverse('order', args=[order.id]))
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('order', args=[order.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(reverse('order', args=[order.id]), HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        order.user.first_name = 'Renamed'
+        order.user.save()
+        response = self.client.get(reverse('order', args=[order.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['user']['first_name'], 'Renamed')
+        self.assertEqual(self.client.get(reverse('order', args=[0]), HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTestCase(OrderTestCase):
+    """
+    The replica is a second SQLite file that never receives the primary's writes,
+    so every response shows which database it was read from.
+    """
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.databases['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': cls.directory.name + '/replica.sqlite3'}
+        with override_settings(DATABASE_REPLICAS=['replica']):
+            call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections.databases['replica']
+        delattr(connections._connections, 'replica')
+        cls.directory.cleanup()
+
+    def setUp(self):
+        super().setUp()
+        create_orders(3)
+        create_orders(5, using='replica')
+        self.replica_orders = list(Order.objects.using('replica').order_by('id'))
+
+    def test_gets_read_from_the_replica(self):
+        self.assertEqual(self.client.get(reverse('orders')).data['pagination']['count'], 5)
+        self.assertEqual(self.client.get(reverse('orders-aggregates')).data['data'][0]['count'], 5)
+        order = self.replica_orders[4]
+        self.assertEqual(self.client.get(reverse('order', args=[order.id])).data['data']['customer'], order.customer)
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        user = User.objects.first()
+        response = self.client.post(reverse('orders'), {'customer': 'New', 'amount': 1, 'price': '1.00', 'notes': 'Notes', 'user': user.id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.cookies[REPLICA_PIN_COOKIE]['max-age'], 10)
+        self.assertTrue(Order.objects.filter(customer='New').exists())
+        self.assertFalse(Order.objects.using('replica').filter(customer='New').exists())
+
+        # the writer sees its order, other clients read the replica until it catches up
+        self.assertEqual(self.client.get(reverse('orders')).data['pagination']['count'], 4)
+        self.assertEqual(self.client.get(reverse('order', args=[response.data['data']['id']])).status_code, 200)
+        self.assertEqual(self.client_class().get(reverse('orders')).data['pagination']['count'], 5)
+
+    def test_instances_read_from_the_replica_are_saved_to_the_primary(self):
+        order = Order.objects.using('replica').get(id=self.replica_orders[0].id)
+        order.user = User.objects.using('replica').get(id=order.user_id)
+        order.customer = 'Saved'
+        order.save()
+        self.assertEqual(Order.objects.using('replica').get(id=order.id).customer, self.replica_orders[0].customer)
+        self.assertTrue(Order.objects.filter(customer='Saved').exists())
+
+
+class OrderValuesSerializerTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(15)
+        Order.objects.filter(amount=3).update(price=Decimal('0.1'), deleted=True)
+
+    def test_output_is_identical_to_order_serializer(self):
+        renderer = JSONRenderer()
+        orders = Order.objects.select_related('user')
+        rows = Order.objects.values(*OrderValuesSerializer.get_values_fields())
+        self.assertEqual(renderer.render(OrderValuesSerializer(rows, many=True).data), renderer.render(OrderSerializer(orders, many=True).data))
+
+    def test_list_endpoint(self):
+        response = self.client.get(reverse('orders'), {'page_size': 15, 'ordering': 'price'})
+        expected = OrderSerializer(Order.objects.order_by('price', '-id'), many=True).data
+        self.assertEqual(response.content, JSONRenderer().render({'data': expected, 'pagination': {'count': 15, 'count_exact': True}}))
+
+
+class RenderingTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(40)
+
+    def test_fast_renderer_output_is_identical(self):
+        data = {
+            'data': OrderSerializer(Order.objects.all(), many=True).data,
+            'raw': [datetime.datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=datetime.timezone.utc), datetime.date(2020, 1, 2), Decimal('10.50'), 'line\u2028separator', {1: None}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'), JSONRenderer().render(data, 'application/json; indent=2'))
+
+    def test_fast_renderer_differences(self):
+        # integers orjson refuses are rendered by JSONRenderer
+        data = {'big': [2 ** 64, -2 ** 63 - 1]}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        # floats: the same numbers in shorter exponents
+        self.assertEqual(JSONRenderer().render([0.1, 1e16, 1e-7]), b'[0.1,1e+16,1e-07]')
+        self.assertEqual(FastJSONRenderer().render([0.1, 1e16, 1e-7]), b'[0.1,1e16,1e-7]')
+        # null for what JSON has no number for, where JSONRenderer refuses with STRICT_JSON
+        data = [float('nan'), float('inf'), float('-inf')]
+        with self.assertRaises(ValueError):
+            JSONRenderer().render(data)
+        self.assertEqual(FastJSONRenderer().render(data), b'[null,null,null]')
+        with mock.patch.object(FastJSONRenderer, 'strict', False):
+            self.assertEqual(FastJSONRenderer().render(data), b'[NaN,Infinity,-Infinity]')
+
+    def test_large_responses_are_compressed(self):
+        plain = self.client.get(reverse('orders'), {'page_size': 40})
+        self.assertNotIn('Content-Encoding', plain)
+        response = self.client.get(reverse('orders'), {'page_size': 40}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        # compressed bytes differ, so the ETag is weak and still validates
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        self.assertEqual(self.client.get(reverse('orders'), {'page_size': 40}, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_small_or_refused_responses_are_not_compressed(self):
+        self.assertNotIn('Content-Encoding', self.client.get(reverse('orders'), {'page_size': 1}, HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertNotIn('Content-Encoding', self.client.get(reverse('orders'), {'page_size': 40}, HTTP_ACCEPT_ENCODING='gzip;q=0, identity'))
+
+    @override_settings(COMPRESSION={'MIN_SIZE': 10 ** 6})
+    def test_size_threshold(self):
+        self.assertNotIn('Content-Encoding', self.client.get(reverse('orders'), {'page_size': 40}, HTTP_ACCEPT_ENCODING='*'))
+
+
+class OrderExportTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(30)
+
+    def export(self, file_format, params=None):
+        response = self.client.get(reverse('orders-export', kwargs={'file_format': file_format}), params or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        content = self.export('csv', {'amount_min': 21, 'ordering': 'amount'}).decode('utf-8')
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ['id', 'customer', 'amount', 'price', 'notes', 'deleted', 'date_created', 'date_last_updated', 'user.username', 'user.first_name', 'user.last_name'])
+        self.assertEqual([row[2] for row in rows[1:]], [str(amount) for amount in range(21, 31)])
+        self.assertEqual(rows[1][3], '30.50')
+
+    def test_ndjson_matches_list_representation(self):
+        lines = self.export('ndjson', {'customer': 'Customer 1'}).decode('utf-8').splitlines()
+        listed = self.client.get(reverse('orders'), {'customer': 'Customer 1', 'page_size': 100}).data['data']
+        self.assertEqual([json.loads(line) for line in lines], json.loads(JSONRenderer().render(listed)))
+
+    def test_xlsx(self):
+        workbook = zipfile.ZipFile(io.BytesIO(self.export('xlsx')))
+        self.assertIsNone(workbook.testzip())
+        sheet = workbook.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(sheet.count('<row>'), 31)
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('orders-export', kwargs={'file_format': 'pdf'}))
+        self.assertEqual(response.status_code, 404)
+
+
+class OrderBulkCreateTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='importer')
+
+    def post(self, payload):
+        return self.client.post(reverse('orders'), json.dumps(payload), content_type='application/json')
+
+    def payload(self, count):
+        return [{'user': self.user.pk, 'customer': 'Bulk {}'.format(i), 'amount': i + 1, 'price': '9.99', 'notes': 'Imported'} for i in range(count)]
+
+    def test_single_create(self):
+        response = self.post(self.payload(1)[0])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['data']['customer'], 'Bulk 0')
+
+    def test_bulk_create_in_batches(self):
+        with mock.patch.object(OrderListCreateAPIView, 'bulk_create_batch_size', 50):
+            # users are loaded once for the whole list, then three INSERTs
+            with self.assertNumQueries(1 + 3 + 4):  # + savepoints of the two atomic blocks
+                response = self.post(self.payload(120))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['data'], {'created': 120})
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 120)
+        self.assertIsNotNone(Order.objects.first().date_created)
+
+    def test_per_item_errors(self):
+        payload = self.payload(5)
+        payload[1]['amount'] = 'many'
+        payload[3]['user'] = 999
+        response = self.post(payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['type'], 'ValidationError')
+        self.assertEqual(sorted(response.data['errors']), [1, 3])
+        self.assertEqual(response.data['errors'][3]['user'][0]['code'], 'does_not_exist')
+        self.assertIn('[1] amount:', response.data['message'])
+        self.assertFalse(Order.objects.exists())
+
+    def test_bulk_create_evicts_cached_lists(self):
+        self.assertEqual(self.client.get(reverse('orders')).data['pagination']['count'], 0)
+        self.post(self.payload(3))
+        self.assertEqual(self.client.get(reverse('orders')).data['pagination']['count'], 3)
+
+
+class OrderBulkUpdateDeleteTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(10)
+        Order.objects.update(date_last_updated=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+
+    def request(self, method, body, params=''):
+        return getattr(self.client, method)(reverse('orders-bulk') + params, json.dumps(body), content_type='application/json')
+
+    def test_patch_by_filter_in_one_update(self):
+        # the ids and a single UPDATE, the rest are savepoints of the atomic blocks
+        with self.assertNumQueries(6):
+            response = self.request('patch', {'data': {'notes': 'Shipped'}}, '?amount_max=4')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'], {'updated': 4})
+        self.assertEqual(Order.objects.filter(notes='Shipped').count(), 4)
+        self.assertEqual(Order.objects.filter(date_last_updated__year=2020).count(), 6)
+
+    def test_signal_gets_exactly_the_changed_rows(self):
+        now = timezone.now()
+        # stamped with the same time by another writer
+        other = Order.objects.get(amount=10)
+        Order.objects.filter(pk=other.pk).update(date_last_updated=now)
+        changed = []
+
+        def receiver(queryset, **kwargs):
+            changed.extend(queryset.values_list('amount', flat=True))
+        post_bulk_change.connect(receiver, sender=Order)
+        self.addCleanup(post_bulk_change.disconnect, receiver, sender=Order)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            # the changed rows no longer match the filter
+            self.request('patch', {'data': {'amount': 9}}, '?amount_max=4')
+        self.assertEqual(changed, [9, 9, 9, 9])
+
+    def test_patch_by_ids_and_filter(self):
+        ids = list(Order.objects.filter(amount__lte=5).values_list('id', flat=True))
+        response = self.request('patch', {'ids': ids, 'data': {'price': '1.00'}}, '?customer=Customer 1')
+        self.assertEqual(response.data['data'], {'updated': 1})
+        self.assertEqual(Order.objects.get(price=Decimal('1.00')).customer, 'Customer 1')
+
+    def test_invalid_patch(self):
+        response = self.request('patch', {'ids': [1], 'data': {'amount': 'many'}})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['type'], 'ValidationError')
+        response = self.request('patch', {'data': {'notes': 'All'}})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['type'], 'InvalidData')
+
+    def test_params_that_are_not_filters_select_nothing(self):
+        for params in ['?format=json', '?custmer=x', '?page=1&fields=id', '?archive=include', '?amount_min=']:
+            response = self.request('delete', {}, params)
+            self.assertEqual((response.status_code, response.data['type']), (400, 'InvalidData'), params)
+        response = self.request('delete', {}, '?amount_min=abc')
+        self.assertEqual((response.status_code, response.data['type']), (400, 'ValidationError'))
+        self.assertFalse(Order.objects.filter(deleted=True).exists())
+
+    def test_soft_delete(self):
+        ids = list(Order.objects.values_list('id', flat=True)[:3])
+        response = self.request('delete', {'ids': ids})
+        self.assertEqual(response.data['data'], {'deleted': 3})
+        # already deleted rows are not counted again
+        response = self.request('delete', {}, '?amount_max=10')
+        self.assertEqual(response.data['data'], {'deleted': 7})
+        self.assertEqual(Order.objects.filter(deleted=True).count(), 10)
+
+    def test_detail_view(self):
+        order = Order.objects.first()
+        response = self.client.get(reverse('order', kwargs={'pk': order.pk}))
+        self.assertEqual(response.data['data']['id'], order.pk)
+        self.assertEqual(self.client.get(reverse('orders-bulk')).status_code, 404)
+
+
+class BackgroundJobTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(30)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = self.settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def run_jobs(self):
+        # the worker closes stale connections between jobs, here they hold the test transaction
+        with mock.patch('filters_tutorial_back.common.jobs.close_old_connections'):
+            call_command('run_jobs', processes=1, burst=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+    def get_job(self, response):
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['data']['status'], 'queued')
+        return self.client.get(reverse('job', kwargs={'pk': response.data['data']['id']})).data['data']
+
+    def test_export(self):
+        url = reverse('orders-export', kwargs={'file_format': 'csv'})
+        job = self.get_job(self.client.get(url, {'amount_min': 21, 'ordering': 'amount', 'background': 1}))
+        result = self.client.get(reverse('job-result', kwargs={'pk': job['id']}))
+        self.assertEqual(result.status_code, 202)
+
+        self.run_jobs()
+        job = self.client.get(reverse('job', kwargs={'pk': job['id']})).data['data']
+        self.assertEqual((job['status'], job['progress'], job['total']), ('succeeded', 10, 10))
+        result = self.client.get(job['result_url'])
+        self.assertEqual(result['Content-Disposition'], 'attachment; filename="orders.csv"')
+        inline = self.client.get(url, {'amount_min': 21, 'ordering': 'amount'})
+        self.assertEqual(b''.join(result.streaming_content), b''.join(inline.streaming_content))
+
+    def test_bulk_update(self):
+        body = json.dumps({'data': {'customer': 'Renamed'}})
+        job = self.get_job(self.client.patch(reverse('orders-bulk') + '?amount_max=5&background=1', body, content_type='application/json'))
+        self.assertFalse(Order.objects.filter(customer='Renamed').exists())
+
+        self.run_jobs()
+        self.assertEqual(Order.objects.filter(customer='Renamed').count(), 5)
+        result = self.client.get(reverse('job-result', kwargs={'pk': job['id']}))
+        self.assertEqual((result.status_code, result.json()), (200, {'data': {'updated': 5}}))
+
+    def test_failed_request(self):
+        job = self.get_job(self.client.delete(reverse('orders-bulk') + '?background=1'))
+        self.run_jobs()
+        job = Job.objects.get(pk=job['id'])
+        self.assertEqual((job.status, job.error), ('failed', 'HTTP 400'))
+        self.assertEqual(Order.objects.filter(deleted=True).count(), 0)
+        result = self.client.get(reverse('job-result', kwargs={'pk': job.pk}))
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(result.json()['type'], 'InvalidData')
+
+    def test_reindex(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM sc_order_search')
+        OrderDailySummary.objects.all().delete()
+        response = self.client.post(reverse('jobs'), {'kind': 'orders.reindex', 'params': {'chunk_size': 7}}, content_type='application/json')
+        job = self.get_job(response)
+        self.assertEqual(self.client.post(reverse('jobs'), {'kind': 'request'}, content_type='application/json').status_code, 400)
+
+        self.run_jobs()
+        job = self.client.get(reverse('job', kwargs={'pk': job['id']})).data['data']
+        self.assertEqual((job['status'], job['result']), ('succeeded', {'orders': 30, 'summaries': 3}))
+        self.assertEqual(self.client.get(reverse('orders'), {'q': 'customer 12'}).data['pagination']['count'], 1)
+        self.assertEqual(OrderDailySummary.objects.aggregate(count=Sum('order_count'))['count'], 30)
+
+    def test_claim(self):
+        job = Job.enqueue('orders.reindex')
+        self.assertEqual(Job.claim('a'), job)
+        self.assertIsNone(Job.claim('b'))
+        # the worker died
+        Job.objects.filter(pk=job.pk).update(date_heartbeat=job.date_created - datetime.timedelta(hours=1))
+        self.assertEqual(Job.requeue_stale(60, max_attempts=2), 1)
+        self.assertEqual(Job.claim('b').attempts, 2)
+        Job.objects.filter(pk=job.pk).update(date_heartbeat=job.date_created - datetime.timedelta(hours=1))
+        self.assertEqual(Job.requeue_stale(60, max_attempts=2), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'failed')
+
+
+class ProfilingMiddlewareTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(5)
+
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('orders')))
+
+    @override_settings(PROFILING={'ENABLED': True, 'SLOW_REQUEST_MS': None})
+    def test_server_timing(self):
+        with self.assertLogs('filters_tutorial_back.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('orders'))
+        timings = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertCountEqual(timings, ['total', 'db', 'validators', 'count', 'page', 'serialize', 'render'])
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertEqual((logged['queries'], logged['status'], logged['path']), (2, 200, '/orders/'))
+        self.assertNotIn('sql', logged)
+
+    @override_settings(PROFILING={'ENABLED': True, 'SLOW_REQUEST_MS': 0})
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.assertLogs('filters_tutorial_back.profiling', 'WARNING') as logs:
+            self.client.get(reverse('orders'), {'customer': 'Customer'})
+        logged = logs.records[0].profile
+        self.assertEqual(len(logged['sql']), 2)
+        self.assertIn('COUNT', logged['sql'][0]['sql'])
+
+    @override_settings(PROFILING={'ENABLED': True, 'SAMPLE_RATE': 0})
+    def test_sampling(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('orders')))
+
+
+class SeedOrdersCommandTestCase(OrderTestCase):
+    def seed(self, **options):
+        call_command('seed_orders', stdout=io.StringIO(), **options)
+        return list(Order.objects.order_by('id').values_list('customer', 'amount', 'price', 'deleted', 'user__username'))
+
+    def test_seed(self):
+        rows = self.seed(orders=250, users=20, batch_size=100, seed=7)
+        self.assertEqual(len(rows), 250)
+        self.assertEqual(User.objects.filter(username__startswith='seed7_').count(), 20)
+        self.assertGreater(Order.objects.dates('date_created', 'day').count(), 1)
+        # reproducible
+        Order.objects.all().delete()
+        self.assertEqual(self.seed(orders=250, users=20, batch_size=100, seed=7), rows)
+
+    def test_api_benchmark(self):
+        self.seed(orders=100, users=5)
+        out = io.StringIO()
+        call_command('benchmark', 'api', requests=20, stdout=out)
+        self.assertIn('p95 ms', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('benchmark', 'api', requests=5, max_p95=0, stdout=io.StringIO())
+
+
+class ConnectionTuningTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.name = directory.name + '/tuned.sqlite3'
+        settings_dict = dict(connection.settings_dict, NAME=self.name, TRANSACTION_MODE='IMMEDIATE', PRAGMAS={'journal_mode': 'wal', 'synchronous': 'normal', 'cache_size': -2048})
+        self.tuned = DatabaseWrapper(settings_dict, alias='tuned')
+        self.addCleanup(self.tuned.close)
+
+    def test_pragmas_of_new_connections(self):
+        with self.tuned.cursor() as cursor:
+            self.assertEqual([cursor.execute('PRAGMA {}'.format(name)).fetchone()[0] for name in ('journal_mode', 'synchronous', 'cache_size')], ['wal', 1, -2048])
+        with connection.cursor() as cursor:
+            self.assertNotEqual(cursor.execute('PRAGMA cache_size').fetchone()[0], -2048)
+
+    def test_transactions_take_the_write_lock_when_they_begin(self):
+        with self.tuned.cursor() as cursor:
+            cursor.execute('CREATE TABLE t (id integer)')
+        other = sqlite3.connect(self.name, timeout=0, isolation_level=None)
+        self.addCleanup(other.close)
+        # what atomic() runs when it opens a transaction
+        self.tuned._start_transaction_under_autocommit()
+        self.tuned.cursor().execute('SELECT * FROM t')
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            other.execute('INSERT INTO t VALUES (1)')
+        self.tuned.connection.rollback()
+        other.execute('INSERT INTO t VALUES (1)')
+
+    def test_health_check_closes_unusable_connections(self):
+        connections['default'].settings_dict['CONN_HEALTH_CHECKS'] = True
+        self.addCleanup(connections['default'].settings_dict.pop, 'CONN_HEALTH_CHECKS')
+        with mock.patch.object(DatabaseWrapper, 'is_usable', return_value=False), mock.patch.object(DatabaseWrapper, 'close') as close:
+            request_started.send(sender=self.__class__)
+        close.assert_called()
+
+
+class AsyncListViewTestCase(TransactionTestCase):
+    """
+    The queries run in worker threads with their own connections, so the data has to be committed.
+    """
+
+    def setUp(self):
+        cache.clear()
+        create_orders(15)
+
+    def get(self, path, query_string='', method='GET', headers=(), app=application):
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'root_path': '', 'scheme': 'http',
+            'query_string': query_string.encode(), 'headers': list(headers), 'server': ('testserver', 80),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(app(scope, receive, send))
+        headers = {key.decode(): value.decode() for key, value in messages[0]['headers']}
+        body = messages[1]['body']
+        if headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return messages[0]['status'], headers, json.loads(body) if body else None
+
+    def test_same_response_as_sync_view(self):
+        query_string = 'page=2&page_size=4&ordering=-amount&customer=Customer'
+        status, headers, data = self.get('/async/orders/', query_string)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['X-Cache'], 'MISS')
+        response = self.client.get(reverse('orders') + '?' + query_string)
+        self.assertEqual(data, json.loads(response.content))
+        self.assertEqual(headers['Last-Modified'], response['Last-Modified'])
+        self.assertEqual(data['pagination'], {'count': 15, 'count_exact': True})
+        self.assertEqual(self.get('/async/orders/', query_string)[1]['X-Cache'], 'HIT')
+
+    def test_errors(self):
+        self.assertEqual(self.get('/async/orders/', 'page=5')[0], 404)
+        self.assertEqual(self.get('/async/orders/', 'amount_min=abc')[0], 400)
+        self.assertEqual(self.get('/async/orders/', method='POST')[0], 405)
+
+    def test_other_paginations_and_paths(self):
+        status, headers, data = self.get('/async/orders/', 'cursor=&page_size=10')
+        self.assertEqual((status, len(data['data'])), (200, 10))
+        self.assertEqual(self.get('/async/orders/', 'page=last&page_size=10')[2]['data'][0]['amount'], 5)
+        self.assertEqual(self.get('/orders/', 'page_size=1')[2]['pagination']['count'], 15)
+
+    def test_middleware(self):
+        origin = (b'origin', b'https://shop.example.com')
+        status, headers, data = self.get('/async/orders/', 'page_size=15', headers=[origin, (b'accept-encoding', b'gzip')])
+        self.assertEqual((status, len(data['data'])), (200, 15))
+        self.assertEqual(headers['Access-Control-Allow-Origin'], '*')
+        self.assertEqual(headers['X-Frame-Options'], 'DENY')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+
+        # preflight, answered by the middleware
+        status, headers, _ = self.get('/async/orders/', method='OPTIONS', headers=[origin, (b'access-control-request-method', b'GET')])
+        self.assertEqual(status, 200)
+        self.assertIn('GET', headers['Access-Control-Allow-Methods'])
+
+    @override_settings(PROFILING={'ENABLED': True, 'SLOW_REQUEST_MS': 0})
+    def test_profiled_queries_of_worker_threads(self):
+        # the middleware is loaded with the view
+        app = AsyncListView(OrderListCreateAPIView)
+        with self.assertLogs('filters_tutorial_back.profiling', 'WARNING') as logs:
+            status, headers, _ = self.get('/async/orders/', 'page_size=5', app=app)
+        self.assertEqual(status, 200)
+        # the aggregate of the validators and the page, run concurrently in the default pool
+        self.assertIn('desc="2 queries"', headers['Server-Timing'])
+        self.assertEqual(len(logs.records[0].profile['sql']), 2)
+
+
+class OrderEventStreamTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        create_orders(3)
+        self.orders = list(Order.objects.order_by('id'))
+
+    def stream(self, query_string, *steps, headers=()):
+        """
+        Opens /stream/orders/ and runs the steps, (write, until) pairs: write runs in a thread,
+        the next step waits until the body contains `until`. Returns the status, the headers and the events.
+        """
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/stream/orders/', 'root_path': '', 'scheme': 'http',
+            'query_string': query_string.encode(), 'headers': list(headers), 'server': ('testserver', 80),
+        }
+        messages = []
+
+        async def run():
+            received, disconnected, requested = asyncio.Event(), asyncio.Event(), []
+
+            async def receive():
+                if not requested:
+                    requested.append(True)
+                    return {'type': 'http.request', 'body': b''}
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+                received.set()
+
+            async def wait_for(until):
+                while not messages or until not in b''.join(message.get('body', b'') for message in messages[1:]):
+                    received.clear()
+                    await received.wait()
+
+            task = asyncio.ensure_future(application(scope, receive, send))
+            await asyncio.wait_for(wait_for(b''), 5)
+            for write, until in steps:
+                await sync_to_async(write, thread_sensitive=False)()
+                await asyncio.wait_for(wait_for(until), 5)
+            disconnected.set()
+            await asyncio.wait_for(task, 5)
+
+        asyncio.run(run())
+        headers = {key.decode(): value.decode() for key, value in messages[0]['headers']}
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        events = []
+        for block in body.decode().split('\n\n') if messages[0]['status'] == 200 else ():
+            fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+            if 'event' in fields:
+                events.append((fields['event'], json.loads(fields['data']), fields.get('id')))
+        return messages[0]['status'], headers, events
+
+    def test_matching_changes(self):
+        user = self.orders[0].user
+        acme = []
+
+        def create():
+            # not matching, then matching
+            Order.objects.create(user=user, customer='Globex', amount=1, price=1)
+            acme.append(Order.objects.create(user=user, customer='Acme', amount=2, price=1))
+
+        def update():
+            Order.objects.filter(pk=self.orders[0].pk).update(customer='Acme first')
+            Order.objects.get(pk=self.orders[0].pk).save()
+
+        def remove():
+            acme[0].customer = 'Initech'
+            acme[0].save()
+
+        status, headers, events = self.stream(
+            'customer=acme&fields=customer,amount',
+            (create, b'event: create'), (update, b'event: update'), (remove, b'event: remove'), (lambda: acme[0].delete(), b'event: delete'),
+        )
+        self.assertEqual((status, headers['Content-Type']), (200, 'text/event-stream'))
+        pk = Order.objects.filter(customer='Globex').get().pk + 1
+        self.assertEqual([(name, data) for name, data, _ in events], [
+            ('create', [{'customer': 'Acme', 'amount': 2}]),
+            ('update', [{'customer': 'Acme first', 'amount': 1}]),
+            ('remove', [pk]),
+            ('delete', [pk]),
+        ])
+        self.assertTrue(all(event_id for _, _, event_id in events))
+
+    def test_last_event_id(self):
+        user = self.orders[0].user
+        _, _, events = self.stream('', (lambda: Order.objects.create(user=user, customer='Acme', amount=1, price=1), b'event: create'))
+        last_event_id = events[0][2]
+        Order.objects.create(user=user, customer='Globex', amount=2, price=1)
+
+        # what was missed is sent first
+        _, _, events = self.stream('', (lambda: None, b'Globex'), headers=[(b'last-event-id', last_event_id.encode())])
+        self.assertEqual([data[0]['customer'] for _, data, _ in events], ['Globex'])
+        # unknown (e.g. from before a restart)
+        _, _, events = self.stream('', (lambda: None, b'event: reset'), headers=[(b'last-event-id', b'0-1')])
+        self.assertEqual(events, [('reset', {}, None)])
+
+    def test_bulk_changes(self):
+        def write():
+            self.client.patch(reverse('orders-bulk') + '?customer=Customer 1', json.dumps({'data': {'amount': 9}}), content_type='application/json')
+
+        _, _, events = self.stream('amount_min=5', (write, b'event: update'))
+        self.assertEqual([(name, [row['id'] for row in data]) for name, data, _ in events], [('update', [self.orders[1].pk])])
+
+    def test_invalid_filters(self):
+        status, _, events = self.stream('amount_min=abc')
+        self.assertEqual((status, events), (400, []))
+
+    def test_middleware(self):
+        status, headers, _ = self.stream('', headers=[(b'origin', b'https://shop.example.com'), (b'accept-encoding', b'gzip')])
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Access-Control-Allow-Origin'], '*')
+        self.assertEqual(headers['X-Frame-Options'], 'DENY')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Cache-Control'], 'no-cache')
+
+
+class OrderSearchTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='jdoe', first_name='Jane', last_name='Doe')
+        Order.objects.bulk_create([
+            Order(user=self.user, customer='Acme Widgets', amount=1, price=1, notes='Urgent delivery'),
+            Order(user=self.user, customer='Globex', amount=2, price=1, notes='Acme parts inside'),
+            Order(user=self.user, customer='Initech', amount=3, price=1, notes='Nothing special'),
+        ])
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('orders'), dict(params, q=q))
+        self.assertEqual(response.status_code, 200)
+        return [order['customer'] for order in response.data['data']]
+
+    def test_ranked_search_over_customer_and_notes(self):
+        self.assertEqual(self.search('acme'), ['Acme Widgets', 'Globex'])
+        self.assertEqual(self.search('acm'), ['Acme Widgets', 'Globex'])
+        self.assertEqual(self.search('acme', ordering='amount'), ['Acme Widgets', 'Globex'])
+        self.assertEqual(self.search('acme', ordering='-amount'), ['Globex', 'Acme Widgets'])
+        self.assertEqual(self.search('urgent acme'), ['Acme Widgets'])
+        self.assertEqual(self.search('"acme* ('), ['Acme Widgets', 'Globex'])
+        self.assertEqual(len(self.search('  ')), 3)
+
+    def test_index_follows_writes(self):
+        self.assertEqual(len(self.search('jane doe')), 3)
+        order = Order.objects.get(customer='Initech')
+        order.notes = 'Acme again'
+        order.save()
+        self.assertEqual(len(self.search('acme')), 3)
+        Order.objects.filter(customer='Globex').delete()
+        self.assertEqual(self.search('acme'), ['Acme Widgets', 'Initech'])
+        self.user.first_name = 'Janet'
+        self.user.save()
+        self.assertEqual(len(self.search('janet')), 2)
+        self.assertEqual(self.search('jane'), self.search('janet'))
+        self.assertEqual(self.search('jdoe', customer='Init'), ['Initech'])
+
+
+class OrderAggregatesTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(12)
+        for order in Order.objects.all():
+            Order.objects.filter(pk=order.pk).update(date_created=datetime.datetime(2020, 1, 1 + order.amount % 3, 12, tzinfo=datetime.timezone.utc))
+
+    def aggregates(self, source, **params):
+        response = self.client.get(reverse('orders-aggregates'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Aggregate-Source'], source)
+        return response.data['data']
+
+    maxDiff = None
+
+    def assert_summary_matches_orders(self):
+        expected = Order.objects.order_by().values('user', 'deleted', 'date_created__date').annotate(count=Count('id'), amount=Sum('amount'), price=Sum('price'))
+        summary = OrderDailySummary.objects.values('user', 'deleted', 'day', 'order_count', 'amount_sum', 'price_sum')
+        self.assertCountEqual(
+            [(row['user'], row['deleted'], row['day'], row['order_count'], row['amount_sum'], row['price_sum']) for row in summary],
+            [(row['user'], row['deleted'], row['date_created__date'], row['count'], row['amount'], row['price']) for row in expected],
+        )
+
+    def test_totals_and_groups_from_summary(self):
+        self.assertEqual(self.aggregates('summary'), [{
+            'count': 12, 'amount_sum': 78, 'price_sum': Decimal('192.00'), 'amount_avg': 6.5, 'price_avg': Decimal('16.00')
+        }])
+        days = self.aggregates('summary', group_by='day', day_after='2020-01-02', username='user')
+        self.assertEqual([(row['day'], row['count']) for row in days], [(datetime.date(2020, 1, 2), 4), (datetime.date(2020, 1, 3), 4)])
+        by_user = self.aggregates('summary', group_by='user,day', deleted='false', user__first_name='First1')
+        self.assertEqual(sum(row['count'] for row in by_user), 4)
+        self.assertEqual({row['user'] for row in by_user}, {User.objects.get(username='user1').pk})
+
+    def test_other_filters_and_groups_query_orders(self):
+        days = self.aggregates('query', group_by='day', amount_min=5)
+        self.assertEqual(days, self.aggregates('query', group_by='day', amount_min=5, ordering='-price'))
+        self.assertEqual(sum(row['count'] for row in days), 8)
+        customers = self.aggregates('query', group_by='customer', customer='Customer 1')
+        self.assertEqual([row['customer'] for row in customers], ['Customer 1', 'Customer 10', 'Customer 11'])
+        response = self.client.get(reverse('orders-aggregates'), {'group_by': 'day,unknown'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_summary_follows_writes(self):
+        self.assert_summary_matches_orders()
+        order = Order.objects.get(amount=1)
+        order.price = Decimal('99.99')
+        order.user = User.objects.get(username='user2')
+        order.save()
+        Order.objects.get(amount=2).delete()
+        self.client.patch(reverse('orders-bulk') + '?amount_max=4', json.dumps({'data': {'amount': 7}}), content_type='application/json')
+        self.client.delete(reverse('orders-bulk') + '?amount_min=10')
+        self.assert_summary_matches_orders()
+        self.assertEqual(self.aggregates('summary', deleted='true')[0]['count'], 3)
+        self.assertEqual(self.aggregates('summary', deleted='false')[0]['amount_sum'], 7 * 3 + sum(range(5, 10)))
+
+
+@mock.patch('order.models.TRIGGER_VENDORS', ())
+class OrderWithoutTriggersTestCase(OrderTestCase):
+    """
+    Databases the migrations install no triggers on, taken for one by patching TRIGGER_VENDORS.
+    """
+
+    def setUp(self):
+        super().setUp()
+        create_orders(12)
+
+    def test_search_uses_icontains(self):
+        response = self.client.get(reverse('orders'), {'q': 'first1 ustomer'})
+        self.assertEqual([order['customer'] for order in response.data['data']], ['Customer 10', 'Customer 7', 'Customer 4', 'Customer 1'])
+
+    def test_aggregates_read_the_orders(self):
+        OrderDailySummary.objects.all().delete()
+        response = self.client.get(reverse('orders-aggregates'))
+        self.assertEqual((response['X-Aggregate-Source'], response.data['data'][0]['count']), ('query', 12))
+
+    def test_tombstones_are_written_by_signals(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER sc_order_tombstone_delete')
+        order = Order.objects.first()
+        pk = order.pk
+        order.delete()
+        self.assertEqual(list(OrderTombstone.objects.values_list('order_id', flat=True)), [pk])
+
+    def test_migrations_and_reindex_skip_the_triggers(self):
+        schema_editor = mock.Mock(connection=mock.Mock(vendor='mysql'))
+        for name, operation in [
+            ('0005_order_search', 'create_search_index'),
+            ('0006_order_daily_summary', 'create_summary_triggers'),
+            ('0008_order_tombstone', 'create_tombstone_trigger'),
+            ('0011_order_daily_summary_archived', 'create_summary_triggers'),
+        ]:
+            with self.assertLogs('order.migrations.' + name, 'WARNING'):
+                getattr(import_module('order.migrations.' + name), operation)(None, schema_editor)
+        archive = import_module('order.migrations.0009_order_archive')
+        archive.create_archive_view(None, schema_editor)
+        archive.drop_archive_view(None, schema_editor)
+        # the view alone
+        self.assertEqual(schema_editor.execute.call_count, 2)
+
+        with self.assertLogs('order.jobs', 'WARNING'):
+            self.assertEqual(reindex_orders(None), {'orders': 12, 'summaries': 0})
+
+
+class OrderSparseFieldsetTestCase(OrderTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orders(5)
+
+    def get(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('orders'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['data'], context.captured_queries[-1]['sql']
+
+    def test_fields_trim_select_and_payload(self):
+        data, sql = self.get(fields='id,customer,price')
+        self.assertEqual(list(data[0]), ['id', 'customer', 'price'])
+        self.assertNotIn('notes', sql)
+        self.assertNotIn('JOIN', sql)
+
+        data, sql = self.get(fields='id,user')
+        self.assertEqual(data[0], {'id': data[0]['id'], 'user': Order.objects.get(pk=data[0]['id']).user_id})
+        self.assertNotIn('JOIN', sql)
+
+        data, sql = self.get(fields='customer', expand='user')
+        self.assertEqual(data[0]['user'], {'username': 'user1', 'first_name': 'First1', 'last_name': 'Last1'})
+        self.assertEqual(list(data[0]), ['customer', 'user'])
+        self.assertIn('JOIN', sql)
+        # the full representation stays the default
+        self.assertEqual(self.get()[0], self.get(expand='user')[0])
+
+    def test_invalid_names(self):
+        response = self.client.get(reverse('orders'), {'fields': 'id,secret', 'expand': 'customer'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'fields', 'expand'})
+
+    def test_export_and_model_serializer(self):
+        response = self.client.get(reverse('orders-export', kwargs={'file_format': 'ndjson'}), {'fields': 'id,amount'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(rows[0], {'id': rows[0]['id'], 'amount': 5})
+
+        fieldset = Fieldset(('amount',), ('user',))
+        queryset = optimize_queryset(Order.objects.all(), OrderSerializer, fieldset)
+        with self.assertNumQueries(1):
+            data = OrderSerializer(queryset, many=True, context={'fieldset': fieldset}).data
+        self.assertEqual(data[0], {'amount': 5, 'user': {'username': 'user1', 'first_name': 'First1', 'last_name': 'Last1'}})
+        self.assertEqual(queryset.query.deferred_loading, ({'id', 'amount', 'user', 'user__id', 'user__username', 'user__first_name', 'user__last_name'}, False))
@@ -1,7 +1,18 @@
 from django.urls import path
 
-from order.views import OrderListCreateAPIView
+from order.views import (
+    JobListCreateAPIView, JobResultAPIView, JobRetrieveDestroyAPIView, OrderAggregateAPIView, OrderChangesAPIView,
+    OrderExportAPIView, OrderListCreateAPIView, OrderRetrieveUpdateDestroyAPIView
+)
 
 urlpatterns = [
-    path('orders/', OrderListCreateAPIView.as_view(), name='orders')
+    path('orders/', OrderListCreateAPIView.as_view(), name='orders'),
+    path('orders/<int:pk>/', OrderRetrieveUpdateDestroyAPIView.as_view(), name='order'),
+    path('orders/bulk/', OrderRetrieveUpdateDestroyAPIView.as_view(), name='orders-bulk'),
+    path('orders/aggregates/', OrderAggregateAPIView.as_view(), name='orders-aggregates'),
+    path('orders/export/<str:file_format>/', OrderExportAPIView.as_view(), name='orders-export'),
+    path('orders/changes/', OrderChangesAPIView.as_view(), name='orders-changes'),
+    path('jobs/', JobListCreateAPIView.as_view(), name='jobs'),
+    path('jobs/<int:pk>/', JobRetrieveDestroyAPIView.as_view(), name='job'),
+    path('jobs/<int:pk>/result/', JobResultAPIView.as_view(), name='job-result'),
 ]
@@ -1,14 +1,144 @@
-from filters_tutorial_back.common.api_views import CustomListAPIView
-from order.filters import OrderFilter
-from order.models import Order
-from order.serializers import OrderSerializer
+from django.contrib.auth.models import User
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
 
+from filters_tutorial_back.common.api_views import (
+    AggregateSource, CustomAggregateAPIView, CustomChangesAPIView, CustomExportAPIView, CustomJobResultAPIView,
+    CustomListCreateAPIView, HRMRetrieveUpdateDestroyAPIView
+)
+from filters_tutorial_back.common.exceptions import APIException202
+from filters_tutorial_back.common.cache import normalize_cleaned_data
+from order.filters import OrderAggregateFilter, OrderDailySummaryFilter, OrderFilter
+from order.models import Job, Order, OrderDailySummary, OrderTombstone, OrderWithArchive, has_triggers
+from order.serializers import JobSerializer, OrderSerializer, OrderValuesSerializer, OrderWriteSerializer
 
-class OrderListCreateAPIView(CustomListAPIView):
+
+class OrderArchiveMixin:
+    """
+    GET requests read archived orders as well when their filters need them, see OrderFilter.get_source_queryset().
+    """
+
+    def get_queryset(self, **kwargs):
+        if self.request.method == 'GET' and '_source_queryset' not in self.__dict__:
+            self._source_queryset = None
+            filterset = self.get_request_filterset(self.request, Order.objects.all())
+            if filterset is not None and filterset.is_valid():
+                self._source_queryset = filterset.get_source_queryset()
+        if getattr(self, '_source_queryset', None) is not None:
+            self.queryset = self._source_queryset
+        return super().get_queryset(**kwargs)
+
+
+class OrderListCreateAPIView(OrderArchiveMixin, CustomListCreateAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    read_serializer_class = OrderSerializer
+    write_serializer_class = OrderWriteSerializer
+    values_serializer_class = OrderValuesSerializer
     filterset_class = OrderFilter
     ordering_fields = ['id', 'customer', 'amount', 'price', 'date_created', 'user__first_name', 'user__last_name', 'deleted']
+    # sorted on the copies of the user's names, without a join
+    ordering_aliases = {'user__first_name': 'user_first_name', 'user__last_name': 'user_last_name'}
+    cache_models = [Order, User]
+    last_modified_field = 'date_last_updated'
 
     def get_filterset(self, request, queryset, view):
         pass
+
+
+class OrderRetrieveUpdateDestroyAPIView(HRMRetrieveUpdateDestroyAPIView):
+    queryset = Order.objects.all()
+    serializer_class = OrderSerializer
+    read_serializer_class = OrderSerializer
+    write_serializer_class = OrderWriteSerializer
+    filterset_class = OrderFilter
+    bulk_unselective_filters = ['archive']
+    # the user's names in the representation move date_last_updated too (OrderQuerySet.sync_user_names)
+    last_modified_field = 'date_last_updated'
+    job_model = Job
+    job_serializer_class = JobSerializer
+
+
+class OrderExportAPIView(OrderArchiveMixin, CustomExportAPIView):
+    queryset = Order.objects.all()
+    serializer_class = OrderSerializer
+    values_serializer_class = OrderValuesSerializer
+    filterset_class = OrderFilter
+    ordering_fields = OrderListCreateAPIView.ordering_fields
+    ordering_aliases = OrderListCreateAPIView.ordering_aliases
+    export_filename = 'orders'
+    job_model = Job
+    job_serializer_class = JobSerializer
+
+
+class OrderChangesAPIView(CustomChangesAPIView):
+    queryset = Order.objects.all()
+    serializer_class = OrderSerializer
+    values_serializer_class = OrderValuesSerializer
+    last_modified_field = 'date_last_updated'
+    tombstone_model = OrderTombstone
+    tombstone_id_field = 'order_id'
+
+
+class OrderAggregateAPIView(OrderArchiveMixin, CustomAggregateAPIView):
+    queryset = Order.objects.all()
+    filterset_class = OrderAggregateFilter
+    cache_models = [Order, User]
+    aggregate_groups = {'customer': 'customer', 'user': 'user', 'day': TruncDate('date_created')}
+    aggregate_fields = ['amount', 'price']
+    summary_groups = ['user', 'day']
+
+    def get_aggregate_source(self, request, group_by):
+        """
+        Requests that only group and filter by user, day and deleted are answered from
+        OrderDailySummary, which has a row per user and day instead of one per order.
+        Its archived rows count when the query would read the archive too (OrderArchiveMixin).
+        Databases without its triggers (see TRIGGER_VENDORS) always aggregate the orders.
+        """
+        if set(group_by) <= set(self.summary_groups) and has_triggers(OrderDailySummary.objects.db):
+            filterset = self.get_request_filterset(request)
+            if filterset.is_valid():
+                used = {name for name, value in normalize_cleaned_data(filterset.form.cleaned_data)}
+                if used <= set(OrderDailySummaryFilter.base_filters) | {'archive'}:
+                    summaries = OrderDailySummary.objects.all()
+                    if self.get_queryset().model is not OrderWithArchive:
+                        summaries = summaries.filter(archived=False)
+                    queryset = OrderDailySummaryFilter(data=request.query_params, queryset=summaries, request=request).qs
+                    totals = {'count': Sum('order_count'), 'amount_sum': Sum('amount_sum'), 'price_sum': Sum('price_sum')}
+                    return AggregateSource('summary', queryset, {name: name for name in group_by}, totals)
+        return super().get_aggregate_source(request, group_by)
+
+
+class JobListCreateAPIView(CustomListCreateAPIView):
+    """
+    Jobs and their progress. Exports and bulk changes are submitted with ?background=1 on their
+    own endpoint, the kinds below with a POST of `kind` and `params`.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    read_serializer_class = JobSerializer
+    write_serializer_class = JobSerializer
+    filterset_fields = ['status', 'kind']
+    ordering_fields = ['id', 'date_created']
+    job_kinds = ['orders.reindex', 'orders.prune_tombstones', 'orders.archive']
+
+    def perform_create(self, serializer):
+        serializer.save()
+        raise APIException202('Puna u shtua në radhë', serializer.data)
+
+
+class JobRetrieveDestroyAPIView(HRMRetrieveUpdateDestroyAPIView):
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    read_serializer_class = JobSerializer
+    http_method_names = ['get', 'delete', 'head', 'options']
+
+    def perform_destroy(self, instance):
+        if instance.result_file:
+            instance.result_file.delete(save=False)
+        instance.delete()
+
+
+class JobResultAPIView(CustomJobResultAPIView):
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer